@@ -1,120 +1,413 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, g, make_response
+from flask import before_render_template, template_rendered
+from contextlib import contextmanager
+import click
+import cProfile
+import io
+import itertools
 import json
+import math
 import os
 import random
 import time
 import threading
-from werkzeug.security import generate_password_hash, check_password_hash
+from question_bank import create_question_bank
+from question_io import FORMATS, detect_format, export_lines, import_questions
+from question_sampler import QuestionSampler
+from match_log import MatchLog, RecordedEvents, REPLAYED_TYPES, match_stats, room_history, read_events
+from matchmaking import MatchPolicy, Matchmaker, elo_changes
+from room import Room, RoomStateError, TIMED_OUT, ANSWER_GRACE_SECONDS
+from room_store import create_room_store, RoomExpiryPolicy
+from http_cache import PageCache, ResponseCompressor
+from leaderboard import Leaderboard
+from room_events import RoomEventHub
+from room_snapshot import RoomSnapshotter
+from spectators import SpectatorHub
+from timers import TimerScheduler
+from user_store import create_user_store, ScoreWriter, DEFAULT_RATING
+from metrics import REGISTRY
+from passwords import LoginThrottle, PasswordHasher, PasswordHasherBusy
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey123!@#'
 app.config['SESSION_PERMANENT'] = False
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
+# پروفایل درخواست‌های کند (اختیاری): از هر درخواست با احتمال SAMPLE_RATE پروفایل
+# گرفته می‌شود و اگر بیش از THRESHOLD_MS طول بکشد آمار cProfile در PROFILE_DIR ذخیره می‌شود
+app.config['PROFILE_SLOW_REQUESTS'] = os.environ.get('QUIZ_PROFILE') == '1'
+app.config['PROFILE_THRESHOLD_MS'] = 500
+app.config['PROFILE_SAMPLE_RATE'] = 0.1
+app.config['PROFILE_DIR'] = 'profiles'
+# فایل‌های static (مثل logo.png) با ETag و Last-Modified فرستاده می‌شوند و
+# مرورگر تا یک ساعت بدون درخواست دوباره از کش استفاده می‌کند
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 3600
 
 # فایل‌های دیتابیس
 USERS_FILE = 'users.json'
 QUESTIONS_FILE = 'questions.json'
 
+# کاربران: 'sqlite' (پیش‌فرض، با انتقال یک‌باره از users.json) یا 'json'
+USER_STORE_BACKEND = os.environ.get('QUIZ_USER_STORE', 'sqlite')
+USERS_DB_FILE = os.environ.get('QUIZ_USERS_DB', 'users.db')
+# امتیاز مسابقه‌های تمام‌شده هر نیم ثانیه یا هر ۱۰۰ مسابقه یک‌جا ذخیره می‌شود
+SCORE_FLUSH_INTERVAL = 0.5
+SCORE_FLUSH_BATCH = 100
+
+# هش رمز عبور در پروسه‌های جدا (با gunicorn برای هر worker)؛ 0 یعنی روی همان
+# thread درخواست. بیش از PASSWORD_HASH_QUEUE درخواست در صف پاسخ «دوباره تلاش
+# کنید» می‌گیرد. با تغییر روش یا هزینه‌ی هش، رمز هر کاربر در ورود بعدی دوباره هش می‌شود.
+PASSWORD_HASH_METHOD = os.environ.get('QUIZ_PASSWORD_HASH', 'scrypt')
+PASSWORD_HASH_WORKERS = int(os.environ.get('QUIZ_HASH_WORKERS', str(os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE = int(os.environ.get('QUIZ_HASH_QUEUE', '32'))
+# ورود ناموفق: حداکثر ۵ بار برای هر نام کاربری و ۲۰ بار برای هر IP در ۵ دقیقه
+LOGIN_FAILURE_LIMITS = {'user': 5, 'ip': 20}
+LOGIN_FAILURE_WINDOW = 300
+
+# سؤالات: 'sqlite' (پیش‌فرض، با انتقال یک‌باره از questions.json) یا 'json'
+QUESTION_STORE_BACKEND = os.environ.get('QUIZ_QUESTION_STORE', 'sqlite')
+QUESTIONS_DB_FILE = os.environ.get('QUIZ_QUESTIONS_DB', 'questions.db')
+
+# تعداد ردیف در هر صفحه‌ی فهرست‌های مدیریتی
+ADMIN_PAGE_SIZE = 50
+
+# وضعیت اتاق‌ها: 'memory' برای یک پروسه، 'sqlite' برای چند worker در gunicorn
+ROOM_STORE_BACKEND = os.environ.get('QUIZ_ROOM_STORE', 'memory')
+ROOMS_DB_FILE = os.environ.get('QUIZ_ROOMS_DB', 'rooms.db')
+# در حالت memory، اتاق‌ها و صف انتظار هر چند ثانیه در این فایل ذخیره و هنگام
+# راه‌اندازی دوباره بازیابی می‌شوند؛ مقدار خالی یعنی بدون snapshot
+ROOM_SNAPSHOT_FILE = os.environ.get('QUIZ_ROOM_SNAPSHOT', 'rooms-snapshot.db')
+ROOM_SNAPSHOT_INTERVAL = float(os.environ.get('QUIZ_ROOM_SNAPSHOT_SECONDS', '2'))
+# با debug=True پروسه‌ی ناظر reloader هم app.py را اجرا می‌کند ولی درخواستی
+# نمی‌گیرد؛ فقط پروسه‌ی فرزند (WERKZEUG_RUN_MAIN) start_server را صدا می‌زند
+RELOADER_PARENT = __name__ == '__main__' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
+
+# رویدادهای همه‌ی مسابقه‌ها (JSON Lines، فقط اضافه می‌شود)؛ مقدار خالی یعنی بدون گزارش.
+# تحلیل با `flask match-stats` و بازاجرای یک مسابقه با `flask replay-match`
+MATCH_LOG_FILE = os.environ.get('QUIZ_MATCH_LOG', 'match-events.jsonl')
+
+# جدول امتیازات در حافظه نگه داشته می‌شود؛ با چند worker (room store از نوع sqlite)
+# هر worker فقط مسابقه‌های خودش را می‌بیند، پس هر چند ثانیه دوباره از user_store
+# خوانده می‌شود (0 یعنی هرگز)
+LEADERBOARD_RELOAD_SECONDS = float(os.environ.get(
+    'QUIZ_LEADERBOARD_RELOAD_SECONDS', '60' if ROOM_STORE_BACKEND == 'sqlite' else '0'))
+LEADERBOARD_PAGE_SIZE = 50
+
+# سؤال‌های پاسخ‌داده‌شده‌ی هر بازیکن (completed_questions) در حافظه نگه داشته و
+# پس از این چند ثانیه دوباره خوانده می‌شوند تا پاسخ‌های workerهای دیگر هم دیده شوند
+QUESTION_HISTORY_TTL = 30 if ROOM_STORE_BACKEND == 'sqlite' else 600
+QUESTION_HISTORY_CACHE_SIZE = 10000
+
+# انقضای اتاق‌ها (ثانیه): بر اساس آخرین فعالیت و وضعیت اتاق، حداکثر یک ساعت
+ROOM_IDLE_TTL = 600
+ROOM_IN_PROGRESS_TTL = 900
+ROOM_FINISHED_TTL = 300
+ROOM_MAX_AGE = 3600
+ROOM_REAP_INTERVAL = 5
+
+# جفت‌سازی بر اساس رتبه‌ی Elo: صف هر بازه‌ی ۱۰۰ امتیازی جداست؛ بازیکن ابتدا
+# حریفی تا ۱۰۰ امتیاز اختلاف می‌پذیرد، هر ثانیه انتظار ۲۰ امتیاز به این بازه
+# اضافه می‌شود و پس از MATCH_MAX_WAIT ثانیه هر حریفی پذیرفته می‌شود
+MATCH_BUCKET_WIDTH = 100
+MATCH_INITIAL_WINDOW = 100
+MATCH_WIDEN_PER_SECOND = 20
+MATCH_MAX_WAIT = 30
+MATCH_SWEEP_INTERVAL = 1
+RATING_K = 32
+
+# Server-Sent Events: فاصله‌ی keepalive و بازبینی وضعیت. در حالت sqlite تغییراتی
+# که workerهای دیگر می‌دهند اعلان نمی‌شوند، پس وضعیت زودتر بازبینی می‌شود.
+SSE_KEEPALIVE_SECONDS = 15
+SSE_RECHECK_SECONDS = 1 if ROOM_STORE_BACKEND == 'sqlite' else SSE_KEEPALIVE_SECONDS
+# تماشاگری که این تعداد وضعیت ارسال‌نشده دارد قطع می‌شود (EventSource دوباره وصل می‌شود)
+SPECTATOR_QUEUE_FRAMES = 8
+
+# متریک‌ها (در /admin/metrics)
+REQUEST_SECONDS = REGISTRY.histogram('quiz_request_duration_seconds', 'Request latency by route', ['endpoint', 'method'])
+LOCK_WAIT_SECONDS = REGISTRY.histogram('quiz_game_lock_wait_seconds', 'Time waiting for the GameManager store lock', ['method'])
+LOCK_HOLD_SECONDS = REGISTRY.histogram('quiz_game_lock_hold_seconds', 'Time holding the GameManager store lock', ['method'])
+ROOM_UPDATE_SECONDS = REGISTRY.histogram('quiz_room_update_seconds', 'Duration of GameManager.update_room')
+ROOMS_REAPED = REGISTRY.counter('quiz_rooms_reaped_total', 'Rooms removed by the expiry reaper', ['reason'])
+PASSWORD_HASH_SECONDS = REGISTRY.histogram('quiz_password_hash_seconds', 'Password hashing time', ['op'])
+PASSWORD_HASH_REJECTED = REGISTRY.counter('quiz_password_hash_rejected_total', 'Requests refused because the hash pool queue was full', ['endpoint'])
+LOGINS_THROTTLED = REGISTRY.counter('quiz_logins_throttled_total', 'Login attempts refused after too many failures')
+TEMPLATE_RENDER_SECONDS = REGISTRY.histogram('quiz_template_render_seconds', 'Template render time', ['template'])
+ANSWER_SECONDS = REGISTRY.histogram('quiz_answer_seconds', 'Time from showing a question to its answer', ['outcome'],
+                                    buckets=(1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180))
+TOPICS_AUTO_SELECTED = REGISTRY.counter('quiz_topics_auto_selected_total', 'Rounds whose topic was picked after the selection deadline')
+MATCH_WAIT_SECONDS = REGISTRY.histogram('quiz_matchmaking_wait_seconds', 'Time from joining the queue to being matched', ['bucket'],
+                                        buckets=(0.5, 1, 2, 5, 10, 15, 20, 30, 45, 60, 120, 300))
+
 # مدیریت اتاق‌های بازی
 class GameManager:
-    def __init__(self):
-        self.waiting_players = []
-        self.rooms = {}
-        self.room_counter = 0
-        self.lock = threading.Lock()
+    def __init__(self, store, events, matchmaker, timers):
+        self.store = store
+        self.events = events
+        self.matchmaker = matchmaker
+        # مهلت‌های بازیکنان همه‌ی اتاق‌ها روی همین یک زمان‌بند
+        self.timers = timers
+        # rating_of(player) -> رتبه‌ی فعلی؛ پس از ساخته شدن user_store مقدار می‌گیرد
+        self.rating_of = lambda player: DEFAULT_RATING
+        self.reaped_counts = {'idle': 0, 'in_progress': 0, 'finished': 0}
+        # listener(room_id, room.to_dict()) یک بار برای هر اتاقی که به وضعیت finished می‌رسد
+        self.finish_listeners = []
+        # listener(room_id, player, question_id) برای هر سؤالی که بازیکن جواب داده یا وقتش گذشته
+        self.answer_listeners = []
+        # match_log.MatchLog یا None؛ هر تغییر ثبت‌شده‌ی اتاق در آن نوشته می‌شود
+        self.match_log = None
+
+    # قفل/تراکنش store همراه با ثبت زمان انتظار و نگه‌داشتن
+    @contextmanager
+    def locked(self, method):
+        start = time.perf_counter()
+        with self.store.transaction():
+            acquired = time.perf_counter()
+            LOCK_WAIT_SECONDS.observe(acquired - start, method=method)
+            try:
+                yield
+            finally:
+                LOCK_HOLD_SECONDS.observe(time.perf_counter() - acquired, method=method)
 
     def find_match(self, current_player):
-        with self.lock:
+        with self.locked('find_match'):
             # 1. ابتدا بررسی می‌کنیم که آیا بازیکن در حال حاضر در یک اتاق فعال است یا خیر
-            for room_id, room in list(self.rooms.items()):
-                if current_player in room['players']:
-                    if room['status'] == 'finished':
-                        del self.rooms[room_id]
-                    else:
-                        return {'status': 'found_match', 'room_id': room_id}
-
-            # 2. جفت‌سازی هوشمند
-            if current_player not in self.waiting_players:
-                self.waiting_players.append(current_player)
-
-            if len(self.waiting_players) >= 2:
-                player1 = self.waiting_players.pop(0)
-                player2 = self.waiting_players.pop(0)
-                room_id = self.create_room(player1, player2)
-                return {'status': 'found_match', 'room_id': room_id}
+            room_id = self.store.room_of(current_player)
+            while room_id is not None:
+                room, _ = self.store.get(room_id)
+                if room is not None and room.status != 'finished':
+                    return {'status': 'found_match', 'room_id': room_id}
+                self.store.delete(room_id)
+                room_id = self.store.room_of(current_player)
+
+            # 2. جفت‌سازی بر اساس رتبه؛ بازیکنانی که جفت نشوند با بازتر شدن
+            # بازه‌شان در match_waiting() جفت می‌شوند
+            now = time.time()
+            self.matchmaker.enqueue(self.store, current_player, self.rating_of, now)
+            match = self.matchmaker.find_opponent(self.store, current_player, now)
+            if match:
+                return {'status': 'found_match', 'room_id': self.create_matched_room(match, now)}
 
             return {'status': 'waiting'}
 
     def add_to_queue(self, player):
-        with self.lock:
-            if player not in self.waiting_players:
-                self.waiting_players.append(player)
+        with self.locked('add_to_queue'):
+            self.matchmaker.enqueue(self.store, player, self.rating_of, time.time())
+
+    # جفت کردن بازیکنانی که بازه‌ی جستجویشان از آخرین درخواست باز شده است
+    def match_waiting(self):
+        with self.locked('match_waiting'):
+            now = time.time()
+            matches = self.matchmaker.sweep(self.store, now)
+            for match in matches:
+                self.create_matched_room(match, now)
+        return len(matches)
+
+    # match: ((player, rating, enqueued_at), (opponent, rating, enqueued_at))
+    def create_matched_room(self, match, now):
+        for player, rating, enqueued_at in match:
+            bucket = self.matchmaker.policy.bucket_label(self.matchmaker.policy.bucket(rating))
+            MATCH_WAIT_SECONDS.observe(now - enqueued_at, bucket=bucket)
+        (player1, rating1, _), (player2, rating2, _) = match
+        return self.create_room(player1, player2, (rating1, rating2))
     
     def remove_from_queue(self, player):
-        with self.lock:
-            if player in self.waiting_players:
-                self.waiting_players.remove(player)
+        with self.locked('remove_from_queue'):
+            self.store.remove_waiting(player)
 
-    def create_room(self, player1, player2):
-        room_id = f"room_{self.room_counter}"
-        self.room_counter += 1
-        
-        self.rooms[room_id] = {
-            'players': [player1, player2],
-            'scores': {player1: 0, player2: 0},
-            'turn': random.choice([player1, player2]),
-            'total_rounds': 6,
-            'current_round': 0,
-            'questions': {},
-            'questions_answered_count': {player1: 0, player2: 0},
-            'status': 'waiting_for_topic_selection',
-            'current_topic': '',
-            'current_level': 0,
-            'created_at': time.time(),
-            'used_combinations': {
-                player1: [],
-                player2: []
-            },
-            'used_10_point_question': {
-                player1: False,
-                player2: False
-            },
-            'used_remove_two': {
-                player1: 0,
-                player2: 0
-            },
-            'question_start_time': 0,
-            'current_question_index': 0
-        }
-        self.cleanup_old_rooms()
+    def get_room(self, room_id):
+        room, _ = self.store.get(room_id)
+        return room
+
+    # همه‌ی تغییرات اتاق از این مسیر انجام می‌شود: mutate یک room.Room می‌گیرد و
+    # یکی از انتقال‌های آن را صدا می‌زند. قفل فقط مربوط به همان اتاق است (یا
+    # compare-and-set در حالت چند پروسه‌ای)، پس اتاق‌های مختلف موازی پیش می‌روند.
+    # RoomStateError یعنی انتقال در وضعیت فعلی مجاز نبود و چیزی تغییر نکرده است.
+    # event: رویداد گزارش مسابقه برای همین تغییر (match_log)؛ پایان دور و مسابقه
+    # خودکار ثبت می‌شوند.
+    def update_room(self, room_id, mutate, event=None):
+        finished = []
+        deadlines = []
+        outcomes = []
+
+        # touch may run again after a lost compare-and-set; only the attempt
+        # that was stored decides whether this call finished the room, which
+        # new deadlines get a timer and what goes to the match log.
+        def touch(room):
+            status = room.status
+            before = list(room.deadlines)
+            result = mutate(room)
+            room.last_activity = time.time()
+            room.transitions += 1
+            finished[:] = [room.to_dict()] if status != 'finished' and room.status == 'finished' else []
+            deadlines[:] = [(deadline, player) for player, deadline, old
+                            in zip(room.players, room.deadlines, before) if deadline and deadline != old]
+            outcomes[:] = [event] if event else []
+            if room.status != status and room.status == 'waiting_for_topic_selection':
+                outcomes.append({'type': 'round_advanced', 'round': room.current_round, 'turn': room.turn})
+            elif room.status != status and room.status == 'finished':
+                outcomes.append({'type': 'finished', 'scores': list(room.scores)})
+                if status == 'in_progress':
+                    outcomes[-1]['round'] = room.current_round
+            for outcome in outcomes:
+                outcome['seq'] = room.transitions
+            return result
+
+        with ROOM_UPDATE_SECONDS.time():
+            result = self.store.update(room_id, touch)
+        if self.match_log is not None:
+            self.match_log.record(room_id, outcomes)
+        for deadline, player in deadlines:
+            self.timers.call_at(deadline, self.expire_deadline, room_id, player)
+        self.events.publish(f'room:{room_id}')
+        for room in finished:
+            for listener in self.finish_listeners:
+                listener(room_id, room)
+        return result
+
+    # turn_index و now فقط برای replay-match؛ در حالت عادی تصادفی و زمان فعلی
+    def create_room(self, player1, player2, ratings=None, turn_index=None, now=None):
+        room_id = self.store.next_room_id()
+        # ترکیب‌های (موضوع، سطح) قابل انتخاب: همان dict مشترک بانک سؤالات
+        room = Room(room_id, (player1, player2), random.randrange(2) if turn_index is None else turn_index,
+                    question_bank.selectable(), time.time() if now is None else now, ratings=ratings)
+        self.store.insert(room_id, room)
+        if self.match_log is not None:
+            self.match_log.record(room_id, [{'type': 'created', 't': room.created_at, 'seq': 0,
+                                             'players': list(room.players), 'turn': room.turn,
+                                             'ratings': ratings and list(ratings)}])
+        self.timers.call_at(room.deadlines[room.turn_index], self.expire_deadline, room_id, room.turn)
+        self.events.publish(f'player:{player1}', f'player:{player2}')
         return room_id
 
+    # انتخاب موضوع دور بعد؛ auto یعنی انتخاب خودکار پس از گذشتن مهلت انتخاب‌کننده
+    def select_topic(self, room_id, player, topic, level, questions, now=None, auto=False):
+        now = time.time() if now is None else now
+        event = {'type': 'topic_selected', 't': now, 'player': player, 'topic': topic, 'level': level,
+                 'questions': [q.id for q in questions], 'auto': auto}
+
+        def select(room):
+            if auto:
+                event['round'] = room.timeout_selection(player, topic, level, questions, now)
+            else:
+                event['round'] = room.select_topic(player, topic, level, questions, now)
+            return event['round']
+
+        return self.update_room(room_id, select, event)
+
+    # ثبت پاسخ همراه با زمان پاسخ‌گویی؛ answer_index برابر TIMED_OUT یعنی بدون پاسخ.
+    # expired: فقط اگر مهلت بازیکن گذشته باشد (زمان‌بند)
+    def submit_answer(self, room_id, player, answer_index, now=None, expired=False, question_number=None):
+        now = time.time() if now is None else now
+        event = {'type': 'answered', 't': now, 'player': player, 'answer': answer_index, 'expired': expired}
+
+        def record(room):
+            question = room.question(room.answered_count(player))
+            score = room.score(player)
+            event.update(question=question.id if question is not None else None,
+                         topic=room.current_topic, level=room.current_level,
+                         latency=room.answer_latency(player, now),
+                         timed_out=answer_index == TIMED_OUT or room.overdue(player, now))
+            if expired:
+                status = room.timeout_answer(player, now)
+            else:
+                status = room.submit_answer(player, answer_index, now, question_number)
+            event['correct'] = room.score(player) > score
+            return status
+
+        status = self.update_room(room_id, record, event)
+        if event['question'] is not None:
+            for listener in self.answer_listeners:
+                listener(room_id, player, event['question'])
+        ANSWER_SECONDS.observe(event['latency'], outcome='timeout' if event['timed_out'] else 'answered')
+        return status
+
+    # توسط زمان‌بند: اگر مهلت بازیکن هنوز باز است کاری انجام نمی‌شود. بازیکنی که
+    # موضوع را انتخاب نکرده یک ترکیب تصادفی می‌گیرد و سؤال بی‌پاسخ غلط حساب می‌شود.
+    def expire_deadline(self, room_id, player):
+        now = time.time()
+        room = self.get_room(room_id)
+        if room is None or not room.overdue(player, now):
+            return
+        try:
+            if room.status == 'waiting_for_topic_selection':
+                choices = room.selectable_for(player)
+                random.shuffle(choices)
+                for topic, level in choices:
+                    questions = question_sampler.draw(topic, level, room.players)
+                    if questions is not None:
+                        self.select_topic(room_id, player, topic, level, questions, now, auto=True)
+                        TOPICS_AUTO_SELECTED.inc()
+                        return
+                # هیچ ترکیبی باقی نمانده؛ مسابقه تمام می‌شود
+                self.update_room(room_id, lambda r: r.finish(),
+                                 {'type': 'no_topics_left', 't': now, 'player': player})
+            else:
+                self.submit_answer(room_id, player, TIMED_OUT, now, expired=True)
+        except RoomStateError:
+            pass
+
+    # پس از راه‌اندازی دوباره، مهلت اتاق‌های موجود دوباره زمان‌بندی می‌شود؛ مهلتی
+    # که در این فاصله گذشته بلافاصله اعمال می‌شود
+    def resume_deadlines(self):
+        deadlines = self.store.room_deadlines()
+        for room_id, player, deadline in deadlines:
+            self.timers.call_at(deadline, self.expire_deadline, room_id, player)
+        return len(deadlines)
+
+    # حذف اتاق‌های منقضی‌شده؛ توسط reaper پس‌زمینه صدا زده می‌شود
     def cleanup_old_rooms(self):
-        current_time = time.time()
-        expired_rooms = []
-        
-        for room_id, room in list(self.rooms.items()):
-            if current_time - room.get('created_at', current_time) > 3600:
-                expired_rooms.append(room_id)
-        
-        for room_id in expired_rooms:
-            del self.rooms[room_id]
+        with self.locked('cleanup_old_rooms'):
+            reaped = self.store.reap(time.time())
+        for room_id, status in reaped:
+            reason = RoomExpiryPolicy.reason(status)
+            self.reaped_counts[reason] += 1
+            ROOMS_REAPED.inc(reason=reason)
+            self.events.publish(f'room:{room_id}')
+        return len(reaped)
 
-game_manager = GameManager()
+game_timers = TimerScheduler('room-timers')
+
+room_expiry = RoomExpiryPolicy(ROOM_IDLE_TTL, ROOM_IN_PROGRESS_TTL, ROOM_FINISHED_TTL, ROOM_MAX_AGE)
+game_manager = GameManager(create_room_store(ROOM_STORE_BACKEND, room_expiry, ROOMS_DB_FILE,
+                                             question_lookup=lambda qid: question_bank.get(qid)),
+                           RoomEventHub(),
+                           Matchmaker(MatchPolicy(MATCH_BUCKET_WIDTH, MATCH_INITIAL_WINDOW,
+                                                  MATCH_WIDEN_PER_SECOND, MATCH_MAX_WAIT)),
+                           game_timers)
+
+def reap_rooms_forever():
+    while True:
+        time.sleep(ROOM_REAP_INTERVAL)
+        try:
+            game_manager.cleanup_old_rooms()
+        except Exception:
+            app.logger.exception('room reaper failed')
+
+def match_waiting_forever():
+    while True:
+        time.sleep(MATCH_SWEEP_INTERVAL)
+        try:
+            game_manager.match_waiting()
+        except Exception:
+            app.logger.exception('matchmaking sweep failed')
+
+REGISTRY.gauge('quiz_live_rooms', 'Rooms currently stored', function=lambda: game_manager.store.room_count())
+REGISTRY.gauge('quiz_waiting_players', 'Players waiting for a match', function=lambda: game_manager.store.waiting_count())
+REGISTRY.gauge('quiz_pending_timers', 'Deadlines scheduled on the room timer', function=lambda: game_timers.pending())
+REGISTRY.gauge('quiz_matchmaking_queue_depth', 'Players waiting for a match by rating bucket', ['bucket'],
+               function=lambda: {game_manager.matchmaker.policy.bucket_label(bucket): count
+                                 for bucket, count in game_manager.store.waiting_by_bucket().items()})
 
 # توابع کمکی برای مدیریت فایل‌ها
 def init_files():
-    if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump({
-                "admin": {
-                    "password": generate_password_hash("admin123"),
-                    "scores": {"online_match": 0},
-                    "completed_questions": []
-                }
-            }, f, ensure_ascii=False, indent=4)
+    if user_store.get('admin') is None:
+        user_store.create('admin', {
+            "password": hash_password("admin123"),
+            "scores": {"online_match": 0},
+            "completed_questions": []
+        })
+        leaderboard.set_score('admin', 0)
     
-    if not os.path.exists(QUESTIONS_FILE):
+    if question_bank.count() == 0 and not os.path.exists(QUESTIONS_FILE):
         sample_questions = [
             {
                 "qText": "پایتخت ایران کدام است؟",
@@ -141,46 +434,138 @@ def init_files():
                 "time": 120
             }
         ]
-        with open(QUESTIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(sample_questions, f, ensure_ascii=False, indent=4)
+        for question in sample_questions:
+            question_bank.add(question)
 
-def load_users():
-    if not os.path.exists(USERS_FILE) or os.stat(USERS_FILE).st_size == 0:
-        return {}
-    with open(USERS_FILE, 'r', encoding='utf-8') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-
-def save_users(users):
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=4)
-
-def load_questions():
-    if not os.path.exists(QUESTIONS_FILE) or os.stat(QUESTIONS_FILE).st_size == 0:
-        return []
-    with open(QUESTIONS_FILE, 'r', encoding='utf-8') as f:
+user_store = create_user_store(USER_STORE_BACKEND, USERS_FILE, USERS_DB_FILE)
+score_writer = ScoreWriter(user_store, SCORE_FLUSH_INTERVAL, SCORE_FLUSH_BATCH)
+game_manager.rating_of = user_store.rating
+
+# ثبت امتیاز نهایی و تغییر رتبه‌ی Elo، دقیقاً یک بار در لحظه‌ی پایان مسابقه
+def commit_match_scores(room_id, room):
+    ratings = room.get('ratings')
+    changes = elo_changes(ratings, room['scores'], RATING_K) if ratings else (0, 0)
+    with leaderboard_lock:
+        score_writer.add({player: {'online_match': score, 'rating': change}
+                          for player, score, change in zip(room['players'], room['scores'], changes)})
+        for player, score in zip(room['players'], room['scores']):
+            leaderboard.add(player, score)
+
+game_manager.finish_listeners.append(commit_match_scores)
+
+# جدول امتیازات مسابقه‌ی آنلاین؛ فقط هنگام راه‌اندازی و بارگذاری دوره‌ای کل
+# امتیازها خوانده می‌شود و صفحه‌ها و رتبه‌ها از حافظه پاسخ داده می‌شوند
+leaderboard = Leaderboard()
+# امتیاز یک مسابقه با هم در صف score_writer و در جدول قرار می‌گیرد؛ جایگزینی
+# جدول نباید بین این دو انجام شود
+leaderboard_lock = threading.Lock()
+
+# The queued scores are flushed and every score is read outside
+# leaderboard_lock, so finishing matches never wait for the scan. While
+# holding() the score writer writes nothing else: a match committed in the
+# meantime is still in its queue and missing from the scan, and is added
+# to the new table when it is swapped in under the lock.
+def reload_leaderboard():
+    with score_writer.holding():
+        fresh = Leaderboard()
+        fresh.load(user_store.scores_of('online_match'))
+        with leaderboard_lock:
+            for username, delta in score_writer.pending_of('online_match').items():
+                fresh.add(username, delta)
+            leaderboard.replace(fresh)
+
+def reload_leaderboard_forever():
+    while True:
+        time.sleep(LEADERBOARD_RELOAD_SECONDS)
         try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []
+            reload_leaderboard()
+        except Exception:
+            app.logger.exception('leaderboard reload failed')
 
-def save_questions(questions):
-    with open(QUESTIONS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(questions, f, ensure_ascii=False, indent=4)
+question_bank = create_question_bank(QUESTION_STORE_BACKEND, QUESTIONS_FILE, QUESTIONS_DB_FILE)
 
 def get_topics():
-    questions = load_questions()
-    topics = sorted(list(set(q['category'] for q in questions)))
-    return topics
+    return question_bank.catalog().topics
+
+# سؤال‌های هر دور از میان سؤال‌هایی که هیچ‌یک از دو بازیکن جواب نداده‌اند
+question_sampler = QuestionSampler(question_bank, user_store.completed_of,
+                                   QUESTION_HISTORY_CACHE_SIZE, QUESTION_HISTORY_TTL)
+
+def record_completed_question(room_id, player, question_id):
+    if question_sampler.mark(player, question_id):
+        score_writer.add_completed(player, [question_id])
+
+game_manager.answer_listeners.append(record_completed_question)
+
+# راه‌اندازی سرور
+# Importing app has no side effects on live state: the CLI commands, the
+# benchmarks and anything else that only needs the stores import it freely.
+# A process that serves players calls start_server() once before taking
+# requests; it restores the rooms of the previous run, re-arms their
+# deadlines and starts the timer, reaper, matchmaker, score writer, match
+# log, leaderboard reload and room snapshot threads. It is called from
+# `python app.py` below, from gunicorn.conf.py (post_worker_init, in every
+# worker) and from the ASGI lifespan startup in asgi.py.
+room_snapshotter = None
+server_lock = threading.Lock()
+server_started = False
 
-def get_levels(topic):
-    questions = load_questions()
-    levels = sorted(list(set(q['level'] for q in questions if q['category'] == topic)))
-    return levels
+def start_server():
+    global room_snapshotter, server_started
+    with server_lock:
+        if server_started:
+            return
+        game_timers.start()
+        threading.Thread(target=reap_rooms_forever, name='room-reaper', daemon=True).start()
+        threading.Thread(target=match_waiting_forever, name='matchmaker', daemon=True).start()
+        score_writer.start()
+        if MATCH_LOG_FILE:
+            game_manager.match_log = MatchLog(MATCH_LOG_FILE)
+            game_manager.match_log.start()
+        reload_leaderboard()
+        if LEADERBOARD_RELOAD_SECONDS > 0:
+            threading.Thread(target=reload_leaderboard_forever, name='leaderboard-reload', daemon=True).start()
+        # بازیابی مسابقه‌های در جریان پس از راه‌اندازی دوباره (سؤال‌ها از question_bank)
+        if ROOM_STORE_BACKEND == 'memory' and ROOM_SNAPSHOT_FILE:
+            room_snapshotter = RoomSnapshotter(ROOM_SNAPSHOT_FILE, game_manager.store,
+                                               lambda qid: question_bank.get(qid), ROOM_SNAPSHOT_INTERVAL)
+            restored = room_snapshotter.restore()
+            if restored:
+                app.logger.info('restored %d rooms from %s', restored, ROOM_SNAPSHOT_FILE)
+            room_snapshotter.start()
+            REGISTRY.gauge('quiz_room_snapshot_seconds', 'Duration of the last room snapshot write',
+                           function=lambda: room_snapshotter.last_write[1])
+        game_manager.resume_deadlines()
+        server_started = True
 
 # سیستم احراز هویت
+password_hasher = PasswordHasher(PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE)
+login_throttle = LoginThrottle(LOGIN_FAILURE_LIMITS, LOGIN_FAILURE_WINDOW)
+REGISTRY.gauge('quiz_password_hash_pending', 'Password hashes queued or running in the pool',
+               function=lambda: password_hasher.pending)
+
+# هر دو در صورت پر بودن صف PasswordHasherBusy می‌دهند
+def hash_password(password):
+    with PASSWORD_HASH_SECONDS.time(op='generate'):
+        return password_hasher.hash(password)
+
+# (درست بودن رمز، هش تازه برای ذخیره یا None)
+def verify_password(password_hash, password):
+    with PASSWORD_HASH_SECONDS.time(op='check'):
+        return password_hasher.verify(password_hash, password)
+
+# پاسخ سریع «دوباره تلاش کنید» با همان فرم و پیام flash
+def try_again_page(template, status, seconds):
+    response = make_response(render_template(template), status)
+    response.cache_control.no_store = True
+    response.headers['Retry-After'] = str(max(1, math.ceil(seconds)))
+    return response
+
+def hasher_busy_page(template):
+    PASSWORD_HASH_REJECTED.inc(endpoint=request.endpoint)
+    flash('سرور در حال حاضر شلوغ است؛ چند لحظه‌ی دیگر دوباره تلاش کنید', 'error')
+    return try_again_page(template, 503, 1)
+
 def login_required(route_func):
     def wrapper(*args, **kwargs):
         if 'username' not in session:
@@ -199,10 +584,106 @@ def admin_required(route_func):
     wrapper.__name__ = route_func.__name__
     return wrapper
 
+# زمان‌سنجی درخواست‌ها و قالب‌ها، و پروفایل درخواست‌های کند
+# Only one cProfile profiler can be enabled per process (Python 3.12+ raises
+# ValueError for a second one), so at most one request is profiled at a time;
+# a sampled request that finds the lock taken is simply not profiled.
+profiler_lock = threading.Lock()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if (app.config['PROFILE_SLOW_REQUESTS'] and random.random() < app.config['PROFILE_SAMPLE_RATE']
+            and profiler_lock.acquire(blocking=False)):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiling tool is active in this process
+            profiler_lock.release()
+            return
+        g.profiler = profiler
+
+# پروفایل درخواست را متوقف و قفل را آزاد می‌کند؛ None اگر پروفایل نمی‌شد
+def stop_request_profiler():
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profiler_lock.release()
+    return profiler
+
+@app.after_request
+def record_request_time(response):
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method)
+
+    profiler = stop_request_profiler()
+    if profiler is not None:
+        elapsed_ms = elapsed * 1000
+        if elapsed_ms >= app.config['PROFILE_THRESHOLD_MS']:
+            os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+            path = os.path.join(app.config['PROFILE_DIR'],
+                                f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{int(elapsed_ms)}ms.prof")
+            profiler.dump_stats(path)
+            app.logger.warning('slow request %s %s took %.0f ms, profile saved to %s',
+                               request.method, request.path, elapsed_ms, path)
+    return response
+
+# پاسخ‌های متنی بزرگ (مثل فهرست‌های مدیریت) فشرده فرستاده می‌شوند
+response_compressor = ResponseCompressor()
+
+@app.after_request
+def compress_response(response):
+    return response_compressor.apply(response, request.accept_encodings)
+
+@app.teardown_request
+def stop_profiler(exc):
+    stop_request_profiler()
+
+render_timing = threading.local()
+
+def template_render_started(sender, template, context, **extra):
+    render_timing.start = time.perf_counter()
+
+def template_render_finished(sender, template, context, **extra):
+    start = getattr(render_timing, 'start', None)
+    if start is not None:
+        TEMPLATE_RENDER_SECONDS.observe(time.perf_counter() - start, template=template.name)
+
+before_render_template.connect(template_render_started, app)
+template_rendered.connect(template_render_finished, app)
+
+# صفحه‌های عمومی یک بار رندر و با ETag فرستاده می‌شوند؛ پاسخ دوباره‌ی مرورگر
+# 304 است. صفحه‌ای که پیام flash دارد مخصوص همان کاربر است و کش نمی‌شود
+page_cache = PageCache()
+
+def render_public_page(template):
+    if '_flashes' in session:
+        response = make_response(render_template(template))
+        response.cache_control.no_store = True
+        return response
+    page = page_cache.get((template, request.script_root), lambda: render_template(template))
+    response = make_response(page.body)
+    response.set_etag(page.etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 # روت‌های اصلی برنامه
 @app.route('/')
 def home():
-    return render_template('start.html')
+    return render_public_page('start.html')
+
+# فهرست موضوع‌ها و سطح‌ها؛ تا تغییر بانک سؤالات همان ETag را دارد
+@app.route('/catalog.json')
+@login_required
+def catalog():
+    catalog = question_bank.catalog()
+    response = app.response_class(catalog.body, mimetype='application/json')
+    response.set_etag(catalog.etag)
+    response.last_modified = catalog.modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -214,32 +695,53 @@ def register():
             flash('نام کاربری و رمز عبور نمی‌توانند خالی باشند', 'error')
             return redirect(url_for('register'))
         
-        users = load_users()
-        if username in users:
+        try:
+            password_hash = hash_password(password)
+        except PasswordHasherBusy:
+            return hasher_busy_page('register.html')
+        created = user_store.create(username, {
+            'password': password_hash,
+            'scores': {"online_match": 0},
+            "completed_questions": []
+        })
+        if not created:
             flash('این نام کاربری قبلاً ثبت شده است', 'error')
         else:
-            users[username] = {
-                'password': generate_password_hash(password),
-                'scores': {"online_match": 0},
-                "completed_questions": []
-            }
-            save_users(users)
+            leaderboard.set_score(username, 0)
             flash('ثبت‌نام با موفقیت انجام شد. اکنون می‌توانید وارد شوید', 'success')
             return redirect(url_for('login'))
-    return render_template('register.html')
+    return render_public_page('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username'].strip()
         password = request.form['password'].strip()
-        users = load_users()
+        throttle_keys = [('user', username), ('ip', request.remote_addr)]
+        wait = login_throttle.retry_after(throttle_keys)
+        if wait:
+            LOGINS_THROTTLED.inc()
+            flash(f'تلاش ناموفق زیادی انجام شده است؛ {max(1, math.ceil(wait))} ثانیه‌ی دیگر دوباره تلاش کنید', 'error')
+            return try_again_page('login.html', 429, wait)
+
+        user = user_store.get(username)
+        valid = new_hash = None
+        if user is not None:
+            try:
+                valid, new_hash = verify_password(user['password'], password)
+            except PasswordHasherBusy:
+                return hasher_busy_page('login.html')
         
-        if username not in users:
+        if user is None:
+            login_throttle.failed(throttle_keys)
             flash('نام کاربری وجود ندارد', 'error')
-        elif not check_password_hash(users[username]['password'], password):
+        elif not valid:
+            login_throttle.failed(throttle_keys)
             flash('رمز عبور اشتباه است', 'error')
         else:
+            login_throttle.succeeded(throttle_keys[:1])
+            if new_hash:
+                user_store.set_password(username, new_hash)
             session.permanent = True
             session['username'] = username
             flash(f'خوش آمدید {username}!', 'success')
@@ -247,7 +749,7 @@ def login():
             if username == 'admin':
                 return redirect(url_for('admin_panel'))
             return redirect(url_for('dashboard'))
-    return render_template('login.html')
+    return render_public_page('login.html')
 
 @app.route('/logout')
 def logout():
@@ -267,13 +769,55 @@ def forgot_password():
 @login_required
 def dashboard():
     username = session['username']
-    users = load_users()
-    user_data = users.get(username, {})
+    user_data = user_store.get(username) or {}
     
     return render_template('dashboard.html', 
                            username=username, 
                            scores=user_data.get('scores', {}),
-                           total_score=sum(user_data.get('scores', {}).values()))
+                           total_score=sum(user_data.get('scores', {}).values()),
+                           rank=leaderboard.rank(username),
+                           player_count=leaderboard.count())
+
+def leaderboard_entries(entries):
+    return [{'rank': rank, 'username': username, 'score': score} for rank, username, score in entries]
+
+# جدول امتیازات: صفحه‌ی page از بالا، و رتبه‌ی کاربر با چند نفر بالا و پایین او
+@app.route('/leaderboard')
+@login_required
+def leaderboard_page():
+    username = session['username']
+    page = page_number()
+    total = leaderboard.count()
+    return render_template('leaderboard.html',
+                           username=username,
+                           entries=leaderboard.page((page - 1) * LEADERBOARD_PAGE_SIZE, LEADERBOARD_PAGE_SIZE),
+                           around=leaderboard.around(username),
+                           rank=leaderboard.rank(username),
+                           total=total,
+                           page=page,
+                           pages=max(1, -(-total // LEADERBOARD_PAGE_SIZE)))
+
+# ?offset=&limit= برای یک بازه از بالا، یا ?around=me برای اطراف کاربر
+@app.route('/leaderboard.json')
+@login_required
+def leaderboard_json():
+    username = session['username']
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(max(1, int(request.args.get('limit', LEADERBOARD_PAGE_SIZE))), 200)
+        span = min(max(0, int(request.args.get('span', 5))), 100)
+    except ValueError:
+        return jsonify({'error': 'bad offset, limit or span'}), 400
+    if request.args.get('around') == 'me':
+        entries = leaderboard.around(username, span, span)
+    else:
+        entries = leaderboard.page(offset, limit)
+    return jsonify({
+        'total': leaderboard.count(),
+        'me': {'username': username, 'rank': leaderboard.rank(username),
+               'score': leaderboard.score(username)},
+        'entries': leaderboard_entries(entries),
+    })
 
 @app.route('/start_match')
 @login_required
@@ -290,29 +834,31 @@ def waiting():
 @app.route('/check_match_status')
 @login_required
 def check_match_status():
-    username = session['username']
+    return jsonify(match_status(session['username']))
+
+def match_status(username):
     result = game_manager.find_match(username)
     
     if result['status'] == 'found_match':
         room_id = result['room_id']
-        room = game_manager.rooms.get(room_id)
-        if room and room['status'] == 'waiting_for_topic_selection':
-            if username == room['turn']:
+        room = game_manager.get_room(room_id)
+        if room and room.status == 'waiting_for_topic_selection':
+            if username == room.turn:
                 result['redirect_url'] = url_for('select_topic_for_match', room_id=room_id)
             else:
                 result['redirect_url'] = url_for('waiting_for_selection', room_id=room_id)
         else:
             result['redirect_url'] = url_for('quiz_match', room_id=room_id)
             
-    return jsonify(result)
+    return result
 
 @app.route('/waiting_for_selection/<room_id>')
 @login_required
 def waiting_for_selection(room_id):
     username = session['username']
-    room = game_manager.rooms.get(room_id)
+    room = game_manager.get_room(room_id)
 
-    if not room or username not in room['players']:
+    if not room or not room.has_player(username):
         return redirect(url_for('dashboard'))
 
     return render_template('waiting_for_selection.html', 
@@ -322,62 +868,134 @@ def waiting_for_selection(room_id):
 @app.route('/check_round_status/<room_id>')
 @login_required
 def check_round_status(room_id):
-    username = session['username']
-    room = game_manager.rooms.get(room_id)
+    return jsonify(round_status(room_id, session['username']))
 
-    if not room or username not in room['players']:
-        return jsonify({'status': 'redirect_home', 'redirect_url': url_for('dashboard')})
+def round_status(room_id, username):
+    room = game_manager.get_room(room_id)
 
-    # Check for inactive player (simple session check)
-    other_player = [p for p in room['players'] if p != username][0]
-    if other_player not in session:
-        room['status'] = 'finished'
-        return jsonify({'status': 'match_finished', 'redirect_url': url_for('match_result', room_id=room_id)})
+    if not room or not room.has_player(username):
+        return {'status': 'redirect_home', 'redirect_url': url_for('dashboard')}
 
-    if room['status'] == 'finished':
-        return jsonify({'status': 'match_finished', 'redirect_url': url_for('match_result', room_id=room_id)})
+    other_player = [p for p in room.players if p != username][0]
 
-    if room['status'] == 'waiting_for_topic_selection':
-        if username == room['turn']:
-            return jsonify({'status': 'my_turn_to_select', 'redirect_url': url_for('select_topic_for_match', room_id=room_id)})
+    if room.status == 'finished':
+        return {'status': 'match_finished', 'redirect_url': url_for('match_result', room_id=room_id)}
+
+    if room.status == 'waiting_for_topic_selection':
+        if username == room.turn:
+            return {'status': 'my_turn_to_select', 'redirect_url': url_for('select_topic_for_match', room_id=room_id)}
         else:
-            return jsonify({'status': 'waiting_for_opponent_to_select', 'redirect_url': url_for('waiting_for_selection', room_id=room_id)})
+            return {'status': 'waiting_for_opponent_to_select', 'redirect_url': url_for('waiting_for_selection', room_id=room_id)}
 
-    if room['status'] == 'in_progress':
-        if room['questions_answered_count'].get(username, 0) < 3:
-            return jsonify({'status': 'go_to_questions', 'redirect_url': url_for('quiz_match', room_id=room_id)})
+    if room.status == 'in_progress':
+        if room.answered_count(username) < 3:
+            return {'status': 'go_to_questions', 'redirect_url': url_for('quiz_match', room_id=room_id)}
         else:
             # Check if opponent has also answered all 3 questions
-            if room['questions_answered_count'].get(other_player, 0) >= 3:
+            if room.answered_count(other_player) >= 3:
                 # Both players are done, start next round/finish game
-                return jsonify({'status': 'round_complete', 'redirect_url': url_for('quiz_match', room_id=room_id)})
+                return {'status': 'round_complete', 'redirect_url': url_for('quiz_match', room_id=room_id)}
             else:
-                return jsonify({'status': 'waiting_for_opponent_to_answer'})
+                return {'status': 'waiting_for_opponent_to_answer'}
     
-    return jsonify({'status': 'waiting'})
+    return {'status': 'waiting'}
+
+# وضعیت فقط‌خواندنی اتاق برای تماشاگران؛ None اگر اتاق وجود ندارد
+def spectator_status(room_id):
+    room = game_manager.get_room(room_id)
+    if room is None:
+        return None
+    return {
+        'status': room.status,
+        'players': list(room.players),
+        'scores': list(room.scores),
+        'answered': list(room.answered),
+        'turn': room.turn,
+        'round': room.current_round,
+        'total_rounds': room.total_rounds,
+        'topic': room.current_topic,
+        'level': room.current_level,
+    }
+
+# هر تغییر اتاق یک بار برای همه‌ی تماشاگرانش ساخته و فرستاده می‌شود
+spectator_hub = SpectatorHub(game_manager.events, spectator_status, SPECTATOR_QUEUE_FRAMES, SSE_RECHECK_SECONDS)
+REGISTRY.gauge('quiz_spectators', 'Open spectator streams', function=lambda: spectator_hub.spectators())
+REGISTRY.gauge('quiz_spectators_dropped', 'Spectator streams dropped for falling behind since start',
+               function=lambda: spectator_hub.dropped_total)
+
+# ارسال لحظه‌ای وضعیت با Server-Sent Events؛ روت‌های check_* به عنوان جایگزین باقی می‌مانند
+def event_stream(key, compute_status, final_statuses):
+    def generate():
+        last_status = None
+        last_write = time.time()
+        with game_manager.events.subscribe(key):
+            while True:
+                seen = game_manager.events.version(key)
+                status = compute_status()
+                if status != last_status:
+                    last_status = status
+                    last_write = time.time()
+                    yield f"data: {json.dumps(status, ensure_ascii=False)}\n\n"
+                    if status['status'] in final_statuses:
+                        return
+                elif time.time() - last_write >= SSE_KEEPALIVE_SECONDS:
+                    last_write = time.time()
+                    yield ": keepalive\n\n"
+                game_manager.events.wait(key, seen, SSE_RECHECK_SECONDS)
+
+    return Response(stream_with_context(generate()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/events/match')
+@login_required
+def match_events():
+    username = session['username']
+    return event_stream(f'player:{username}',
+                        lambda: match_status(username),
+                        {'found_match'})
+
+@app.route('/events/room/<room_id>')
+@login_required
+def room_events(room_id):
+    username = session['username']
+    return event_stream(f'room:{room_id}',
+                        lambda: round_status(room_id, username),
+                        {'redirect_home', 'match_finished'})
+
+# تماشای مسابقه بدون عضویت در اتاق؛ فقط خواندنی
+@app.route('/watch/<room_id>')
+@login_required
+def watch(room_id):
+    state = spectator_status(room_id)
+    if state is None:
+        flash('اتاق بازی یافت نشد', 'error')
+        return redirect(url_for('dashboard'))
+    return render_template('watch.html', room_id=room_id, state=state)
+
+@app.route('/events/watch/<room_id>')
+@login_required
+def watch_events(room_id):
+    return Response(spectator_hub.stream(room_id, SSE_KEEPALIVE_SECONDS),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/select_topic_for_match/<room_id>', methods=['GET', 'POST'])
 @login_required
 def select_topic_for_match(room_id):
     username = session['username']
     
-    if room_id not in game_manager.rooms:
+    room = game_manager.get_room(room_id)
+    if room is None:
         flash('اتاق بازی یافت نشد', 'error')
         return redirect(url_for('dashboard'))
     
-    room = game_manager.rooms[room_id]
-    
-    if username != room['turn']:
+    if username != room.turn:
         return redirect(url_for('waiting_for_selection', room_id=room_id))
     
-    if room['status'] == 'finished':
+    if room.status == 'finished':
         return redirect(url_for('match_result', room_id=room_id))
     
-    questions_data = load_questions()
-    topics = sorted(set(q['category'] for q in questions_data))
-
-    used_combinations = [f"{topic}-{level}" for topic, level in room['used_combinations'].get(username, [])]
-    
     if request.method == 'POST':
         topic = request.form.get('topic')
         level_str = request.form.get('level')
@@ -387,9 +1005,6 @@ def select_topic_for_match(room_id):
             return redirect(url_for('select_topic_for_match', room_id=room_id))
 
         if topic == "سوال 10 امتیازی":
-            if room['used_10_point_question'][username]:
-                flash('شما قبلاً از سؤال ۱۰ امتیازی استفاده کرده‌اید.', 'error')
-                return redirect(url_for('select_topic_for_match', room_id=room_id))
             level = 10
         else:
             try:
@@ -397,112 +1012,103 @@ def select_topic_for_match(room_id):
             except ValueError:
                 flash('سطح انتخابی نامعتبر است.', 'error')
                 return redirect(url_for('select_topic_for_match', room_id=room_id))
-        
-            if (topic, level) in room['used_combinations'][username]:
+
+        if not room.can_select(username, topic, level):
+            player_index = room.players.index(username)
+            if topic == "سوال 10 امتیازی" and room.used_10_point_question[player_index]:
+                flash('شما قبلاً از سؤال ۱۰ امتیازی استفاده کرده‌اید.', 'error')
+            elif (topic, level) in room.used_combinations[player_index]:
                 flash('شما قبلاً این ترکیب موضوع و سطح را انتخاب کرده‌اید. لطفاً ترکیب دیگری را انتخاب کنید.', 'error')
-                return redirect(url_for('select_topic_for_match', room_id=room_id))
+            else:
+                flash(f'تعداد سوالات کافی برای "{topic}" در سطح {level} وجود ندارد', 'error')
+            return redirect(url_for('select_topic_for_match', room_id=room_id))
         
-        filtered_questions = [q for q in questions_data if q['category'] == topic and q['level'] == level]
+        # بانک سؤالات ممکن است در طول مسابقه تغییر کرده باشد
+        selected_questions = question_sampler.draw(topic, level, room.players)
         
-        if len(filtered_questions) < 3:
+        if selected_questions is None:
             flash(f'تعداد سوالات کافی برای "{topic}" در سطح {level} وجود ندارد', 'error')
             return redirect(url_for('select_topic_for_match', room_id=room_id))
-        
-        selected_questions = random.sample(filtered_questions, 3)
-        
-        room['questions'] = {i: q for i, q in enumerate(selected_questions)}
-        room['current_round'] += 1
-        room['questions_answered_count'] = {p: 0 for p in room['players']}
-        room['status'] = 'in_progress'
-        room['current_topic'] = topic
-        room['current_level'] = level
-        room['question_start_time'] = time.time()
-        room['current_question_index'] = 0
-        
-        if topic == "سوال 10 امتیازی":
-            room['used_10_point_question'][username] = True
-        else:
-            room['used_combinations'][username].append((topic, level))
 
-        flash(f'موضوع "{topic}" برای دور {room["current_round"]} انتخاب شد! آماده باشید', 'success')
+        # درخواست تکراری یا هم‌زمان با RoomStateError رد می‌شود و دور دوباره شروع نمی‌شود
+        try:
+            current_round = game_manager.select_topic(room_id, username, topic, level, selected_questions)
+        except RoomStateError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('quiz_match', room_id=room_id))
+        flash(f'موضوع "{topic}" برای دور {current_round} انتخاب شد! آماده باشید', 'success')
         return redirect(url_for('quiz_match', room_id=room_id))
     
+    # فقط ترکیب‌های قابل انتخاب: {topic: [levels]}
+    choices = {}
+    for topic, level in sorted(room.selectable_for(username), key=lambda c: (c[0], -c[1])):
+        choices.setdefault(topic, []).append(level)
+
     return render_template('select_topic.html',
                            room_id=room_id,
-                           topics=topics,
+                           choices=choices,
                            is_my_turn=True,
-                           current_round=room['current_round'],
-                           turn_player=room['turn'],
-                           used_combinations=used_combinations)
+                           current_round=room.current_round,
+                           turn_player=room.turn)
 
 @app.route('/quiz_match/<room_id>', methods=['GET', 'POST'])
 @login_required
 def quiz_match(room_id):
     username = session['username']
     
-    if room_id not in game_manager.rooms:
+    room = game_manager.get_room(room_id)
+    if room is None:
         flash('اتاق بازی یافت نشد', 'error')
         return redirect(url_for('dashboard'))
     
-    room = game_manager.rooms[room_id]
-    
-    if username not in room['players']:
+    if not room.has_player(username):
         flash('شما عضو این اتاق بازی نیست', 'error')
         return redirect(url_for('dashboard'))
 
-    if room['status'] == 'finished':
+    if room.status == 'finished':
         return redirect(url_for('match_result', room_id=room_id))
 
-    answered_count = room['questions_answered_count'].get(username, 0)
+    answered_count = room.answered_count(username)
     
     if request.method == 'POST':
         try:
-            selected_answer_index = int(request.form.get('answer'))
-            correct_answer_index = room['questions'][str(answered_count)]['correct']
-            
-            is_correct = (selected_answer_index == correct_answer_index)
-            
-            if is_correct:
-                if room['questions'][str(answered_count)]['level'] == 10:
-                    room['scores'][username] += 10
-                else:
-                    room['scores'][username] += room['questions'][str(answered_count)]['level']
+            # فرمی که با تمام شدن زمان بدون گزینه ارسال شود پاسخ نداده حساب می‌شود
+            answer = request.form.get('answer')
+            selected_answer_index = TIMED_OUT if answer is None else int(answer)
+            question_number = int(request.form['question_number'])
 
-            room['questions_answered_count'][username] += 1
-            
-            if all(count >= 3 for count in room['questions_answered_count'].values()):
-                if room['current_round'] < room['total_rounds']:
-                    current_index = room['players'].index(room['turn'])
-                    next_index = (current_index + 1) % 2
-                    room['turn'] = room['players'][next_index]
-                    room['status'] = 'waiting_for_topic_selection'
-                    return redirect(url_for('quiz_match', room_id=room_id))
-                else:
-                    room['status'] = 'finished'
-                    return redirect(url_for('match_result', room_id=room_id))
-            
+            status = game_manager.submit_answer(room_id, username, selected_answer_index,
+                                                question_number=question_number)
+            if status == 'finished':
+                return redirect(url_for('match_result', room_id=room_id))
+            return redirect(url_for('quiz_match', room_id=room_id))
+
+        # پاسخ تکراری (مثلاً دوبار ارسال فرم) یا پاسخ سؤالی که مهلتش قبلاً ثبت شده
+        # چیزی را تغییر نمی‌دهد
+        except RoomStateError:
             return redirect(url_for('quiz_match', room_id=room_id))
-        
         except (ValueError, TypeError, KeyError) as e:
             flash(f'پاسخ نامعتبر یا خطای داخلی: {e}', 'error')
             return redirect(url_for('quiz_match', room_id=room_id))
 
-    if room['status'] == 'in_progress' and answered_count < 3:
-        question_data = room['questions'].get(str(answered_count))
+    if room.status == 'in_progress' and answered_count < 3:
+        question_data = room.question(answered_count)
         if not question_data:
             flash('مشکلی در دریافت سوال پیش آمده است', 'error')
             return redirect(url_for('dashboard'))
 
-        # Set question start time if it's the first question of the round
-        if answered_count == 0:
-            room['question_start_time'] = time.time()
-        
+        # زمان را سرور نگه می‌دارد؛ بارگذاری دوباره‌ی صفحه آن را از نو شروع نمی‌کند
+        deadline = room.deadlines[room.players.index(username)]
+        time_left = max(0, int(deadline - ANSWER_GRACE_SECONDS - time.time()))
+
         return render_template('quiz_match.html',
                                room_id=room_id,
                                room=room,
                                username=username,
                                question=question_data,
                                question_number=answered_count + 1,
+                               answered_count=answered_count,
+                               time_left=time_left,
                                answered_all=False)
     else:
         return render_template('quiz_match.html',
@@ -516,19 +1122,17 @@ def quiz_match(room_id):
 def match_result(room_id):
     username = session['username']
     
-    if room_id not in game_manager.rooms:
+    room = game_manager.get_room(room_id)
+    if room is None:
         flash('اتاق بازی یافت نشد', 'error')
         return redirect(url_for('dashboard'))
     
-    room = game_manager.rooms[room_id]
-    
-    if username not in room['players']:
+    if not room.has_player(username):
         flash('شما عضو این اتاق بازی نیستید', 'error')
         return redirect(url_for('dashboard'))
     
-    player1, player2 = room['players']
-    score1 = room['scores'].get(player1, 0)
-    score2 = room['scores'].get(player2, 0)
+    player1, player2 = room.players
+    score1, score2 = room.scores
     
     winner = 'مساوی'
     if score1 > score2:
@@ -536,34 +1140,31 @@ def match_result(room_id):
     elif score2 > score1:
         winner = player2
     
-    users = load_users()
-    for player in room['players']:
-        if player in users:
-            users[player]['scores']['online_match'] = users[player]['scores'].get('online_match', 0) + room['scores'][player]
-    save_users(users)
-    
     return render_template('match_result.html',
-                           scores=room['scores'],
+                           scores=room.scores_by_player(),
                            winner=winner,
-                           players=room['players'],
-                           rounds_played=room['current_round'],
-                           total_rounds=room['total_rounds'])
+                           players=room.players,
+                           rounds_played=room.current_round,
+                           total_rounds=room.total_rounds)
 
 # بخش مدیریتی
 @app.route('/admin')
 @admin_required
 def admin_panel():
-    users = load_users()
-    questions = load_questions()
     return render_template('admin_panel.html', 
-                           users=users, 
-                           question_count=len(questions))
+                           user_count=user_store.count(), 
+                           question_count=question_bank.count())
+
+def page_number():
+    try:
+        return max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        return 1
 
 @app.route('/admin/add_question', methods=['GET', 'POST'])
 @admin_required
 def add_question():
-    questions = load_questions()
-    topics = sorted(set(q['category'] for q in questions))
+    topics = get_topics()
     
     if request.method == 'POST':
         try:
@@ -587,8 +1188,7 @@ def add_question():
                 level = int(request.form['level'])
                 new_question['level'] = level
             
-            questions.append(new_question)
-            save_questions(questions)
+            question_bank.add(new_question)
             flash('سؤال جدید با موفقیت اضافه شد', 'success')
             return redirect(url_for('admin_panel'))
         
@@ -600,20 +1200,51 @@ def add_question():
 @app.route('/admin/questions')
 @admin_required
 def view_questions():
-    questions = load_questions()
-    return render_template('list_questions.html', questions=questions)
+    text = request.args.get('q', '').strip()
+    category = request.args.get('category') or None
+    try:
+        level = int(request.args['level']) if request.args.get('level') else None
+    except ValueError:
+        level = None
+    page = page_number()
+
+    total, questions = question_bank.search(text, category, level,
+                                            offset=(page - 1) * ADMIN_PAGE_SIZE,
+                                            limit=ADMIN_PAGE_SIZE)
+    return render_template('list_questions.html',
+                           questions=questions,
+                           total=total,
+                           page=page,
+                           pages=max(1, -(-total // ADMIN_PAGE_SIZE)),
+                           page_size=ADMIN_PAGE_SIZE,
+                           topics=get_topics(),
+                           filters={'q': text, 'category': category or '', 'level': level or ''})
+
+@app.route('/admin/users')
+@admin_required
+def view_users():
+    prefix = request.args.get('q', '').strip()
+    page = page_number()
+    total, users = user_store.search(prefix, offset=(page - 1) * ADMIN_PAGE_SIZE, limit=ADMIN_PAGE_SIZE)
+    return render_template('list_users.html',
+                           users=users,
+                           total=total,
+                           page=page,
+                           pages=max(1, -(-total // ADMIN_PAGE_SIZE)),
+                           filters={'q': prefix})
 
-@app.route('/admin/edit_question/<int:index>', methods=['GET', 'POST'])
+@app.route('/admin/edit_question/<question_id>', methods=['GET', 'POST'])
 @admin_required
-def edit_question(index):
-    questions = load_questions()
+def edit_question(question_id):
+    question = question_bank.get(question_id)
     
-    if index < 0 or index >= len(questions):
+    if question is None:
         flash('سؤال مورد نظر یافت نشد', 'error')
         return redirect(url_for('view_questions'))
     
-    question = questions[index]
-    topics = sorted(set(q['category'] for q in questions))
+    # کپی تا رکورد کش‌شده در صورت خطای اعتبارسنجی دست نخورد
+    question = question.to_dict()
+    topics = get_topics()
     
     if request.method == 'POST':
         try:
@@ -628,9 +1259,10 @@ def edit_question(index):
             else:
                 question['level'] = int(request.form['level'])
 
-            questions[index] = question
-            save_questions(questions)
-            flash('سؤال با موفقیت ویرایش شد', 'success')
+            if question_bank.update(question_id, question):
+                flash('سؤال با موفقیت ویرایش شد', 'success')
+            else:
+                flash('سؤال مورد نظر یافت نشد', 'error')
             return redirect(url_for('view_questions'))
         
         except ValueError:
@@ -638,38 +1270,179 @@ def edit_question(index):
     
     return render_template('edit_question.html', 
                            question=question, 
-                           index=index,
+                           question_id=question_id,
                            topics=topics)
 
-@app.route('/admin/delete_question/<int:index>', methods=['POST'])
+@app.route('/admin/delete_question/<question_id>', methods=['POST'])
 @admin_required
-def delete_question(index):
-    questions = load_questions()
-    
-    if index < 0 or index >= len(questions):
-        flash('سؤال مورد نظر یافت نشد', 'error')
-    else:
-        del questions[index]
-        save_questions(questions)
+def delete_question(question_id):
+    if question_bank.delete(question_id):
         flash('سؤال با موفقیت حذف شد', 'success')
+    else:
+        flash('سؤال مورد نظر یافت نشد', 'error')
     
     return redirect(url_for('view_questions'))
 
+# ورود دسته‌ای سؤالات از فایل CSV یا JSON Lines؛ فایل به صورت جریانی خوانده می‌شود
+@app.route('/admin/import_questions', methods=['GET', 'POST'])
+@admin_required
+def import_questions_page():
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        fmt = request.form.get('format') or (upload and detect_format(upload.filename))
+        if not upload or not upload.filename:
+            flash('فایلی انتخاب نشده است', 'error')
+        elif fmt not in FORMATS:
+            flash('قالب فایل نامعتبر است', 'error')
+        else:
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+            try:
+                report = import_questions(question_bank, stream, fmt)
+                flash(f'{report.imported} سؤال اضافه شد', 'success')
+            # دسته‌هایی که پیش از خطا خوانده شده‌اند ثبت شده‌اند
+            except (ValueError, UnicodeDecodeError) as e:
+                flash(f'خواندن فایل ممکن نشد (فایل باید UTF-8 باشد؛ سؤال‌های پیش از خطا اضافه شده‌اند): {e}', 'error')
+    return render_template('import_questions.html', report=report)
+
+@app.route('/admin/export_questions')
+@admin_required
+def export_questions():
+    fmt = 'csv' if request.args.get('format') == 'csv' else 'jsonl'
+    return Response(stream_with_context(export_lines(question_bank.iter_questions(), fmt)),
+                    mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename=questions.{fmt}'})
+
+# همان ورود و خروج از خط فرمان:
+#   flask --app app import-questions bank.jsonl
+#   flask --app app export-questions bank.csv
+@app.cli.command('import-questions')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None)
+@click.option('--batch-size', default=500, show_default=True)
+def import_questions_command(path, fmt, batch_size):
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        report = import_questions(question_bank, f, fmt or detect_format(path), batch_size)
+    click.echo(json.dumps(report.as_dict(), ensure_ascii=False, indent=2))
+
+@app.cli.command('export-questions')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None)
+def export_questions_command(path, fmt):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.writelines(export_lines(question_bank.iter_questions(), fmt or detect_format(path)))
+
+# تحلیل گزارش مسابقه‌ها (یک گذر روی فایل) و بازاجرای یک مسابقه:
+#   flask --app app match-stats --hardest 20
+#   flask --app app replay-match room_12
+@app.cli.command('match-stats')
+@click.option('--log', 'path', default=MATCH_LOG_FILE, show_default=True,
+              type=click.Path(exists=True, dir_okay=False))
+@click.option('--min-answers', default=1, show_default=True)
+@click.option('--hardest', default=0, help='Only the N questions with the lowest correct rate.')
+def match_stats_command(path, min_answers, hardest):
+    stats = match_stats(read_events(path), min_answers)
+    if hardest:
+        stats['questions'] = dict(sorted(stats['questions'].items(),
+                                         key=lambda item: item[1]['correct_rate'])[:hardest])
+    click.echo(json.dumps(stats, ensure_ascii=False, indent=2))
+
+# The recorded calls are made again, with their recorded times, on a separate
+# GameManager with a memory store and a timer that never runs, so deadlines
+# only act through the recorded events. The events the replay produces are
+# printed next to the recorded ones ('!' where they differ). Questions come
+# from the current bank.
+@app.cli.command('replay-match')
+@click.argument('room_id')
+@click.option('--log', 'path', default=MATCH_LOG_FILE, show_default=True,
+              type=click.Path(exists=True, dir_okay=False))
+def replay_match_command(room_id, path):
+    recorded = room_history(read_events(path), room_id)
+    if not recorded or recorded[0]['type'] != 'created':
+        raise click.ClickException(f'no match {room_id} in {path}')
+    manager = GameManager(create_room_store('memory', room_expiry), RoomEventHub(),
+                          game_manager.matchmaker, TimerScheduler('replay-timers'))
+    manager.match_log = replayed = RecordedEvents()
+    replay_id = None
+    for event in recorded:
+        kind = event['type']
+        if kind not in REPLAYED_TYPES:
+            continue
+        try:
+            if kind == 'created':
+                replay_id = manager.create_room(*event['players'], event['ratings'],
+                                                event['players'].index(event['turn']), event['t'])
+            elif kind == 'topic_selected':
+                questions = [question_bank.get(qid) for qid in event['questions']]
+                if None in questions:
+                    raise click.ClickException(f"questions {event['questions']} are no longer all in the bank")
+                manager.select_topic(replay_id, event['player'], event['topic'], event['level'],
+                                     questions, event['t'], event['auto'])
+            elif kind == 'answered':
+                manager.submit_answer(replay_id, event['player'], event['answer'], event['t'], event['expired'])
+            else:
+                manager.update_room(replay_id, lambda r: r.finish(),
+                                     {'type': kind, 't': event['t'], 'player': event['player']})
+        except RoomStateError as e:
+            click.echo(f'rejected {kind} at {event["t"]}: {e}')
+
+    differences = 0
+    for expected, actual in itertools.zip_longest(recorded, replayed):
+        expected = expected and {k: v for k, v in expected.items() if k not in ('t', 'room')}
+        actual = actual and {k: v for k, v in actual.items() if k != 't'}
+        if expected == actual:
+            click.echo('  ' + json.dumps(expected, ensure_ascii=False))
+        else:
+            differences += 1
+            click.echo('! recorded ' + json.dumps(expected, ensure_ascii=False))
+            click.echo('! replayed ' + json.dumps(actual, ensure_ascii=False))
+    room = manager.get_room(replay_id).to_dict()
+    del room['selectable']
+    click.echo(json.dumps(room, ensure_ascii=False))
+    if differences:
+        raise click.ClickException(f'{differences} events differ from the log')
+
+@app.route('/admin/metrics')
+@admin_required
+def admin_metrics():
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# روشن/خاموش کردن پروفایل درخواست‌های کند؛ فقط برای همین پروسه
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+@admin_required
+def admin_profiling():
+    if request.method == 'POST':
+        app.config['PROFILE_SLOW_REQUESTS'] = request.form.get('enabled') == '1'
+        try:
+            if request.form.get('threshold_ms'):
+                app.config['PROFILE_THRESHOLD_MS'] = float(request.form['threshold_ms'])
+            if request.form.get('sample_rate'):
+                app.config['PROFILE_SAMPLE_RATE'] = float(request.form['sample_rate'])
+        except ValueError:
+            return jsonify({'error': 'invalid number'}), 400
+    return jsonify({key.lower(): app.config[key] for key in
+                    ('PROFILE_SLOW_REQUESTS', 'PROFILE_THRESHOLD_MS', 'PROFILE_SAMPLE_RATE', 'PROFILE_DIR')})
+
 @app.route('/admin/reset_password', methods=['POST'])
 @admin_required
 def reset_password():
     username = request.form.get('username')
-    users = load_users()
     
-    if username not in users:
+    try:
+        password_hash = hash_password('123456')
+    except PasswordHasherBusy:
+        flash('سرور در حال حاضر شلوغ است؛ چند لحظه‌ی دیگر دوباره تلاش کنید', 'error')
+        return redirect(url_for('admin_panel'))
+    if not user_store.set_password(username, password_hash):
         flash('کاربر مورد نظر یافت نشد', 'error')
     else:
-        users[username]['password'] = generate_password_hash('123456')
-        save_users(users)
         flash(f'رمز عبور {username} با موفقیت به 123456 تغییر یافت', 'success')
     
     return redirect(url_for('admin_panel'))
 
 if __name__ == '__main__':
     init_files()
-    app.run(host='0.0.0.0', port=8080, debug=True, threaded=False)
\ No newline at end of file
+    if not RELOADER_PARENT:
+        start_server()
+    # threaded=True تا اتصال‌های باز SSE بقیه‌ی درخواست‌ها را مسدود نکنند
+    app.run(host='0.0.0.0', port=8080, debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,304 @@
+import asyncio
+import contextvars
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import session
+from flask.ctx import RequestContext
+from werkzeug.exceptions import HTTPException
+
+from app import (app, game_manager, match_status, round_status, spectator_hub, start_server,
+                 SSE_KEEPALIVE_SECONDS, SSE_RECHECK_SECONDS)
+from spectators import KEEPALIVE_FRAME
+
+# اجرای ناهمگام (ASGI)
+# Most connected players are idle: waiting for an opponent, for a topic
+# pick or for the other player's answers. Under WSGI each of those open
+# /events/* streams holds a thread. Here the two event streams run on the
+# asyncio loop and wait on RoomEventHub.wait_async(), so an idle player
+# costs a task and a future rather than a thread; every other route is
+# the unchanged Flask app, called through a bounded thread pool.
+# Spectator streams (/events/watch/<room_id>) are served the same way from
+# the frames SpectatorHub has already built, so thousands of spectators of
+# one match cost one task each.
+#
+# Needs an ASGI server, which is not a dependency of the WSGI setup:
+#   pip install uvicorn
+#   uvicorn asgi:application --host 0.0.0.0 --port 8080
+# or `python asgi.py`. Use a single process with the memory room store;
+# for several processes use QUIZ_ROOM_STORE=sqlite as with gunicorn.
+# The lifespan startup calls app.start_server(), so the server must run
+# with lifespan enabled (uvicorn's default --lifespan auto does).
+
+# تعداد threadهای اجرای روت‌های Flask و محاسبه‌ی وضعیت استریم‌ها
+WSGI_THREADS = int(os.environ.get('QUIZ_ASGI_THREADS', '32'))
+# بدنه‌ی درخواست تا این اندازه در حافظه و بزرگ‌تر از آن در فایل موقت نگه داشته می‌شود
+MAX_BODY_IN_MEMORY = 1024 * 1024
+# تماشاگری که نوشتن یک فریم برایش بیش از این طول بکشد قطع می‌شود
+SPECTATOR_SEND_SECONDS = 10
+
+wsgi_pool = ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+
+
+# context: اگر داده شود همه‌ی مراحل یک درخواست در همان contextvars.Context اجرا
+# می‌شوند؛ stream_with_context در Flask بدون آن بین threadها از کار می‌افتد
+def run_sync(function, *args, context=None):
+    if context is not None:
+        function, args = context.run, (function,) + args
+    return asyncio.get_running_loop().run_in_executor(wsgi_pool, function, *args)
+
+
+# بدنه‌ی درخواست بعداً، فقط برای روت‌هایی که به Flask می‌روند، خوانده می‌شود
+def wsgi_environ(scope):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+# بدنه‌ی کامل که فراخواننده باید ببندد، یا None اگر کاربر زودتر قطع شد (فایل بسته شده)
+async def read_body(receive):
+    body = tempfile.SpooledTemporaryFile(MAX_BODY_IN_MEMORY)
+    complete = False
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                body.seek(0)
+                complete = True
+                return body
+    finally:
+        if not complete:
+            body.close()
+
+
+async def call_wsgi(environ, send):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                               for name, value in headers]
+        return lambda data: response.setdefault('written', []).append(data)
+
+    context = contextvars.Context()
+    chunks = await run_sync(app, environ, start_response, context=context)
+    try:
+        await send({'type': 'http.response.start', 'status': response['status'],
+                    'headers': response['headers']})
+        for data in response.get('written', ()):
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        # پاسخ‌های استریمی (مثلاً export سؤالات) تکه‌تکه در thread pool ساخته می‌شوند
+        iterator = iter(chunks)
+        while True:
+            data = await run_sync(next, iterator, None, context=context)
+            if data is None:
+                break
+            if data:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(chunks, 'close'):
+            await run_sync(chunks.close, context=context)
+
+
+def open_session(environ):
+    with app.request_context(environ):
+        return session._get_current_object()
+
+
+# وضعیت در thread pool و داخل یک request context کوتاه‌عمر محاسبه می‌شود (برای
+# url_for)، تا استریم بیکار فقط environ و session را نگه دارد؛ کوکی session
+# فقط یک بار در ابتدای استریم باز می‌شود
+def in_request(environ, user_session, function):
+    with RequestContext(app, environ, session=user_session):
+        return function()
+
+
+# همان منطق app.event_stream، با انتظار ناهمگام روی RoomEventHub
+async def event_stream(environ, user_session, receive, send, key, compute_status, final_statuses):
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def write(text):
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]})
+    gone = asyncio.ensure_future(disconnected())
+    try:
+        last_status = None
+        last_write = time.time()
+        with game_manager.events.subscribe(key):
+            while True:
+                seen = game_manager.events.version(key)
+                status = await run_sync(in_request, environ, user_session, compute_status)
+                if status != last_status:
+                    last_status = status
+                    last_write = time.time()
+                    await write(f"data: {json.dumps(status, ensure_ascii=False)}\n\n")
+                    if status['status'] in final_statuses:
+                        break
+                elif time.time() - last_write >= SSE_KEEPALIVE_SECONDS:
+                    last_write = time.time()
+                    await write(": keepalive\n\n")
+                await game_manager.events.wait_async(key, seen, SSE_RECHECK_SECONDS, interrupt=gone)
+                if gone.done():
+                    return
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        gone.cancel()
+
+
+# تماشای مسابقه: فریم‌های آماده‌ی SpectatorHub نوشته می‌شوند؛ تماشاگر عقب‌مانده
+# (dropped) یا اتصال کند بدون پایان درست پاسخ رها می‌شود تا سرور اتصال را ببندد
+async def watch_stream(receive, send, room_id):
+    async def disconnected():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ]})
+    subscriber = spectator_hub.subscribe(room_id, asyncio.get_running_loop())
+    gone = asyncio.ensure_future(disconnected())
+    try:
+        while not subscriber.dropped:
+            subscriber.event.clear()
+            body = subscriber.take()
+            if not body:
+                if subscriber.closed:
+                    await send({'type': 'http.response.body', 'body': b''})
+                    return
+                woken = asyncio.ensure_future(subscriber.event.wait())
+                done, _ = await asyncio.wait({woken, gone}, timeout=SSE_KEEPALIVE_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                woken.cancel()
+                if gone.done():
+                    return
+                if done:
+                    continue
+                body = KEEPALIVE_FRAME
+            try:
+                await asyncio.wait_for(send({'type': 'http.response.body', 'body': body, 'more_body': True}),
+                                       SPECTATOR_SEND_SECONDS)
+            except asyncio.TimeoutError:
+                return
+    finally:
+        gone.cancel()
+        spectator_hub.unsubscribe(room_id, subscriber)
+
+
+# استریم‌هایی که روی event loop اجرا می‌شوند: endpoint -> (key, status, final_statuses)
+NATIVE_STREAMS = {
+    'match_events': lambda username, args: (
+        f'player:{username}', lambda: match_status(username), {'found_match'}),
+    'room_events': lambda username, args: (
+        f'room:{args["room_id"]}', lambda: round_status(args['room_id'], username),
+        {'redirect_home', 'match_finished'}),
+}
+
+
+async def http(scope, receive, send):
+    environ = wsgi_environ(scope)
+    try:
+        endpoint, args = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        endpoint = None
+
+    if endpoint in NATIVE_STREAMS and scope['method'] == 'GET':
+        user_session = open_session(environ)
+        username = user_session.get('username')
+        if username is not None:
+            key, compute_status, final_statuses = NATIVE_STREAMS[endpoint](username, args)
+            await event_stream(environ, user_session, receive, send, key, compute_status, final_statuses)
+            return
+
+    if endpoint == 'watch_events' and scope['method'] == 'GET':
+        if open_session(environ).get('username') is not None:
+            await watch_stream(receive, send, args['room_id'])
+            return
+
+    # کاربر وارد نشده هم به روت Flask می‌رود تا login_required هدایتش کند
+    body = await read_body(receive)
+    if body is None:
+        return
+    environ['wsgi.input'] = body
+    try:
+        await call_wsgi(environ, send)
+    finally:
+        body.close()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # بازیابی اتاق‌ها و threadهای پس‌زمینه‌ی app؛ پیش از اولین درخواست
+            try:
+                await run_sync(start_server)
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': repr(e)})
+                return
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            wsgi_pool.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(application, host='0.0.0.0', port=8080)
@@ -0,0 +1,101 @@
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+from werkzeug.security import generate_password_hash
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEN_POINT_TOPIC = "سوال 10 امتیازی"
+BENCH_PASSWORD = 'bench-pass'
+
+
+# داده‌ی مصنوعی برای بنچمارک‌ها
+def make_questions(count, topics=8, seed=0):
+    rng = random.Random(seed)
+    questions = []
+    for i in range(count):
+        if i % 20 == 19:
+            category, level, time_limit = TEN_POINT_TOPIC, 10, 120
+        else:
+            category, level, time_limit = f"topic_{i % topics}", (i // topics) % 3 + 1, 60
+        questions.append({
+            "qText": f"سؤال آزمایشی شماره {i}",
+            "options": [f"گزینه {j} از {i}" for j in range(4)],
+            "correct": rng.randrange(4),
+            "level": level,
+            "category": category,
+            "time": time_limit
+        })
+    return questions
+
+
+# همه‌ی کاربران یک hash مشترک دارند تا ساخت فایل با هزاران کاربر سریع باشد
+def make_users(count, prefix='bench_user_'):
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    users = {
+        "admin": {"password": password_hash, "scores": {"online_match": 0}, "completed_questions": []}
+    }
+    for i in range(count):
+        users[f"{prefix}{i}"] = {
+            "password": password_hash,
+            "scores": {"online_match": 0},
+            "completed_questions": []
+        }
+    return users
+
+
+def write_dataset(workdir, question_count, user_count, topics=8):
+    with open(os.path.join(workdir, 'questions.json'), 'w', encoding='utf-8') as f:
+        json.dump(make_questions(question_count, topics), f, ensure_ascii=False)
+    with open(os.path.join(workdir, 'users.json'), 'w', encoding='utf-8') as f:
+        json.dump(make_users(user_count), f, ensure_ascii=False)
+
+
+# app.py مسیر فایل‌ها را نسبت به پوشه‌ی جاری و تنظیمات را از متغیرهای محیطی
+# هنگام import می‌خواند، پس پوشه و env قبل از import تنظیم می‌شوند.
+def import_app(workdir, env=None):
+    os.environ.update(env or {})
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    import app
+    return app
+
+
+def make_workdir(prefix='quiz-bench-'):
+    return tempfile.mkdtemp(prefix=prefix)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    # nearest-rank
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize_ms(samples):
+    values = sorted(samples)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
+
+
+def write_report(report, path):
+    report.setdefault('created_at', time.strftime('%Y-%m-%dT%H:%M:%S'))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    return text
@@ -0,0 +1,128 @@
+# استریم‌های بیکار در حالت ASGI
+# Opens N /events/room/<id> streams against asgi.application in process (no
+# server or sockets, so the numbers are the app's own cost per stream) for
+# N/2 rooms waiting for a topic pick, and reports the bytes allocated per
+# idle stream with tracemalloc and the thread count. Then every room picks a
+# topic and the time until all streams have pushed the new status is
+# reported, and finally all clients disconnect.
+#
+#   python -m benchmarks.idle_streams --streams 10000
+import argparse
+import asyncio
+import gc
+import random
+import threading
+import time
+import tracemalloc
+
+from benchmarks.common import import_app, make_workdir, write_dataset, write_report
+
+
+class FakeClient:
+    def __init__(self, room_id, cookie):
+        self.scope = {
+            'type': 'http', 'method': 'GET', 'scheme': 'http', 'http_version': '1.1',
+            'path': f'/events/room/{room_id}', 'root_path': '', 'query_string': b'',
+            'headers': [(b'cookie', cookie)], 'server': ('bench', 80), 'client': ('127.0.0.1', 0),
+        }
+        self.requested = False
+        self.closed = asyncio.Event()
+        self.events = 0
+        self.changed = asyncio.Event()
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.body' and message.get('body', b'').startswith(b'data:'):
+            self.events += 1
+            self.changed.set()
+
+    async def wait_for_events(self, count):
+        while self.events < count:
+            self.changed.clear()
+            await self.changed.wait()
+
+
+async def run(args, app_module, asgi):
+    serializer = app_module.app.session_interface.get_signing_serializer(app_module.app)
+    cookie_name = app_module.app.config['SESSION_COOKIE_NAME']
+    manager = app_module.game_manager
+    bank = app_module.question_bank
+    rng = random.Random(args.seed)
+
+    rooms = []
+    clients = []
+    for i in range(args.streams // 2):
+        players = (f'p{i}a', f'p{i}b')
+        room_id = manager.create_room(*players)
+        rooms.append(room_id)
+        for player in players:
+            cookie = f'{cookie_name}={serializer.dumps({"username": player})}'.encode()
+            clients.append(FakeClient(room_id, cookie))
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    tasks = [asyncio.ensure_future(asgi.application(c.scope, c.receive, c.send)) for c in clients]
+    await asyncio.gather(*(c.wait_for_events(1) for c in clients))
+    connect_s = time.perf_counter() - start
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    threads = threading.active_count()
+
+    combinations = list(bank.selectable().values())
+
+    def pick_topics():
+        for room_id in rooms:
+            topic, level = rng.choice(combinations)
+            questions = rng.sample(bank.candidates(topic, level), 3)
+            manager.update_room(room_id, lambda r: r.select_topic(r.turn, topic, level, questions, time.time()))
+
+    start = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, pick_topics)
+    await asyncio.gather(*(c.wait_for_events(2) for c in clients))
+    wake_s = time.perf_counter() - start
+
+    for c in clients:
+        c.closed.set()
+    await asyncio.gather(*tasks)
+
+    return {
+        'config': vars(args),
+        'streams': len(clients),
+        'connect_s': round(connect_s, 3),
+        'bytes_per_idle_stream': round(allocated / len(clients), 1),
+        'mb_per_1000_streams': round(allocated / len(clients) * 1000 / 2 ** 20, 3),
+        'threads_while_idle': threads,
+        'all_notified_after_topic_pick_s': round(wake_s, 3),
+        'channels_left_after_disconnect': len(manager.events.channels),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure idle event streams under asgi.application.')
+    parser.add_argument('--streams', type=int, default=10000)
+    parser.add_argument('--questions', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    workdir = make_workdir()
+    write_dataset(workdir, args.questions, 0)
+    app_module = import_app(workdir, {'QUIZ_ROOM_STORE': 'memory'})
+    app_module.start_server()
+    import asgi
+    report = asyncio.run(run(args, app_module, asgi))
+    print(write_report(report, args.output))
+
+
+if __name__ == '__main__':
+    main()
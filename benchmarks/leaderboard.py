@@ -0,0 +1,97 @@
+# جدول امتیازات با تعداد زیاد کاربر
+# Loads N users with skewed online_match scores into leaderboard.Leaderboard
+# (optionally reading them back from a SQLiteUserStore first, as app.py
+# does at startup), then applies random score increments and times rank,
+# page and around-me queries. The same queries against a list sorted per
+# request, what a leaderboard built from user_store.all() would cost, are
+# timed as the baseline.
+#
+#   python -m benchmarks.leaderboard --users 1000000 --from-store
+import argparse
+import os
+import random
+import time
+
+from benchmarks.common import make_workdir, summarize_ms, write_report
+from leaderboard import Leaderboard
+from user_store import SQLiteUserStore
+
+
+def timed(samples, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure leaderboard updates and queries.')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--mean-score', type=float, default=150)
+    parser.add_argument('--updates', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=10000)
+    parser.add_argument('--baseline-queries', type=int, default=5)
+    parser.add_argument('--from-store', action='store_true',
+                        help='write the users to a SQLite user store and load the leaderboard from it')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    names = [f'player{i}' for i in range(args.users)]
+    scores = [int(rng.expovariate(1 / args.mean_score)) for _ in names]
+    report = {'config': vars(args)}
+
+    pairs = list(zip(names, scores))
+    if args.from_store:
+        store = SQLiteUserStore(os.path.join(make_workdir(), 'users.db'))
+        with store.db.transaction() as conn:
+            conn.executemany('INSERT INTO users (username, password) VALUES (?, ?)',
+                             [(name, '-') for name in names])
+            conn.executemany("INSERT INTO user_scores (username, key, value) VALUES (?, 'online_match', ?)",
+                             pairs)
+        start = time.perf_counter()
+        pairs = store.scores_of('online_match')
+        report['store_read_s'] = round(time.perf_counter() - start, 3)
+
+    board = Leaderboard()
+    start = time.perf_counter()
+    board.load(pairs)
+    report['load_s'] = round(time.perf_counter() - start, 3)
+
+    update_times = []
+    for _ in range(args.updates):
+        timed(update_times, board.add, rng.choice(names), rng.randrange(0, 31))
+
+    rank_times, page_times, around_times = [], [], []
+    for _ in range(args.queries):
+        timed(rank_times, board.rank, rng.choice(names))
+        timed(page_times, board.page, rng.randrange(args.users), 50)
+        timed(around_times, board.around, rng.choice(names))
+    top_times = []
+    for _ in range(args.queries):
+        timed(top_times, board.page, 0, 50)
+
+    # مبنا: مرتب‌سازی همه‌ی کاربران در هر درخواست
+    baseline_times = []
+    for _ in range(args.baseline_queries):
+        name = rng.choice(names)
+        start = time.perf_counter()
+        ordered = sorted(board.scores.items(), key=lambda item: (-item[1], item[0]))
+        rank = next(i for i, (username, _) in enumerate(ordered, 1) if username == name)
+        ordered[max(0, rank - 6):rank + 5]
+        baseline_times.append(time.perf_counter() - start)
+
+    report.update({
+        'update': summarize_ms(update_times),
+        'rank': summarize_ms(rank_times),
+        'top_50': summarize_ms(top_times),
+        'page_50_random_offset': summarize_ms(page_times),
+        'around_me': summarize_ms(around_times),
+        'baseline_full_sort_rank_and_around': summarize_ms(baseline_times),
+    })
+    print(write_report(report, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# هجوم ورود هم‌زمان با مسابقه
+# A probe client polls /check_match_status in a loop while --threads
+# threads log --logins users in through the test client at once, and the
+# probe's latency is reported before and during the burst, with the login
+# throughput and how many logins got 503 "try again". Run it once with
+# --hash-workers 0 (hashing on the request threads, the old behaviour) and
+# once with a pool to compare.
+#
+#   python -m benchmarks.login_burst --logins 300 --threads 32 --hash-workers 4
+import argparse
+import threading
+import time
+
+from benchmarks.common import BENCH_PASSWORD, import_app, make_workdir, summarize_ms, write_dataset, write_report
+
+
+def probe(client, stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        client.get('/check_match_status')
+        samples.append(time.perf_counter() - start)
+        time.sleep(0.005)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure request latency during a login burst.')
+    parser.add_argument('--logins', type=int, default=300)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--hash-workers', type=int, default=4, help='0 hashes on the request threads')
+    parser.add_argument('--hash-queue', type=int, default=32)
+    parser.add_argument('--idle-seconds', type=float, default=2.0)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    workdir = make_workdir()
+    write_dataset(workdir, 200, args.logins)
+    app_module = import_app(workdir, {'QUIZ_HASH_WORKERS': str(args.hash_workers),
+                                      'QUIZ_HASH_QUEUE': str(args.hash_queue),
+                                      'QUIZ_ROOM_SNAPSHOT': '', 'QUIZ_MATCH_LOG': ''})
+    app = app_module.app
+    # the burst comes from many addresses; keep the per-IP failure limit out of the way
+    app_module.login_throttle.limits['ip'] = args.logins + 1
+    # start the pool's workers before the probe thread starts
+    app_module.password_hasher.verify(app_module.user_store.get('admin')['password'], BENCH_PASSWORD)
+
+    prober = app.test_client()
+    prober.post('/login', data={'username': 'bench_user_0', 'password': BENCH_PASSWORD})
+    stop = threading.Event()
+    idle, busy = [], []
+    thread = threading.Thread(target=probe, args=(prober, stop, idle))
+    thread.start()
+    time.sleep(args.idle_seconds)
+    stop.set()
+    thread.join()
+
+    statuses = {}
+    lock = threading.Lock()
+    next_user = iter(range(args.logins))
+
+    def login_worker():
+        client = app.test_client()
+        for i in next_user:
+            status = client.post('/login', data={'username': f'bench_user_{i}',
+                                                 'password': BENCH_PASSWORD}).status_code
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    stop = threading.Event()
+    thread = threading.Thread(target=probe, args=(prober, stop, busy))
+    thread.start()
+    start = time.perf_counter()
+    workers = [threading.Thread(target=login_worker) for _ in range(args.threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    burst_s = time.perf_counter() - start
+    stop.set()
+    thread.join()
+    app_module.password_hasher.close()
+
+    report = {
+        'config': vars(args),
+        'burst_s': round(burst_s, 3),
+        'logins_per_s': round(args.logins / burst_s, 1),
+        'login_statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'probe_idle': summarize_ms(idle),
+        'probe_during_burst': summarize_ms(busy),
+    }
+    print(write_report(report, args.output))
+
+
+if __name__ == '__main__':
+    main()
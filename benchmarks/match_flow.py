@@ -0,0 +1,278 @@
+# بنچمارک جریان کامل مسابقه
+# Drives N player pairs through login -> /start_match -> /check_match_status
+# -> /select_topic_for_match -> /quiz_match -> /match_result, either in
+# process through Flask's test client or over HTTP against a gunicorn it
+# starts locally, and writes throughput / per-endpoint latency as JSON.
+#
+#   python -m benchmarks.match_flow --pairs 50 --questions 20000 --output run.json
+#   python -m benchmarks.match_flow --mode gunicorn --workers 4 --baseline run.json
+import argparse
+import html
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+
+from benchmarks.common import (BENCH_PASSWORD, REPO_DIR, import_app, make_workdir,
+                               summarize_ms, write_dataset, write_report)
+
+CHOICE_RE = re.compile(r'name="topic" value="([^"]*)">\s*<input type="hidden" name="level" value="(\d+)"')
+QUESTION_RE = re.compile(r'name="question_number" value="(\d+)"')
+
+
+class TestClientTransport:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data(as_text=True)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpTransport:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                return response.status, response.read().decode('utf-8')
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode('utf-8', 'replace')
+
+
+# آمار هر endpoint: "GET /check_round_status" -> [seconds]
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def call(self, transport, method, path, data=None):
+        start = time.perf_counter()
+        status, body = transport.request(method, path, data)
+        elapsed = time.perf_counter() - start
+        key = f"{method} /{path.strip('/').split('/')[0]}"
+        with self.lock:
+            self.samples.setdefault(key, []).append(elapsed)
+            if status >= 500:
+                self.errors += 1
+        return status, body
+
+
+# زمان انتظار و نگه‌داشتن قفل تراکنش‌های GameManager (فقط حالت test client)
+class LockProbe:
+    def __init__(self, transaction):
+        self.transaction = transaction
+        self.waits = []
+        self.holds = []
+
+    @contextmanager
+    def __call__(self):
+        start = time.perf_counter()
+        with self.transaction():
+            acquired = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.holds.append(time.perf_counter() - acquired)
+                self.waits.append(acquired - start)
+
+    def report(self):
+        return {
+            'acquisitions': len(self.waits),
+            'wait_total_ms': round(sum(self.waits) * 1000, 3),
+            'hold_total_ms': round(sum(self.holds) * 1000, 3),
+            'wait': summarize_ms(self.waits),
+            'hold': summarize_ms(self.holds),
+        }
+
+
+def play(transport, recorder, username, poll_interval, deadline, rng):
+    recorder.call(transport, 'POST', '/login', {'username': username, 'password': BENCH_PASSWORD})
+    recorder.call(transport, 'GET', '/start_match')
+
+    room_id = None
+    while room_id is None:
+        if time.time() > deadline:
+            return 'timeout'
+        _, body = recorder.call(transport, 'GET', '/check_match_status')
+        data = json.loads(body)
+        if data['status'] == 'found_match':
+            room_id = data['room_id']
+        else:
+            time.sleep(poll_interval)
+
+    while time.time() < deadline:
+        _, body = recorder.call(transport, 'GET', f'/check_round_status/{room_id}')
+        status = json.loads(body)['status']
+        if status == 'my_turn_to_select':
+            _, page = recorder.call(transport, 'GET', f'/select_topic_for_match/{room_id}')
+            choices = CHOICE_RE.findall(page)
+            if not choices:
+                return 'no_choices'
+            topic, level = rng.choice(choices)
+            recorder.call(transport, 'POST', f'/select_topic_for_match/{room_id}',
+                          {'topic': html.unescape(topic), 'level': level})
+        elif status == 'go_to_questions':
+            _, page = recorder.call(transport, 'GET', f'/quiz_match/{room_id}')
+            number = QUESTION_RE.search(page)
+            if number:
+                recorder.call(transport, 'POST', f'/quiz_match/{room_id}',
+                              {'answer': str(rng.randrange(4)), 'question_number': number.group(1)})
+        elif status in ('match_finished', 'redirect_home'):
+            recorder.call(transport, 'GET', f'/match_result/{room_id}')
+            return 'finished' if status == 'match_finished' else 'lost_room'
+        else:
+            time.sleep(poll_interval)
+    return 'timeout'
+
+
+def run_players(make_transport, players, args):
+    recorder = Recorder()
+    outcomes = {}
+    outcome_lock = threading.Lock()
+    deadline = time.time() + args.timeout
+
+    def worker(index, username):
+        rng = random.Random(args.seed + index)
+        try:
+            outcome = play(make_transport(), recorder, username, args.poll_interval, deadline, rng)
+        except Exception as e:
+            outcome = f'error:{type(e).__name__}'
+        with outcome_lock:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(i, name)) for i, name in enumerate(players)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, outcomes, time.perf_counter() - start
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'gunicorn did not start on port {port}')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def compare(report, baseline):
+    lines = []
+    old, new = baseline.get('matches_per_s'), report.get('matches_per_s')
+    if old and new:
+        lines.append(f"matches/s: {old:.2f} -> {new:.2f} ({(new - old) / old * 100:+.1f}%)")
+    for key, stats in sorted(report['endpoints'].items()):
+        before = baseline.get('endpoints', {}).get(key, {}).get('p95_ms')
+        if before and stats.get('p95_ms') is not None:
+            change = (stats['p95_ms'] - before) / before * 100
+            lines.append(f"{key:40s} p95 {before:9.3f} -> {stats['p95_ms']:9.3f} ms ({change:+.1f}%)")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the online match flow.')
+    parser.add_argument('--mode', choices=['client', 'gunicorn'], default='client')
+    parser.add_argument('--pairs', type=int, default=50)
+    parser.add_argument('--questions', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=None, help='registered users (default: 2 * pairs)')
+    parser.add_argument('--topics', type=int, default=8)
+    parser.add_argument('--room-store', choices=['memory', 'sqlite'], default=None)
+    parser.add_argument('--user-store', choices=['sqlite', 'json'], default='sqlite')
+    parser.add_argument('--question-store', choices=['sqlite', 'json'], default='sqlite')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--poll-interval', type=float, default=0.01)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--baseline', help='earlier JSON report to compare against')
+    args = parser.parse_args(argv)
+
+    users = max(args.users or 0, args.pairs * 2)
+    room_store = args.room_store or ('sqlite' if args.mode == 'gunicorn' and args.workers > 1 else 'memory')
+    env = {'QUIZ_ROOM_STORE': room_store, 'QUIZ_USER_STORE': args.user_store,
+           'QUIZ_QUESTION_STORE': args.question_store}
+    workdir = make_workdir()
+    write_dataset(workdir, args.questions, users, args.topics)
+    players = [f'bench_user_{i}' for i in range(args.pairs * 2)]
+
+    lock_report = None
+    if args.mode == 'client':
+        app_module = import_app(workdir, env)
+        app_module.app.config['TESTING'] = True
+        app_module.start_server()
+        probe = LockProbe(app_module.game_manager.store.transaction)
+        app_module.game_manager.store.transaction = probe
+        recorder, outcomes, elapsed = run_players(lambda: TestClientTransport(app_module.app), players, args)
+        lock_report = probe.report()
+    else:
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-w', str(args.workers), '-k', 'gthread',
+             '--threads', str(args.threads), '-b', f'127.0.0.1:{port}',
+             '--chdir', workdir, '--pythonpath', REPO_DIR, '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+             '--log-level', 'warning', 'app:app'],
+            env={**os.environ, **env})
+        try:
+            wait_for_port(port)
+            base_url = f'http://127.0.0.1:{port}'
+            recorder, outcomes, elapsed = run_players(lambda: HttpTransport(base_url), players, args)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    requests_total = sum(len(v) for v in recorder.samples.values())
+    matches = outcomes.get('finished', 0) // 2
+    report = {
+        'mode': args.mode,
+        'config': {**vars(args), 'users': users, 'room_store': room_store},
+        'duration_s': round(elapsed, 3),
+        'outcomes': outcomes,
+        'matches_completed': matches,
+        'matches_per_s': round(matches / elapsed, 3) if elapsed else None,
+        'requests': requests_total,
+        'requests_per_s': round(requests_total / elapsed, 3) if elapsed else None,
+        'server_errors': recorder.errors,
+        'endpoints': {key: summarize_ms(values) for key, values in sorted(recorder.samples.items())},
+        'game_manager_lock': lock_report,
+    }
+    print(write_report(report, args.output))
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            print(compare(report, json.load(f)))
+
+
+if __name__ == '__main__':
+    main()
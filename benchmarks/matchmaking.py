@@ -0,0 +1,79 @@
+# جفت‌سازی با صف بزرگ
+# Queues N players with normally distributed ratings in a room store, then
+# has every player search for an opponent once, and finally sweeps the
+# leftovers after the maximum wait. Reports enqueue and search cost per
+# player, how many were paired on the first search, and the largest rating
+# gap among those pairs.
+#
+#   python -m benchmarks.matchmaking --players 50000 --room-store sqlite
+import argparse
+import os
+import random
+import time
+
+from benchmarks.common import make_workdir, write_report
+from matchmaking import MatchPolicy, Matchmaker
+from room_store import RoomExpiryPolicy, create_room_store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure matchmaking with a large queue.')
+    parser.add_argument('--players', type=int, default=20000)
+    parser.add_argument('--room-store', choices=['memory', 'sqlite'], default='memory')
+    parser.add_argument('--mean-rating', type=float, default=1200)
+    parser.add_argument('--rating-spread', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    workdir = make_workdir()
+    store = create_room_store(args.room_store, RoomExpiryPolicy(600, 900, 300, 3600),
+                              os.path.join(workdir, 'rooms.db'), question_lookup=lambda qid: None)
+    policy = MatchPolicy()
+    matchmaker = Matchmaker(policy)
+    rng = random.Random(args.seed)
+    ratings = {f'player{i}': round(rng.gauss(args.mean_rating, args.rating_spread))
+               for i in range(args.players)}
+    now = time.time()
+
+    start = time.perf_counter()
+    with store.transaction():
+        for player in ratings:
+            matchmaker.enqueue(store, player, ratings.get, now)
+    enqueue_s = time.perf_counter() - start
+    buckets = len(store.waiting_by_bucket())
+
+    paired = 0
+    largest_gap = 0
+    start = time.perf_counter()
+    with store.transaction():
+        for player in ratings:
+            match = matchmaker.find_opponent(store, player, now)
+            if match:
+                paired += 2
+                largest_gap = max(largest_gap, abs(match[0][1] - match[1][1]))
+    search_s = time.perf_counter() - start
+    left = store.waiting_count()
+
+    start = time.perf_counter()
+    with store.transaction():
+        swept = matchmaker.sweep(store, now + policy.max_wait)
+    sweep_s = time.perf_counter() - start
+
+    report = {
+        'config': vars(args),
+        'buckets': buckets,
+        'enqueue_us_per_player': round(enqueue_s / args.players * 1e6, 2),
+        'search_us_per_player': round(search_s / args.players * 1e6, 2),
+        'paired_on_first_search': paired,
+        'largest_rating_gap': largest_gap,
+        'left_after_search': left,
+        'paired_by_sweep': len(swept) * 2,
+        'sweep_s': round(sweep_s, 4),
+        'left_after_sweep': store.waiting_count(),
+    }
+    print(write_report(report, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# جستجوی متنی سؤال‌ها
+# Builds search_index.InvertedIndex over N synthetic questions (qText and
+# options, as question_bank indexes them) and times queries of one, two
+# and more characters. The short queries are timed a second time with
+# every token expanded as a prefix, the behaviour before MIN_PREFIX, as
+# the baseline. Every result is checked against a scan of the tokenized
+# texts, and the run fails on a mismatch: a token shorter than MIN_PREFIX
+# matches whole tokens only, a longer one every token it is a prefix of.
+#
+#   python -m benchmarks.question_search --questions 100000
+import argparse
+import time
+
+import search_index
+from benchmarks.common import make_questions, summarize_ms, write_report
+from search_index import InvertedIndex, tokenize
+
+SHORT_QUERIES = ['1', '7', '12', '99', 'گز', 'از']
+LONG_QUERIES = ['123', '4567', 'شماره', 'گزینه 3', 'سؤال آزمایشی']
+
+
+def expected_keys(token_sets, query):
+    tokens = tokenize(query)
+    return {key for key, doc_tokens in token_sets.items()
+            if all(token in doc_tokens if len(token) < search_index.MIN_PREFIX
+                   else any(doc_token.startswith(token) for doc_token in doc_tokens)
+                   for token in tokens)}
+
+
+def time_queries(index, queries, repeat):
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            index.search(query)
+            samples.append(time.perf_counter() - start)
+    return summarize_ms(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure and check question text search.')
+    parser.add_argument('--questions', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    texts = {str(i): ' '.join([q['qText']] + q['options'])
+             for i, q in enumerate(make_questions(args.questions))}
+    start = time.perf_counter()
+    index = InvertedIndex().build(texts.items())
+    report = {'config': vars(args), 'build_s': round(time.perf_counter() - start, 3),
+              'tokens': len(index.sorted_tokens)}
+
+    token_sets = {key: set(tokenize(text)) for key, text in texts.items()}
+    mismatches = [query for query in SHORT_QUERIES + LONG_QUERIES
+                  if index.search(query) != expected_keys(token_sets, query)]
+    report['mismatches'] = mismatches
+
+    report['short_queries'] = time_queries(index, SHORT_QUERIES, args.repeat)
+    report['long_queries'] = time_queries(index, LONG_QUERIES, args.repeat)
+    # مبنا: هر توکن، هر قدر هم کوتاه، به صورت پیشوند گسترش داده می‌شود
+    min_prefix, search_index.MIN_PREFIX = search_index.MIN_PREFIX, 1
+    try:
+        report['short_queries_prefix_expanded'] = time_queries(index, SHORT_QUERIES, args.repeat)
+    finally:
+        search_index.MIN_PREFIX = min_prefix
+    print(write_report(report, args.output))
+    if mismatches:
+        raise SystemExit(f'search results differ from a full scan for {mismatches}')
+
+
+if __name__ == '__main__':
+    main()
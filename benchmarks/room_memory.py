@@ -0,0 +1,118 @@
+# حافظه‌ی مصرفی هر اتاق
+# Creates N rooms through GameManager.create_room() against a generated
+# question bank and reports the bytes allocated per room with tracemalloc,
+# for idle rooms (waiting for the first topic) and rooms in a round. The
+# same rooms in the old dict layout are measured for comparison; those are
+# not inserted into a store, so their numbers leave out the store's
+# per-room index and expiry entries that the Room numbers include.
+#
+#   python -m benchmarks.room_memory --rooms 20000 --output rooms.json
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from benchmarks.common import import_app, make_workdir, write_dataset, write_report
+
+
+# اتاق به شکل dict تو در تو، پیش از کلاس Room
+def legacy_room(player1, player2, selectable, questions=None):
+    now = time.time()
+    room = {
+        'players': [player1, player2],
+        'scores': {player1: 0, player2: 0},
+        'turn': player1,
+        'total_rounds': 6,
+        'current_round': 0,
+        'questions': {},
+        'questions_answered_count': {player1: 0, player2: 0},
+        'status': 'waiting_for_topic_selection',
+        'current_topic': '',
+        'current_level': 0,
+        'created_at': now,
+        'last_activity': now,
+        'used_combinations': {player1: [], player2: []},
+        'used_10_point_question': {player1: False, player2: False},
+        'used_remove_two': {player1: 0, player2: 0},
+        'selectable': {player1: dict(selectable), player2: dict(selectable)},
+        'question_start_time': 0,
+        'current_question_index': 0
+    }
+    if questions:
+        room['questions'] = {str(i): dict(q) for i, q in enumerate(questions)}
+        room['status'] = 'in_progress'
+    return room
+
+
+def measure(build, count):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    kept = [build(i) for i in range(count)]
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del kept
+    return {
+        'rooms': count,
+        'bytes_total': allocated,
+        'bytes_per_room': round(allocated / count, 1),
+        'build_s': round(elapsed, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure memory per live room.')
+    parser.add_argument('--rooms', type=int, default=20000)
+    parser.add_argument('--questions', type=int, default=5000)
+    parser.add_argument('--topics', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    workdir = make_workdir()
+    write_dataset(workdir, args.questions, 0, args.topics)
+    app_module = import_app(workdir, {'QUIZ_ROOM_STORE': 'memory'})
+    bank = app_module.question_bank
+    manager = app_module.game_manager
+    store = manager.store
+    rng = random.Random(args.seed)
+    combinations = list(bank.selectable().values())
+
+    def idle_room(i):
+        room_id = manager.create_room(f'a{i}', f'b{i}')
+        return store.get(room_id)[0]
+
+    def playing_room(i):
+        room_id = manager.create_room(f'c{i}', f'd{i}')
+        room = store.get(room_id)[0]
+        topic, level = rng.choice(combinations)
+        questions = rng.sample(bank.candidates(topic, level), 3)
+        store.update(room_id, lambda r: r.select_topic(r.turn, topic, level, questions, time.time()))
+        return room
+
+    def legacy_idle(i):
+        return legacy_room(f'e{i}', f'f{i}', bank.selectable())
+
+    def legacy_playing(i):
+        topic, level = rng.choice(combinations)
+        questions = [q.to_dict() for q in rng.sample(bank.candidates(topic, level), 3)]
+        return legacy_room(f'g{i}', f'h{i}', bank.selectable(), questions)
+
+    report = {
+        'config': vars(args),
+        'selectable_combinations': len(combinations),
+        'idle': measure(idle_room, args.rooms),
+        'in_round': measure(playing_room, args.rooms),
+        'legacy_dict_idle': measure(legacy_idle, args.rooms),
+        'legacy_dict_in_round': measure(legacy_playing, args.rooms),
+    }
+    print(write_report(report, args.output))
+
+
+if __name__ == '__main__':
+    main()
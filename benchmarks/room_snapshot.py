@@ -0,0 +1,124 @@
+# هزینه‌ی snapshot اتاق‌ها
+# Creates N rooms through GameManager (half of them in a round) and writes
+# them with room_snapshot.RoomSnapshotter: first the full table, then
+# incremental snapshots after touching a fraction of the rooms, while
+# another thread keeps updating rooms at --load-rate per second so the
+# effect on the request path shows in its update latency. Reports write time, time holding the store
+# lock, snapshot file size and the time to restore into an empty store.
+#
+#   python -m benchmarks.room_snapshot --rooms 50000 --changed 0.01
+import argparse
+import os
+import random
+import threading
+import time
+
+from benchmarks.common import import_app, make_workdir, summarize_ms, write_dataset, write_report
+from room_snapshot import RoomSnapshotter
+from room_store import InMemoryRoomStore
+
+
+# به‌روزرسانی اتاق‌های تصادفی با نرخ rate تا stop، با زمان هر update_room
+def update_load(manager, room_ids, rate, stop, samples, seed):
+    rng = random.Random(seed)
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        room_id = rng.choice(room_ids)
+        start = time.perf_counter()
+        manager.update_room(room_id, lambda room: None)
+        samples.append(time.perf_counter() - start)
+        next_at += 1 / rate
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure room snapshot cost.')
+    parser.add_argument('--rooms', type=int, default=50000)
+    parser.add_argument('--changed', type=float, default=0.01,
+                        help='fraction of rooms touched between incremental snapshots')
+    parser.add_argument('--snapshots', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=2.0, help='seconds between incremental snapshots')
+    parser.add_argument('--load-rate', type=float, default=500, help='room updates per second meanwhile')
+    parser.add_argument('--questions', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    workdir = make_workdir()
+    write_dataset(workdir, args.questions, 0)
+    app_module = import_app(workdir, {'QUIZ_ROOM_STORE': 'memory', 'QUIZ_ROOM_SNAPSHOT': ''})
+    bank = app_module.question_bank
+    manager = app_module.game_manager
+    store = manager.store
+    rng = random.Random(args.seed)
+    combinations = list(bank.selectable().values())
+
+    room_ids = []
+    for i in range(args.rooms):
+        room_id = manager.create_room(f'a{i}', f'b{i}')
+        if i % 2:
+            topic, level = rng.choice(combinations)
+            questions = rng.sample(bank.candidates(topic, level), 3)
+            store.update(room_id, lambda r: r.select_topic(r.turn, topic, level, questions, time.time()))
+        room_ids.append(room_id)
+
+    path = os.path.join(workdir, 'rooms-snapshot.db')
+    snapshotter = RoomSnapshotter(path, store, bank.get)
+    lock_hold = []
+    take_changes = store.take_changes
+
+    def timed_take_changes():
+        start = time.perf_counter()
+        result = take_changes()
+        lock_hold.append(time.perf_counter() - start)
+        return result
+
+    store.take_changes = timed_take_changes
+
+    start = time.perf_counter()
+    snapshotter.write()
+    full_s = time.perf_counter() - start
+    full_lock_hold = lock_hold.pop()
+
+    changed = max(1, int(args.rooms * args.changed))
+    stop = threading.Event()
+    latencies = []
+    load = threading.Thread(target=update_load,
+                            args=(manager, room_ids, args.load_rate, stop, latencies, args.seed))
+    load.start()
+    incremental = []
+    written = []
+    for _ in range(args.snapshots):
+        for room_id in rng.sample(room_ids, changed):
+            manager.update_room(room_id, lambda room: None)
+        time.sleep(args.interval)
+        start = time.perf_counter()
+        written.append(snapshotter.write())
+        incremental.append(time.perf_counter() - start)
+    stop.set()
+    load.join()
+
+    restored_store = InMemoryRoomStore(store.expiry)
+    start = time.perf_counter()
+    restored = RoomSnapshotter(path, restored_store, bank.get).restore()
+    restore_s = time.perf_counter() - start
+
+    report = {
+        'config': vars(args),
+        'full_snapshot_s': round(full_s, 3),
+        'full_snapshot_lock_hold_ms': round(full_lock_hold * 1000, 3),
+        'incremental_rooms_written_mean': round(sum(written) / len(written), 1),
+        'incremental_snapshot': summarize_ms(incremental),
+        'incremental_lock_hold': summarize_ms(lock_hold),
+        'update_room_during_snapshots': summarize_ms(latencies),
+        'snapshot_file_mb': round(os.path.getsize(path) / 2 ** 20, 2),
+        'restore_s': round(restore_s, 3),
+        'rooms_restored': restored,
+    }
+    print(write_report(report, args.output))
+
+
+if __name__ == '__main__':
+    main()
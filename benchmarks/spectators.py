@@ -0,0 +1,171 @@
+# تماشاگران زیاد برای یک مسابقه
+# Plays one match through GameManager with no spectators, then opens N
+# /events/watch/<room_id> streams on a second room against
+# asgi.application in process (as benchmarks.idle_streams does), a
+# fraction of them "stuck" (their send never completes), and plays the same
+# moves there. Reports the players' update_room latency in both matches,
+# the time until every live spectator has each new state, and how many
+# stuck spectators the hub dropped.
+#
+#   python -m benchmarks.spectators --spectators 5000 --stuck 0.01
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks.common import import_app, make_workdir, summarize_ms, write_dataset, write_report
+
+
+class Spectator:
+    def __init__(self, room_id, cookie, stuck, tally):
+        self.scope = {
+            'type': 'http', 'method': 'GET', 'scheme': 'http', 'http_version': '1.1',
+            'path': f'/events/watch/{room_id}', 'root_path': '', 'query_string': b'',
+            'headers': [(b'cookie', cookie)], 'server': ('bench', 80), 'client': ('127.0.0.1', 0),
+        }
+        self.stuck = stuck
+        self.tally = tally
+        self.closed = asyncio.Event()
+        self.frames = 0
+
+    async def receive(self):
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] != 'http.response.body':
+            return
+        if self.stuck and self.frames:
+            # a connection that stopped reading after the first state
+            await asyncio.Event().wait()
+        for _ in range(message.get('body', b'').count(b'data:')):
+            self.frames += 1
+            if not self.stuck:
+                self.tally.received(self.frames)
+
+
+# شمار تماشاگرانی که فریم n را گرفته‌اند
+class Tally:
+    def __init__(self):
+        self.live = 0
+        self.counts = {}
+        self.waiters = {}
+
+    def received(self, frame):
+        count = self.counts[frame] = self.counts.get(frame, 0) + 1
+        if count == self.live and frame in self.waiters:
+            self.waiters.pop(frame).set()
+
+    async def all_received(self, frame):
+        if self.counts.get(frame, 0) < self.live:
+            event = self.waiters[frame] = asyncio.Event()
+            await event.wait()
+
+
+# حرکت‌های یک مسابقه؛ هر کدام یک تغییر وضعیت برای تماشاگران
+def moves(manager, bank, room_id, rng):
+    for _ in range(6):
+        room = manager.get_room(room_id)
+        topic, level = rng.choice(room.selectable_for(room.turn))
+        yield lambda: manager.select_topic(room_id, room.turn, topic, level,
+                                           rng.sample(bank.candidates(topic, level), 3))
+        for _ in range(3):
+            for player in room.players:
+                yield lambda player=player: manager.submit_answer(room_id, player, rng.randrange(4))
+
+
+# زمان خود حرکت در thread درخواست اندازه‌گیری می‌شود، نه تا وقتی event loop
+# شلوغ نتیجه را ببیند
+def timed(move):
+    start = time.perf_counter()
+    move()
+    return start, time.perf_counter() - start
+
+
+async def play(manager, bank, room_id, seed, after_move):
+    loop = asyncio.get_running_loop()
+    latencies = []
+    for move in moves(manager, bank, room_id, random.Random(seed)):
+        start, elapsed = await loop.run_in_executor(None, timed, move)
+        latencies.append(elapsed)
+        await after_move(start)
+    return latencies
+
+
+async def run(args, app_module, asgi):
+    serializer = app_module.app.session_interface.get_signing_serializer(app_module.app)
+    cookie_name = app_module.app.config['SESSION_COOKIE_NAME']
+    manager = app_module.game_manager
+    bank = app_module.question_bank
+    hub = app_module.spectator_hub
+
+    async def pause(start):
+        await asyncio.sleep(args.pause)
+
+    alone_room = manager.create_room('alone_a', 'alone_b', turn_index=0)
+    alone = await play(manager, bank, alone_room, args.seed, pause)
+
+    room_id = manager.create_room('watched_a', 'watched_b', turn_index=0)
+    stuck_count = int(args.spectators * args.stuck)
+    tally = Tally()
+    tally.live = args.spectators - stuck_count
+    spectators = []
+    for i in range(args.spectators):
+        cookie = f'{cookie_name}={serializer.dumps({"username": f"fan{i}"})}'.encode()
+        spectators.append(Spectator(room_id, cookie, i < stuck_count, tally))
+    tasks = [asyncio.ensure_future(asgi.application(s.scope, s.receive, s.send)) for s in spectators]
+    start = time.perf_counter()
+    await tally.all_received(1)
+    connect_s = time.perf_counter() - start
+
+    fan_out = []
+    expected = [1]
+
+    async def wait_fan_out(start):
+        expected[0] += 1
+        await tally.all_received(expected[0])
+        fan_out.append(time.perf_counter() - start)
+        await asyncio.sleep(args.pause)
+
+    watched = await play(manager, bank, room_id, args.seed, wait_fan_out)
+    finished = sum(1 for task in tasks if task.done())
+    for s in spectators:
+        s.closed.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    return {
+        'config': vars(args),
+        'connect_s': round(connect_s, 3),
+        'update_room_no_spectators': summarize_ms(alone),
+        'update_room_with_spectators': summarize_ms(watched),
+        'all_spectators_updated_after': summarize_ms(fan_out),
+        'stuck_spectators': stuck_count,
+        'dropped': hub.dropped_total,
+        'streams_ended_with_match': finished,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure spectator fan-out under asgi.application.')
+    parser.add_argument('--spectators', type=int, default=5000)
+    parser.add_argument('--stuck', type=float, default=0.01, help='fraction of spectators that stop reading')
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds between moves')
+    parser.add_argument('--questions', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    workdir = make_workdir()
+    write_dataset(workdir, args.questions, 0)
+    app_module = import_app(workdir, {'QUIZ_ROOM_STORE': 'memory', 'QUIZ_ROOM_SNAPSHOT': '',
+                                      'QUIZ_MATCH_LOG': ''})
+    app_module.start_server()
+    import asgi
+    report = asyncio.run(run(args, app_module, asgi))
+    print(write_report(report, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+# اتصال SQLite به ازای هر thread
+# sqlite3 connections must not be shared between threads, so each thread
+# opens its own (WAL mode, autocommit). transaction() nests: only the
+# outermost block issues BEGIN IMMEDIATE / COMMIT.
+class ThreadLocalSQLite:
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()
+
+    def conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.depth = 0
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.conn().execute(sql, params)
+
+    # BEGIN IMMEDIATE takes the write lock up front, so a read-modify-write
+    # inside the block cannot interleave with another process.
+    @contextmanager
+    def transaction(self):
+        conn = self.conn()
+        if self.local.depth:
+            self.local.depth += 1
+            try:
+                yield conn
+            finally:
+                self.local.depth -= 1
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        self.local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            self.local.depth = 0
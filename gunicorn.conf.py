@@ -0,0 +1,10 @@
+# تنظیمات gunicorn
+# gunicorn reads ./gunicorn.conf.py by default; from elsewhere pass
+#   gunicorn -c /path/to/gunicorn.conf.py app:app
+# Each worker imports app on its own, so each starts its background threads
+# (room timers, reaper, matchmaker, score writer, ...) after the fork here.
+
+
+def post_worker_init(worker):
+    from app import start_server
+    start_server()
@@ -0,0 +1,108 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # اختیاری: pip install brotli
+    brotli = None
+
+
+# فشرده‌سازی پاسخ‌ها
+# Text responses of at least min_size bytes are gzip (or brotli, when the
+# module is installed and the client accepts it) encoded after the view
+# has run. Responses carrying an ETag keep it, marked weak since the bytes
+# now differ per encoding, and their compressed body is kept in a small LRU
+# keyed by (etag, encoding) so a cached page is compressed only once.
+# Streams, files sent with send_file and anything already encoded are left
+# alone.
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'text/csv',
+                          'application/json', 'application/javascript'}
+
+
+class ResponseCompressor:
+    def __init__(self, min_size=1024, level=6, cache_size=256):
+        self.min_size = min_size
+        self.level = level
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def encodings(self):
+        return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def choose_encoding(self, accept_encodings):
+        for encoding in self.encodings():
+            if accept_encodings[encoding]:
+                return encoding
+        return None
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=min(self.level, 11))
+        return gzip.compress(data, self.level, mtime=0)
+
+    def _cached(self, key, data, encoding):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        compressed = self.compress(data, encoding)
+        with self.lock:
+            self.cache[key] = compressed
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return compressed
+
+    def apply(self, response, accept_encodings):
+        if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.choose_encoding(accept_encodings)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        etag, _ = response.get_etag()
+        if etag:
+            compressed = self._cached((etag, encoding), data, encoding)
+            response.set_etag(etag, weak=True)
+        else:
+            compressed = self.compress(data, encoding)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+# صفحه‌ی رندرشده‌ی ثابت و ETag آن
+class RenderedPage:
+    __slots__ = ('body', 'etag')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+
+
+# صفحه‌هایی که به کاربر وابسته نیستند (start، login، register بدون پیام flash)
+# یک بار برای هر (template, script_root) رندر می‌شوند
+class PageCache:
+    def __init__(self):
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, render):
+        page = self.pages.get(key)
+        if page is None:
+            page = RenderedPage(render())
+            with self.lock:
+                page = self.pages.setdefault(key, page)
+        return page
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
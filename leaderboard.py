@@ -0,0 +1,138 @@
+import bisect
+import threading
+
+
+# جدول امتیازات
+# Users ordered by score (highest first, ties by username), kept up to date
+# as match scores are committed instead of sorting every user per view.
+# A Fenwick tree indexed by score counts the users at each score, so "how
+# many users score above s" and "which score holds the k-th user" are
+# O(log max_score); users sharing a score sit in a sorted list per score.
+# rank(), page() and around() are therefore O(log n) plus the page size
+# (and a bisect in the tie list). Scores are non-negative integers; the
+# tree doubles when a score outgrows it.
+class Leaderboard:
+    def __init__(self, size=1024):
+        self.lock = threading.RLock()
+        self.scores = {}
+        self.by_score = {}
+        self.tree = [0] * (size + 1)
+
+    # pairs: (username, score)؛ جایگزین کل جدول
+    def load(self, pairs, min_size=0):
+        scores = dict(pairs)
+        size = len(self.tree) - 1
+        top = max(max(scores.values(), default=0) + 1, min_size)
+        while top > size:
+            size *= 2
+        by_score = {}
+        for username in sorted(scores):
+            by_score.setdefault(scores[username], []).append(username)
+        tree = [0] * (size + 1)
+        for score, names in by_score.items():
+            tree[score + 1] = len(names)
+        # ساخت Fenwick در O(size)
+        for i in range(1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                tree[parent] += tree[i]
+        with self.lock:
+            self.scores, self.by_score, self.tree = scores, by_score, tree
+
+    # جایگزین کل جدول با جدولی که بیرون از قفل ساخته شده؛ other دیگر استفاده نمی‌شود
+    def replace(self, other):
+        with self.lock:
+            self.scores, self.by_score, self.tree = other.scores, other.by_score, other.tree
+
+    def _update(self, score, delta):
+        i = score + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    # تعداد کاربران با امتیاز کمتر یا مساوی score
+    def _count_to(self, score):
+        i = min(score + 1, len(self.tree) - 1)
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    # کوچک‌ترین امتیازی که count کاربر امتیازی کمتر یا مساوی آن دارند
+    def _score_at(self, count):
+        position = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = position + step
+            if nxt < len(self.tree) and self.tree[nxt] < count:
+                position = nxt
+                count -= self.tree[nxt]
+            step >>= 1
+        return position
+
+    def set_score(self, username, score):
+        with self.lock:
+            old = self.scores.get(username)
+            if old == score:
+                return
+            if score >= len(self.tree) - 1:
+                self.load(list(self.scores.items()), score + 1)
+            if old is not None:
+                names = self.by_score[old]
+                del names[bisect.bisect_left(names, username)]
+                if not names:
+                    del self.by_score[old]
+                self._update(old, -1)
+            self.scores[username] = score
+            bisect.insort(self.by_score.setdefault(score, []), username)
+            self._update(score, 1)
+
+    def add(self, username, delta):
+        with self.lock:
+            self.set_score(username, self.scores.get(username, 0) + delta)
+
+    def count(self):
+        return len(self.scores)
+
+    def score(self, username):
+        return self.scores.get(username)
+
+    # رتبه از ۱، یا None برای کاربر ناشناس
+    def rank(self, username):
+        with self.lock:
+            score = self.scores.get(username)
+            if score is None:
+                return None
+            above = len(self.scores) - self._count_to(score)
+            return above + bisect.bisect_left(self.by_score[score], username) + 1
+
+    # [(rank, username, score)] از رتبه‌ی offset + 1
+    def page(self, offset, limit):
+        entries = []
+        with self.lock:
+            total = len(self.scores)
+            rank = max(0, offset)
+            start = None
+            while len(entries) < limit and rank < total:
+                # rank-th user from the top is the (total - rank)-th from the bottom
+                score = self._score_at(total - rank)
+                names = self.by_score[score]
+                if start is None:
+                    # users above this score come first; skip into the tie list
+                    start = rank - (total - self._count_to(score))
+                else:
+                    start = 0
+                for username in names[start:start + limit - len(entries)]:
+                    rank += 1
+                    entries.append((rank, username, score))
+        return entries
+
+    # کاربر و before/after نفر بالا و پایین او
+    def around(self, username, before=5, after=5):
+        with self.lock:
+            rank = self.rank(username)
+            if rank is None:
+                return []
+            start = max(0, rank - 1 - before)
+            return self.page(start, rank - start + after)
@@ -0,0 +1,191 @@
+import atexit
+import json
+import logging
+import math
+import threading
+import time
+
+
+# گزارش رویدادهای مسابقه
+# Every stored room transition becomes one JSON Lines record appended to a
+# file: {"t": time, "room": room_id, "type": ..., ...fields}. Records are
+# buffered and written by a background thread every flush_interval seconds
+# (or once max_buffer are waiting) with a single append, so the request
+# path only pays for a list append. The file is opened with O_APPEND, so
+# several gunicorn workers can share it. A crash can at most cut the last
+# line short; read_events() skips it.
+#
+# Lines are in flush order, which across threads and workers is not quite
+# the order of the changes; `seq` (Room.transitions) orders one room's
+# events, and the statistics below do not depend on line order.
+#
+# Types written by GameManager. The first four are the calls made on a
+# room and are enough to replay it (see `flask replay-match`); the last two
+# follow from them and share the seq of the call that caused them:
+#   created         players, turn, ratings
+#   topic_selected  player, topic, level, questions, auto, round
+#   answered        player, question, topic, level, answer, expired, correct,
+#                   latency, timed_out
+#   no_topics_left  player (the selector had nothing left to pick)
+#   round_advanced  round, turn
+#   finished        scores, round (if a round was in progress)
+REPLAYED_TYPES = ('created', 'topic_selected', 'answered', 'no_topics_left')
+
+
+class MatchLog:
+    def __init__(self, path, flush_interval=1.0, max_buffer=1000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='match-log', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # events: dictهای بدون room که بعد از این تغییر داده نمی‌شوند؛ t اگر نباشد
+    # زمان فعلی است. تبدیل به JSON در thread نویسنده انجام می‌شود.
+    def record(self, room_id, events):
+        now = time.time()
+        with self.cond:
+            self.pending.extend((now, room_id, event) for event in events)
+            if len(self.pending) >= self.max_buffer:
+                self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.stopping or len(self.pending) >= self.max_buffer,
+                                   self.flush_interval)
+                if self.stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger(__name__).exception('match log flush failed')
+
+    def flush(self):
+        with self.flush_lock:
+            with self.cond:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return
+            text = ''.join(json.dumps({'t': now, 'room': room_id, **event},
+                                      ensure_ascii=False, separators=(',', ':')) + '\n'
+                           for now, room_id, event in batch)
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(text)
+            except Exception:
+                with self.cond:
+                    self.pending[:0] = batch
+                raise
+
+    def close(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+
+def read_events(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+# رویدادهای یک مسابقه: آخرین مسابقه‌ای که با این شناسه ساخته شده است (شناسه‌ی
+# اتاق پس از راه‌اندازی دوباره بدون snapshot ممکن است تکرار شود)
+def room_history(events, room_id):
+    found = []
+    for event in events:
+        if event['room'] != room_id:
+            continue
+        if event['type'] == 'created':
+            found = []
+        found.append(event)
+    # sorted() is stable, so the events caused by one call stay in order
+    return sorted(found, key=lambda event: event['seq'])
+
+
+def _percentile(sorted_values, pct):
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def _timing(values):
+    values.sort()
+    return {
+        'count': len(values),
+        'mean_s': round(sum(values) / len(values), 3),
+        'p50_s': round(_percentile(values, 50), 3),
+        'p95_s': round(_percentile(values, 95), 3),
+    }
+
+
+# آمار از یک گذر روی گزارش: درصد پاسخ درست هر سؤال و هر موضوع، و زمان پاسخ و
+# طول دور برای هر سطح. حافظه به تعداد سؤال‌ها و دورهای نیمه‌تمام بستگی دارد، نه
+# به طول گزارش (به جز نمونه‌های زمان که برای صدک نگه داشته می‌شوند).
+def match_stats(events, min_answers=1):
+    questions = {}
+    topics = {}
+    answer_times = {}
+    round_times = {}
+    # (room, round) -> شروع (t, level) یا پایان t، هر کدام زودتر خوانده شود
+    round_starts = {}
+    round_ends = {}
+    matches = finished = 0
+    for event in events:
+        kind = event['type']
+        if kind == 'created':
+            matches += 1
+        elif kind == 'answered':
+            for counts in (questions.setdefault(event['question'], [0, 0]),
+                           topics.setdefault(event['topic'], [0, 0])):
+                counts[0] += 1
+                counts[1] += event['correct']
+            if not event['timed_out']:
+                answer_times.setdefault(event['level'], []).append(event['latency'])
+        elif kind == 'topic_selected' or 'round' in event:
+            key = (event['room'], event['round'])
+            if kind == 'topic_selected':
+                end = round_ends.pop(key, None)
+                if end is None:
+                    round_starts[key] = (event['t'], event['level'])
+                else:
+                    round_times.setdefault(event['level'], []).append(end - event['t'])
+            else:
+                start = round_starts.pop(key, None)
+                if start is None:
+                    round_ends[key] = event['t']
+                else:
+                    round_times.setdefault(start[1], []).append(event['t'] - start[0])
+        if kind == 'finished':
+            finished += 1
+
+    return {
+        'matches': matches,
+        'finished': finished,
+        'questions': {qid: {'answers': total, 'correct_rate': round(correct / total, 3)}
+                      for qid, (total, correct) in questions.items() if total >= min_answers},
+        'topics': {topic: {'answers': total, 'correct_rate': round(correct / total, 3)}
+                   for topic, (total, correct) in sorted(topics.items())},
+        'answer_time_by_level': {str(level): _timing(values) for level, values in sorted(answer_times.items())},
+        'round_time_by_level': {str(level): _timing(values) for level, values in sorted(round_times.items())},
+    }
+
+
+# برای replay-match: رویدادها به جای فایل در حافظه جمع می‌شوند
+class RecordedEvents(list):
+    def record(self, room_id, events):
+        self.extend(events)
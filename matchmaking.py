@@ -0,0 +1,106 @@
+import math
+
+
+# جفت‌سازی بر اساس رتبه
+# Waiting players sit in per-bucket FIFO queues, a bucket being a
+# bucket_width wide rating range. A player accepts opponents within
+# `window` rating points, which starts at initial_window and widens by
+# widen_per_second while they wait; after max_wait any opponent is
+# accepted. Only the oldest player of each bucket in range is looked at, so
+# a search costs O(buckets in window * log n) however long the queue is.
+#
+# The queue lives in the room store (see room_store) behind these calls,
+# all made inside the store's transaction():
+#   enqueue(player, rating, bucket, now) / remove_waiting(player)
+#   waiting_entry(player) -> (rating, bucket, enqueued_at) or None
+#   waiting_buckets(lo, hi) -> sorted non-empty buckets, None = unbounded
+#   bucket_head(bucket, exclude) -> (player, rating, enqueued_at) or None
+class MatchPolicy:
+    def __init__(self, bucket_width=100, initial_window=100, widen_per_second=20, max_wait=30):
+        self.bucket_width = bucket_width
+        self.initial_window = initial_window
+        self.widen_per_second = widen_per_second
+        self.max_wait = max_wait
+
+    def bucket(self, rating):
+        return int(rating // self.bucket_width)
+
+    # برچسب متریک‌ها: کران پایین بازه، مثلاً "1200"
+    def bucket_label(self, bucket):
+        return str(bucket * self.bucket_width)
+
+    def window(self, waited):
+        if waited >= self.max_wait:
+            return math.inf
+        return self.initial_window + self.widen_per_second * waited
+
+
+class Matchmaker:
+    def __init__(self, policy):
+        self.policy = policy
+
+    # rating_of فقط برای بازیکنی که تازه وارد صف می‌شود صدا زده می‌شود
+    def enqueue(self, store, player, rating_of, now):
+        if store.waiting_entry(player) is not None:
+            return False
+        rating = rating_of(player)
+        store.enqueue(player, rating, self.policy.bucket(rating), now)
+        return True
+
+    # نزدیک‌ترین حریف در بازه‌ی بازیکن (و در تساوی، قدیمی‌ترین)؛ هر دو از صف
+    # خارج می‌شوند و ((player, rating, enqueued_at), (opponent, ...)) برمی‌گردد
+    def find_opponent(self, store, player, now):
+        entry = store.waiting_entry(player)
+        if entry is None:
+            return None
+        rating, bucket, enqueued_at = entry
+        window = self.policy.window(now - enqueued_at)
+        if window == math.inf:
+            lo = hi = None
+        else:
+            lo, hi = self.policy.bucket(rating - window), self.policy.bucket(rating + window)
+
+        best = None
+        for candidate_bucket in store.waiting_buckets(lo, hi):
+            head = store.bucket_head(candidate_bucket, exclude=player)
+            if head is None:
+                continue
+            distance = abs(head[1] - rating)
+            if distance > window:
+                continue
+            key = (distance, head[2])
+            if best is None or key < best[0]:
+                best = (key, head)
+        if best is None:
+            return None
+
+        opponent = best[1]
+        store.remove_waiting(player)
+        store.remove_waiting(opponent[0])
+        return (player, rating, enqueued_at), opponent
+
+    # بازیکنان منتظری که خودشان درخواستی نمی‌فرستند (مثلاً با SSE) با بازتر شدن
+    # بازه‌شان از این مسیر جفت می‌شوند: قدیمی‌ترین بازیکن هر bucket جستجو می‌کند
+    def sweep(self, store, now):
+        matches = []
+        for bucket in store.waiting_buckets(None, None):
+            head = store.bucket_head(bucket)
+            if head is None:
+                continue
+            match = self.find_opponent(store, head[0], now)
+            if match:
+                matches.append(match)
+        return matches
+
+
+# تغییر رتبه‌ی Elo دو بازیکن بر اساس امتیاز مسابقه؛ مجموع تغییرات صفر است
+def elo_changes(ratings, scores, k=32):
+    expected = 1 / (1 + 10 ** ((ratings[1] - ratings[0]) / 400))
+    if scores[0] > scores[1]:
+        actual = 1.0
+    elif scores[0] < scores[1]:
+        actual = 0.0
+    else:
+        actual = 0.5
+    change = round(k * (actual - expected))
+    return change, -change
@@ -0,0 +1,175 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+# متریک‌های داخلی برنامه در قالب متنی Prometheus
+# Counters, gauges and histograms live in one process-wide REGISTRY and are
+# rendered by /admin/metrics. With several gunicorn workers each worker
+# reports its own numbers.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield self.name, _label_text(self.labels, key), value
+
+
+class Gauge:
+    kind = 'gauge'
+
+    # function: اختیاری؛ مقدار هنگام خواندن متریک‌ها محاسبه می‌شود. برای گیج
+    # برچسب‌دار، function یک dict از مقدار برچسب (یا tuple مقادیر) به مقدار برمی‌گرداند
+    def __init__(self, name, help_text, labels=(), function=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.function = function
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def set(self, value, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            if not self.labels:
+                yield self.name, '', self.function()
+                return
+            for key, value in self.function().items():
+                key = key if isinstance(key, tuple) else (key,)
+                yield self.name, _label_text(self.labels, key), value
+            return
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield self.name, _label_text(self.labels, key), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, (list(e[0]), e[1], e[2])) for key, e in self.values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield (self.name + '_bucket',
+                       _label_text(self.labels, key, [('le', _format(bound))]), cumulative)
+            yield self.name + '_sum', _label_text(self.labels, key), total
+            yield self.name + '_count', _label_text(self.labels, key), count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), function=None):
+        return self._add(Gauge(name, help_text, labels, function))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# خواندن و نوشتن فایل‌ها
+FILE_LOADS = REGISTRY.counter('quiz_file_loads_total', 'Data file loads', ['file'])
+FILE_BYTES_READ = REGISTRY.counter('quiz_file_bytes_read_total', 'Bytes read from data files', ['file'])
+FILE_SAVES = REGISTRY.counter('quiz_file_saves_total', 'Data file saves', ['file'])
+FILE_BYTES_WRITTEN = REGISTRY.counter('quiz_file_bytes_written_total', 'Bytes written to data files', ['file'])
+FILE_LOAD_SECONDS = REGISTRY.histogram('quiz_file_load_seconds', 'Time to read and parse a data file', ['file'])
+
+
+def record_file_load(path, size, seconds):
+    FILE_LOADS.inc(file=path)
+    FILE_BYTES_READ.inc(size, file=path)
+    FILE_LOAD_SECONDS.observe(seconds, file=path)
+
+
+def record_file_save(path, size):
+    FILE_SAVES.inc(file=path)
+    FILE_BYTES_WRITTEN.inc(size, file=path)
@@ -0,0 +1,203 @@
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# هش رمز عبور در پروسه‌های جدا
+# generate/check_password_hash are a deliberately slow KDF and hold the GIL
+# while they run, so a burst of logins on request threads stalls every
+# other request of the worker. PasswordHasher runs them in a process pool
+# of `workers` processes; the request thread only waits on the result.
+# At most max_pending calls may be queued or running: one more raises
+# PasswordHasherBusy at once, and the route answers "try again" instead of
+# queueing behind the burst. workers=0 hashes on the calling thread, as
+# before.
+#
+# verify() also reports when a correct password's hash was made with other
+# parameters than `method` (e.g. after the method or its cost changed), and
+# returns a new hash for the caller to store.
+#
+# Workers are started by a forkserver (spawn where there is none), never
+# by forking the server itself: the server is multithreaded, and a fork
+# copies locks other threads may hold at that moment. The forkserver
+# imports the main module once (`python app.py` imports app, which has no
+# side effects until start_server()) and the workers fork from it; other
+# scripts that hash passwords need the usual `if __name__ == '__main__':`
+# guard, as with any multiprocessing code. Workers may outlive a server
+# that dies by a signal without running atexit (uvicorn re-raises
+# SIGTERM), so each restores the default SIGTERM, ignores SIGINT (the
+# server handles Ctrl-C) and exits once the server process is gone. That
+# is not the worker's parent: the forkserver is, and it stays up for as
+# long as any worker is alive.
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _watch_server(server_pid):
+    while True:
+        time.sleep(1.0)
+        try:
+            os.kill(server_pid, 0)
+        except ProcessLookupError:
+            os._exit(0)
+
+
+def _init_worker(server_pid):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    threading.Thread(target=_watch_server, args=(server_pid,), daemon=True).start()
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+# (درست بودن رمز، هش تازه یا None)
+def _verify(password_hash, password, method, prefix):
+    if not check_password_hash(password_hash, password):
+        return False, None
+    if password_hash.split('$', 1)[0] != prefix:
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', workers=2, max_pending=32, timeout=10.0):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pending = 0
+        # 'scrypt:32768:8:1'، بخش اول هش‌هایی که با method ساخته می‌شوند
+        self.prefix = None
+
+    def _pool(self):
+        if self.pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=context,
+                                            initializer=_init_worker, initargs=(os.getpid(),))
+        return self.pool
+
+    # جای کار در صف وقتی آزاد می‌شود که کار تمام یا لغو شود؛ کاری که منتظرش پس از
+    # timeout رفته هنوز ممکن است در صف یا در حال اجرا باشد
+    def _release(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def _call(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise PasswordHasherBusy()
+            pool = self._pool()
+            try:
+                future = pool.submit(func, *args)
+            except BrokenProcessPool:
+                self.pool = None
+                future = None
+            else:
+                self.pending += 1
+        if future is None:
+            return func(*args)
+        future.add_done_callback(self._release)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise PasswordHasherBusy()
+        except BrokenProcessPool:
+            # a worker died (e.g. OOM); start a new pool next time and hash here
+            logging.getLogger(__name__).exception('password hash pool broke')
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = None
+            return func(*args)
+
+    def hash(self, password):
+        return self._call(_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        if self.prefix is None:
+            self.prefix = self.hash('').split('$', 1)[0]
+        return self._call(_verify, password_hash, password, self.method, self.prefix)
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+# محدودیت تلاش ناموفق ورود
+# Failed logins are counted per key (('user', name) and ('ip', address)) in
+# a sliding window; a key with `limits[kind]` failures in the last `window`
+# seconds is refused until the oldest of them leaves the window, before any
+# password is hashed. A successful login clears its username's failures.
+# Counts are per process. Keys are kept in order of their last failure, so
+# expired keys are dropped from the front as failures come in, and past
+# max_keys the least recently failed keys are evicted: a spray of distinct
+# usernames cannot grow the table.
+class LoginThrottle:
+    def __init__(self, limits, window=300.0, max_keys=100000):
+        self.limits = limits
+        self.window = window
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        # key -> زمان شکست‌ها؛ ترتیب بر اساس آخرین شکست
+        self.failures = OrderedDict()
+
+    # ثانیه تا مجاز شدن دوباره، یا 0
+    def retry_after(self, keys, now=None):
+        now = time.time() if now is None else now
+        wait = 0.0
+        with self.lock:
+            for key in keys:
+                times = self.failures.get(key)
+                if not times:
+                    continue
+                while times and times[0] <= now - self.window:
+                    times.popleft()
+                if not times:
+                    del self.failures[key]
+                elif len(times) >= self.limits[key[0]]:
+                    wait = max(wait, times[0] + self.window - now)
+        return wait
+
+    def failed(self, keys, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            for key in keys:
+                times = self.failures.get(key)
+                if times is None:
+                    times = self.failures[key] = deque(maxlen=self.limits[key[0]])
+                else:
+                    self.failures.move_to_end(key)
+                times.append(now)
+            self._prune(now)
+
+    def succeeded(self, keys):
+        with self.lock:
+            for key in keys:
+                self.failures.pop(key, None)
+
+    def _prune(self, now):
+        while self.failures:
+            times = next(iter(self.failures.values()))
+            if len(self.failures) <= self.max_keys and times[-1] > now - self.window:
+                return
+            self.failures.popitem(last=False)
+
+    def count(self):
+        return len(self.failures)
@@ -0,0 +1,152 @@
+import csv
+import io
+import json
+
+TEN_POINT_TOPIC = "سوال 10 امتیازی"
+CSV_FIELDS = ['id', 'category', 'level', 'time', 'qText',
+              'option0', 'option1', 'option2', 'option3', 'correct']
+FORMATS = ('csv', 'jsonl')
+# حداکثر تعداد خطاهایی که در گزارش import نگه داشته می‌شود
+MAX_REPORTED_ERRORS = 100
+
+
+# ورود و خروج دسته‌ای سؤالات
+# Files are read one record at a time: CSV with the CSV_FIELDS header, or
+# JSON Lines with one question object per line. Nothing holds the whole
+# file in memory; valid records go to QuestionBank.add_many() in batches.
+
+
+def _as_int(value, field):
+    if isinstance(value, bool):
+        raise ValueError(f"'{field}' باید عدد باشد")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{field}' باید عدد باشد")
+
+
+def _as_text(value, field):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"'{field}' خالی است")
+    return value.strip()
+
+
+# یک رکورد خام را بررسی و به شکل رکوردهای questions.json برمی‌گرداند
+def validate_question(record):
+    options = record.get('options')
+    if options is None:
+        options = [record.get(f'option{i}') for i in range(4)]
+    if not isinstance(options, list) or len(options) != 4:
+        raise ValueError('سؤال باید دقیقاً ۴ گزینه داشته باشد')
+
+    question = {
+        'qText': _as_text(record.get('qText'), 'qText'),
+        'options': [_as_text(option, 'options') for option in options],
+        'correct': _as_int(record.get('correct'), 'correct'),
+        'category': _as_text(record.get('category'), 'category'),
+        'time': _as_int(record.get('time'), 'time'),
+    }
+    if not 0 <= question['correct'] < 4:
+        raise ValueError("'correct' باید بین ۰ و ۳ باشد")
+    if question['time'] <= 0:
+        raise ValueError("'time' باید مثبت باشد")
+    if question['category'] == TEN_POINT_TOPIC:
+        question['level'] = 10
+    else:
+        question['level'] = _as_int(record.get('level'), 'level')
+        if question['level'] <= 0:
+            raise ValueError("'level' باید مثبت باشد")
+    if record.get('id'):
+        question['id'] = str(record['id'])
+    return question
+
+
+# (شماره‌ی خط، رکورد خام یا خطای خواندن)
+def read_records(stream, fmt):
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, ValueError(f'JSON نامعتبر: {e.msg}')
+                continue
+            yield line_number, record if isinstance(record, dict) else ValueError('رکورد باید یک شیء JSON باشد')
+    else:
+        raise ValueError(f"unknown format: {fmt}")
+
+
+def detect_format(filename):
+    return 'csv' if filename.lower().endswith('.csv') else 'jsonl'
+
+
+class ImportReport:
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = []
+
+    def error(self, line_number, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, message))
+
+    def as_dict(self):
+        return {'read': self.read, 'imported': self.imported, 'duplicates': self.duplicates,
+                'invalid': self.invalid, 'errors': self.errors}
+
+
+# سؤال‌های تکراری (qText یا id موجود در بانک یا همین فایل) کنار گذاشته می‌شوند
+def import_questions(bank, stream, fmt, batch_size=500):
+    report = ImportReport()
+    existing = bank.all()
+    seen_texts = {q.qText.strip() for q in existing}
+    seen_ids = {q.id for q in existing}
+
+    def valid_questions():
+        for line_number, record in read_records(stream, fmt):
+            report.read += 1
+            if isinstance(record, Exception):
+                report.error(line_number, str(record))
+                continue
+            try:
+                question = validate_question(record)
+            except ValueError as e:
+                report.error(line_number, str(e))
+                continue
+            if question['qText'] in seen_texts or question.get('id') in seen_ids:
+                report.duplicates += 1
+                continue
+            seen_texts.add(question['qText'])
+            if 'id' in question:
+                seen_ids.add(question['id'])
+            yield question
+
+    report.imported = bank.add_many(valid_questions(), batch_size)
+    return report
+
+
+def export_lines(questions, fmt):
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_FIELDS)
+        for q in questions:
+            writer.writerow([q['id'], q['category'], q['level'], q['time'], q['qText'],
+                             *q['options'], q['correct']])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    elif fmt == 'jsonl':
+        for q in questions:
+            yield json.dumps(q, ensure_ascii=False) + '\n'
+    else:
+        raise ValueError(f"unknown format: {fmt}")
@@ -0,0 +1,165 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from question_bank import ROUND_SIZE
+
+
+# انتخاب سؤال‌های تکراری‌نشده
+# Each (topic, level) of the bank gets one pool, shuffled once, and every
+# question a position in it; after an edit only the pools whose question
+# list changed are shuffled again. A player's answered questions
+# (completed_questions) become one integer bitset per pool, built in a
+# single pass over the list when the player is first seen or the pools
+# change, and updated in place as they answer. A draw ORs the players'
+# bitsets and takes free positions after a random offset, so its cost does
+# not depend on how many questions a player has answered (the bit
+# operations run in C over pool_size / 30 digits, not per question).
+#
+# When fewer than ROUND_SIZE questions are new to both players, the round
+# is filled with questions new to at least one of them, then with any;
+# a pool is never too small as long as the bank has ROUND_SIZE questions in
+# it.
+#
+# Players are cached LRU; an entry older than ttl is read again with
+# completed_of, so answers recorded by other workers are picked up.
+class PlayerHistory:
+    __slots__ = ('completed', 'bits', 'pools', 'loaded_at')
+
+    def __init__(self, completed, loaded_at):
+        self.completed = set(completed)
+        # (topic, level) -> bitset over that pool's positions
+        self.bits = {}
+        # pools the bitsets were built for
+        self.pools = None
+        self.loaded_at = loaded_at
+
+
+class QuestionSampler:
+    def __init__(self, bank, completed_of, cache_size=10000, ttl=300.0, rng=None):
+        self.bank = bank
+        self.completed_of = completed_of
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self.revision = None
+        self.source = None
+        # (topic, level) -> the bank's list the pool was shuffled from
+        self.lists = {}
+        # (topic, level) -> [Question] shuffled; a new dict whenever a pool changes
+        self.pools = {}
+        # question id -> ((topic, level), position)
+        self.positions = {}
+        self.players = OrderedDict()
+
+    def _refresh_pools(self):
+        revision = self.bank.revision()
+        if revision == self.revision:
+            return
+        source = self.bank.topic_levels()
+        if source is not self.source:
+            self.source, self.lists, self.pools, self.positions = source, {}, {}, {}
+            changed = list(source.items())
+        else:
+            changed = [(key, questions) for key, questions in list(source.items())
+                       if self.lists.get(key) is not questions]
+            changed += [(key, None) for key in self.lists if key not in source]
+        if changed:
+            pools = dict(self.pools)
+            for key, questions in changed:
+                # a question moved to another pool may already have its new position
+                for question in pools.pop(key, ()):
+                    if self.positions.get(question.id, (None,))[0] == key:
+                        del self.positions[question.id]
+                if questions is None:
+                    del self.lists[key]
+                    continue
+                pool = list(questions)
+                self.rng.shuffle(pool)
+                pools[key] = pool
+                self.lists[key] = questions
+                for position, question in enumerate(pool):
+                    self.positions[question.id] = (key, position)
+            self.pools = pools
+        self.revision = revision
+
+    # خواندن بازیکنانی که در cache نیستند یا کهنه شده‌اند، بیرون از قفل
+    def _load(self, players):
+        now = time.monotonic()
+        stale = [player for player in players
+                 if player not in self.players or now - self.players[player].loaded_at > self.ttl]
+        loaded = {player: PlayerHistory(self.completed_of(player), now) for player in stale}
+        with self.lock:
+            for player, history in loaded.items():
+                self.players[player] = history
+                self.players.move_to_end(player)
+            while len(self.players) > self.cache_size:
+                self.players.popitem(last=False)
+
+    def _history(self, player):
+        history = self.players.get(player)
+        if history is None:
+            # evicted between _load() and now
+            history = self.players[player] = PlayerHistory((), time.monotonic())
+        self.players.move_to_end(player)
+        if history.pools is not self.pools:
+            bits = {}
+            for qid in history.completed:
+                found = self.positions.get(qid)
+                if found is not None:
+                    bits[found[0]] = bits.get(found[0], 0) | (1 << found[1])
+            history.bits, history.pools = bits, self.pools
+        return history
+
+    # موقعیت یک بیت روشن در free، از یک نقطه‌ی تصادفی به بعد
+    def _pick(self, free, size):
+        start = self.rng.randrange(size)
+        high = free >> start
+        if high:
+            return start + (high & -high).bit_length() - 1
+        return (free & -free).bit_length() - 1
+
+    # count سؤال از (topic, level) که تا حد ممکن هیچ‌کدام از players ندیده‌اند؛
+    # None اگر این ترکیب کمتر از count سؤال دارد
+    def draw(self, topic, level, players, count=ROUND_SIZE):
+        self._load(players)
+        with self.lock:
+            self._refresh_pools()
+            key = (topic, level)
+            pool = self.pools.get(key, [])
+            if len(pool) < count:
+                return None
+            seen = [self._history(player).bits.get(key, 0) for player in players]
+            seen_by_any = seen_by_all = 0
+            if seen:
+                seen_by_all = seen[0]
+            for bits in seen:
+                seen_by_any |= bits
+                seen_by_all &= bits
+            everything = (1 << len(pool)) - 1
+            picked = []
+            taken = 0
+            for free in (everything & ~seen_by_any, everything & ~seen_by_all, everything):
+                free &= ~taken
+                while free and len(picked) < count:
+                    position = self._pick(free, len(pool))
+                    picked.append(position)
+                    taken |= 1 << position
+                    free &= ~(1 << position)
+            return [pool[position] for position in picked]
+
+    # True اگر بازیکن این سؤال را قبلاً جواب نداده بود
+    def mark(self, player, question_id):
+        self._load([player])
+        with self.lock:
+            self._refresh_pools()
+            history = self._history(player)
+            if question_id in history.completed:
+                return False
+            history.completed.add(question_id)
+            found = self.positions.get(question_id)
+            if found is not None:
+                history.bits[found[0]] = history.bits.get(found[0], 0) | (1 << found[1])
+            return True
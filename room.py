@@ -0,0 +1,279 @@
+import threading
+
+from question_bank import ROUND_SIZE
+
+TEN_POINT_TOPIC = "سوال 10 امتیازی"
+
+# مهلت‌های سمت سرور (ثانیه): انتخاب موضوع، و زمان هر سؤال (فیلد time) به علاوه‌ی
+# ANSWER_GRACE_SECONDS برای تأخیر شبکه
+TOPIC_SELECTION_SECONDS = 60
+ANSWER_GRACE_SECONDS = 2
+DEFAULT_QUESTION_SECONDS = 60
+# اگر هر دو بازیکن این تعداد مهلت پشت سر هم را از دست بدهند مسابقه رها شده حساب می‌شود
+ABANDON_AFTER_TIMEOUTS = 3
+# پاسخی که با تمام شدن مهلت ثبت می‌شود
+TIMED_OUT = -1
+
+
+def combination_key(topic, level):
+    return f"{topic}-{level}"
+
+
+# انتقال نامعتبر در وضعیت فعلی اتاق، مثلاً پاسخ دوباره به سؤالی که ثبت شده
+class RoomStateError(Exception):
+    pass
+
+
+# اتاق بازی و انتقال‌های وضعیت آن
+# Every transition checks its preconditions before changing anything, so a
+# rejected call leaves the room untouched. The in-memory store runs
+# transitions under the room's own lock; the SQLite store rebuilds a Room
+# from JSON per attempt and relies on compare-and-set instead.
+#
+# Tens of thousands of rooms can be live at once, so a room is kept small:
+# slotted, per-player state in two-element lists indexed like `players`,
+# questions as references to the bank's shared Question objects, and
+# `selectable` is the bank's selectable() dict at creation time, shared by
+# every room created from the same bank version (never mutated); each
+# player's choices are that minus their used combinations.
+#
+# Deadlines are kept by the room, not the client: deadlines[i] is when
+# player i must next act (pick a topic or answer their current question),
+# 0 if nothing is expected of them. Answers after the deadline count as
+# timeouts, and the GameManager's timer calls timeout_answer() /
+# timeout_selection() once a deadline passes.
+class Room:
+    __slots__ = ('room_id', 'lock', 'players', 'turn_index', 'status', 'total_rounds',
+                 'current_round', 'questions', 'scores', 'answered', 'current_topic',
+                 'current_level', 'created_at', 'last_activity', 'question_started',
+                 'deadlines', 'timeouts', 'current_question_index', 'selectable',
+                 'used_combinations', 'used_10_point_question', 'used_remove_two', 'ratings',
+                 'transitions')
+
+    # ratings: رتبه‌ی دو بازیکن هنگام جفت شدن، برای محاسبه‌ی Elo در پایان مسابقه
+    def __init__(self, room_id, players, turn_index, selectable, created_at, total_rounds=6,
+                 ratings=None):
+        self.room_id = room_id
+        self.lock = threading.Lock()
+        self.players = tuple(players)
+        self.turn_index = turn_index
+        self.status = 'waiting_for_topic_selection'
+        self.total_rounds = total_rounds
+        self.current_round = 0
+        self.questions = ()
+        self.scores = [0, 0]
+        self.answered = [0, 0]
+        self.current_topic = ''
+        self.current_level = 0
+        self.created_at = created_at
+        self.last_activity = created_at
+        # زمان شروع سؤال فعلی هر بازیکن، مهلت اقدام بعدی و تعداد مهلت‌های
+        # از دست رفته‌ی پشت سر هم
+        self.question_started = [0, 0]
+        self.deadlines = [0, 0]
+        self.deadlines[turn_index] = created_at + TOPIC_SELECTION_SECONDS
+        self.timeouts = [0, 0]
+        self.current_question_index = 0
+        self.selectable = selectable
+        self.used_combinations = ([], [])
+        self.used_10_point_question = [False, False]
+        self.used_remove_two = [0, 0]
+        self.ratings = tuple(ratings) if ratings else None
+        # تعداد تغییرات ثبت‌شده (GameManager.update_room)؛ ترتیب رویدادهای match_log
+        self.transitions = 0
+
+    # خواندن
+    @property
+    def turn(self):
+        return self.players[self.turn_index]
+
+    def has_player(self, player):
+        return player in self.players
+
+    def _index(self, player):
+        try:
+            return self.players.index(player)
+        except ValueError:
+            raise RoomStateError('شما عضو این اتاق بازی نیستید')
+
+    def score(self, player):
+        return self.scores[self._index(player)]
+
+    def scores_by_player(self):
+        return dict(zip(self.players, self.scores))
+
+    def answered_count(self, player):
+        return self.answered[self._index(player)]
+
+    def question(self, number):
+        return self.questions[number] if number < len(self.questions) else None
+
+    def can_select(self, player, topic, level):
+        i = self._index(player)
+        if combination_key(topic, level) not in self.selectable:
+            return False
+        if topic == TEN_POINT_TOPIC:
+            return not self.used_10_point_question[i]
+        return (topic, level) not in self.used_combinations[i]
+
+    def overdue(self, player, now):
+        deadline = self.deadlines[self._index(player)]
+        return bool(deadline) and now >= deadline
+
+    # زمان پاسخ به سؤال فعلی بازیکن از شروع آن
+    def answer_latency(self, player, now):
+        return now - self.question_started[self._index(player)]
+
+    # ترکیب‌های قابل انتخاب بازیکن: [[topic, level]]
+    def selectable_for(self, player):
+        return [[topic, level] for topic, level in self.selectable.values()
+                if self.can_select(player, topic, level)]
+
+    # انتقال‌ها
+    def _require(self, condition, message):
+        if not condition:
+            raise RoomStateError(message)
+
+    def select_topic(self, player, topic, level, questions, now):
+        i = self._index(player)
+        self._require(self.status == 'waiting_for_topic_selection', 'این دور قبلاً شروع شده است')
+        self._require(self.turn_index == i, 'نوبت انتخاب با حریف است')
+        self._require(self.can_select(player, topic, level), 'این ترکیب موضوع و سطح قابل انتخاب نیست')
+        self._require(len(questions) == ROUND_SIZE, 'تعداد سؤالات دور نامعتبر است')
+
+        self.questions = tuple(questions)
+        self.current_round += 1
+        self.answered = [0, 0]
+        self.status = 'in_progress'
+        self.current_topic = topic
+        self.current_level = level
+        self.current_question_index = 0
+        self.timeouts[i] = 0
+        self.question_started = [now, now]
+        self.deadlines = [self._question_deadline(0, now)] * 2
+
+        if topic == TEN_POINT_TOPIC:
+            self.used_10_point_question[i] = True
+        else:
+            self.used_combinations[i].append((topic, level))
+        return self.current_round
+
+    # انتخاب خودکار پس از گذشتن مهلت انتخاب‌کننده؛ ترکیب را GameManager می‌دهد
+    def timeout_selection(self, player, topic, level, questions, now):
+        i = self._index(player)
+        self._require(self.overdue(player, now), 'مهلت انتخاب موضوع هنوز تمام نشده است')
+        current_round = self.select_topic(player, topic, level, questions, now)
+        self.timeouts[i] += 1
+        return current_round
+
+    def _question_deadline(self, number, now):
+        question = self.questions[number]
+        limit = question.time if question is not None else DEFAULT_QUESTION_SECONDS
+        return now + limit + ANSWER_GRACE_SECONDS
+
+    # question_number: تعداد پاسخ‌های قبلی بازیکن وقتی سؤال را دید. پاسخی که به
+    # سؤال دیگری تعلق دارد (ارسال دوباره، یا فرمی که پس از ثبت خودکار مهلت رسید)
+    # به سؤال فعلی نسبت داده نمی‌شود.
+    def submit_answer(self, player, answer_index, now, question_number=None):
+        i = self._index(player)
+        self._require(self.status == 'in_progress', 'دوری در جریان نیست')
+        self._require(self.answered[i] < ROUND_SIZE, 'به همه‌ی سؤالات این دور پاسخ داده‌اید')
+        self._require(question_number is None or question_number == self.answered[i],
+                      'این پاسخ مربوط به سؤال فعلی نیست')
+
+        # پاسخی که بعد از مهلت برسد پاسخ نداده حساب می‌شود
+        if self.overdue(player, now):
+            answer_index = TIMED_OUT
+        # سؤالی که در این فاصله از بانک حذف شده پاسخ غلط حساب می‌شود
+        question = self.questions[self.answered[i]]
+        if question is not None and answer_index == question.correct:
+            self.scores[i] += 10 if question.level == 10 else question.level
+        self.timeouts[i] = self.timeouts[i] + 1 if answer_index == TIMED_OUT else 0
+        self.answered[i] += 1
+        if self.answered[i] < ROUND_SIZE:
+            self.question_started[i] = now
+            self.deadlines[i] = self._question_deadline(self.answered[i], now)
+        else:
+            self.deadlines[i] = 0
+
+        if all(count >= ABANDON_AFTER_TIMEOUTS for count in self.timeouts):
+            self.finish()
+        elif all(count >= ROUND_SIZE for count in self.answered):
+            self.advance_round(now)
+        return self.status
+
+    # ثبت پاسخ خالی برای سؤالی که مهلتش گذشته است
+    def timeout_answer(self, player, now):
+        self._require(self.overdue(player, now), 'مهلت این سؤال هنوز تمام نشده است')
+        return self.submit_answer(player, TIMED_OUT, now)
+
+    # پایان دور: نوبت انتخاب به بازیکن دیگر می‌رسد یا مسابقه تمام می‌شود
+    def advance_round(self, now):
+        self._require(self.status == 'in_progress', 'دوری در جریان نیست')
+        self._require(all(count >= ROUND_SIZE for count in self.answered),
+                      'هنوز همه به سؤالات این دور پاسخ نداده‌اند')
+        if self.current_round >= self.total_rounds:
+            self.finish()
+            return
+        self.turn_index = 1 - self.turn_index
+        self.status = 'waiting_for_topic_selection'
+        self.deadlines = [0, 0]
+        self.deadlines[self.turn_index] = now + TOPIC_SELECTION_SECONDS
+
+    def finish(self):
+        self._require(self.status != 'finished', 'مسابقه قبلاً تمام شده است')
+        self.status = 'finished'
+        self.deadlines = [0, 0]
+
+    # شکل JSON برای SQLiteRoomStore؛ سؤال‌ها فقط با شناسه ذخیره می‌شوند
+    def to_dict(self):
+        return {
+            'players': list(self.players),
+            'turn': self.turn,
+            'status': self.status,
+            'total_rounds': self.total_rounds,
+            'current_round': self.current_round,
+            'questions': [q.id if q is not None else None for q in self.questions],
+            'scores': list(self.scores),
+            'answered': list(self.answered),
+            'current_topic': self.current_topic,
+            'current_level': self.current_level,
+            'created_at': self.created_at,
+            'last_activity': self.last_activity,
+            'question_started': list(self.question_started),
+            'deadlines': list(self.deadlines),
+            'timeouts': list(self.timeouts),
+            'current_question_index': self.current_question_index,
+            'selectable': self.selectable,
+            'used_combinations': [[list(c) for c in used] for used in self.used_combinations],
+            'used_10_point_question': list(self.used_10_point_question),
+            'used_remove_two': list(self.used_remove_two),
+            'ratings': list(self.ratings) if self.ratings else None,
+            'transitions': self.transitions,
+        }
+
+    # question_lookup(id) -> Question یا None
+    @classmethod
+    def from_dict(cls, room_id, data, question_lookup):
+        room = cls(room_id, data['players'], data['players'].index(data['turn']),
+                   data['selectable'], data['created_at'], data['total_rounds'],
+                   data.get('ratings'))
+        room.status = data['status']
+        room.current_round = data['current_round']
+        room.questions = tuple(question_lookup(qid) if qid is not None else None
+                               for qid in data['questions'])
+        room.scores = data['scores']
+        room.answered = data['answered']
+        room.current_topic = data['current_topic']
+        room.current_level = data['current_level']
+        room.last_activity = data['last_activity']
+        # ردیف‌های قدیمی‌تر مهلت ندارند
+        room.question_started = data.get('question_started', [data.get('question_start_time', 0)] * 2)
+        room.deadlines = data.get('deadlines', [0, 0])
+        room.timeouts = data.get('timeouts', [0, 0])
+        room.current_question_index = data['current_question_index']
+        room.used_combinations = tuple([tuple(c) for c in used] for used in data['used_combinations'])
+        room.used_10_point_question = data['used_10_point_question']
+        room.used_remove_two = data['used_remove_two']
+        room.transitions = data.get('transitions', 0)
+        return room
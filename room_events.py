@@ -0,0 +1,94 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+
+
+# اعلان تغییر وضعیت اتاق‌ها
+# Each key ('room:<id>' or 'player:<name>') has a version counter and its own
+# Condition, so publishing to one room only wakes the streams watching it.
+# Channels exist only while someone is subscribed. Under the ASGI server
+# (see asgi) waiters are asyncio futures instead of threads: publish() wakes
+# them through their event loop's call_soon_threadsafe, and the Condition is
+# only created once a thread waits on the channel.
+class RoomEventHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {}
+
+    @contextmanager
+    def subscribe(self, key):
+        with self.lock:
+            channel = self.channels.get(key)
+            if channel is None:
+                channel = self.channels[key] = [0, None, 0, []]
+            channel[2] += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                channel[2] -= 1
+                if channel[2] == 0:
+                    del self.channels[key]
+
+    def version(self, key):
+        with self.lock:
+            channel = self.channels.get(key)
+            return channel[0] if channel else 0
+
+    def publish(self, *keys):
+        with self.lock:
+            for key in keys:
+                channel = self.channels.get(key)
+                if channel is None:
+                    continue
+                channel[0] += 1
+                if channel[1] is not None:
+                    channel[1].notify_all()
+                for loop, future in channel[3]:
+                    try:
+                        loop.call_soon_threadsafe(_wake, future)
+                    except RuntimeError:
+                        # event loop بسته شده است
+                        pass
+                channel[3].clear()
+
+    # منتظر می‌ماند تا نسخه‌ی کلید از seen بیشتر شود یا timeout برسد؛
+    # نسخه‌ی فعلی را برمی‌گرداند. فقط داخل subscribe() صدا زده شود.
+    def wait(self, key, seen, timeout):
+        with self.lock:
+            channel = self.channels[key]
+            if channel[1] is None:
+                channel[1] = threading.Condition(self.lock)
+            channel[1].wait_for(lambda: channel[0] != seen, timeout)
+            return channel[0]
+
+    # نسخه‌ی asyncio از wait()؛ به جای یک thread فقط یک Future منتظر می‌ماند.
+    # interrupt: Future اختیاری (مثلاً قطع اتصال کلاینت) که انتظار را زودتر تمام می‌کند
+    async def wait_async(self, key, seen, timeout, interrupt=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            channel = self.channels[key]
+            if channel[0] != seen:
+                return channel[0]
+            channel[3].append((loop, future))
+        timer = loop.call_later(timeout, _wake, future)
+        on_interrupt = lambda _: _wake(future)
+        if interrupt is not None:
+            interrupt.add_done_callback(on_interrupt)
+        try:
+            await future
+        finally:
+            timer.cancel()
+            if interrupt is not None:
+                interrupt.remove_done_callback(on_interrupt)
+            with self.lock:
+                if (loop, future) in channel[3]:
+                    channel[3].remove((loop, future))
+        with self.lock:
+            return channel[0]
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,164 @@
+import atexit
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from db import ThreadLocalSQLite
+from room import Room
+
+
+# تصویر پشتیبان اتاق‌های حافظه
+# The in-memory room store lives and dies with its process, so a restart or
+# a debug reload used to drop every live match. RoomSnapshotter copies the
+# store to a local SQLite file every `interval` seconds on its own thread:
+# only rooms changed since the previous snapshot are written (removed ones
+# deleted), the waiting queue is rewritten only when it changed, and each
+# snapshot is a single transaction, so a crash part way leaves the previous
+# snapshot whole. restore() loads the file into the empty store at startup.
+#
+# Rooms are stored as Room.to_dict() JSON with question ids, like the SQLite
+# room store, and rebuilt with question_lookup. The selectable dict, most of
+# a room's JSON and shared by every room of a bank version, is stored once
+# in its own table and shared again on restore.
+class RoomSnapshotter:
+    def __init__(self, path, store, question_lookup, interval=2.0, busy_timeout=5.0):
+        self.path = path
+        self.store = store
+        self.question_lookup = question_lookup
+        self.interval = interval
+        self.db = ThreadLocalSQLite(path, busy_timeout)
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.stopping = False
+        self.thread = None
+        # آخرین snapshot: (تعداد اتاق‌های نوشته یا حذف‌شده، ثانیه)
+        self.last_write = (0, 0.0)
+        # id(selectable) -> (selectable, key); the dict is kept so its id stays unique
+        self.selectable_keys = {}
+        self._init_schema()
+
+    def _init_schema(self):
+        self.db.conn().executescript('''
+            CREATE TABLE IF NOT EXISTS rooms (
+                room_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                selectable TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS selectables (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS waiting_players (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                player TEXT NOT NULL,
+                rating REAL NOT NULL,
+                bucket INTEGER NOT NULL,
+                enqueued_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            );
+        ''')
+
+    # تعداد اتاق‌های بازیابی‌شده را برمی‌گرداند
+    def restore(self):
+        conn = self.db.conn()
+        with self.db.transaction():
+            conn.execute('DELETE FROM selectables WHERE key NOT IN (SELECT selectable FROM rooms)')
+        selectables = {key: json.loads(data) for key, data in conn.execute('SELECT key, data FROM selectables')}
+        for key, selectable in selectables.items():
+            self.selectable_keys[id(selectable)] = (selectable, key)
+        # many rooms share questions; look each one up once
+        questions = {}
+
+        def lookup(qid):
+            if qid not in questions:
+                questions[qid] = self.question_lookup(qid)
+            return questions[qid]
+
+        rooms = []
+        for room_id, data, version, selectable in conn.execute(
+                'SELECT room_id, data, version, selectable FROM rooms ORDER BY created_at'):
+            data = json.loads(data)
+            data['selectable'] = selectables[selectable]
+            rooms.append((room_id, Room.from_dict(room_id, data, lookup), version))
+        waiting = conn.execute(
+            'SELECT player, rating, bucket, enqueued_at FROM waiting_players ORDER BY seq').fetchall()
+        row = conn.execute("SELECT value FROM meta WHERE name = 'room_counter'").fetchone()
+        self.store.restore(rooms, waiting, int(row[0]) if row else 0)
+        return len(rooms)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='room-snapshot', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.stopping, self.interval)
+                if self.stopping:
+                    return
+            try:
+                self.write()
+            except Exception:
+                logging.getLogger(__name__).exception('room snapshot failed')
+
+    def write(self):
+        with self.write_lock:
+            start = time.perf_counter()
+            room_ids, waiting, room_counter = self.store.take_changes()
+            if not room_ids and waiting is None:
+                return 0
+            selectables = []
+            try:
+                rows = []
+                deleted = []
+                for room_id in room_ids:
+                    snapshot = self.store.snapshot_room(room_id)
+                    if snapshot is None:
+                        deleted.append((room_id,))
+                        continue
+                    data, version = snapshot
+                    selectable = data.pop('selectable')
+                    known = self.selectable_keys.get(id(selectable))
+                    if known is None:
+                        text = json.dumps(selectable, ensure_ascii=False, separators=(',', ':'))
+                        known = (selectable, hashlib.sha1(text.encode('utf-8')).hexdigest()[:16])
+                        self.selectable_keys[id(selectable)] = known
+                        selectables.append((id(selectable), known[1], text))
+                    rows.append((room_id, json.dumps(data, ensure_ascii=False, separators=(',', ':')),
+                                 version, data['created_at'], known[1]))
+                with self.db.transaction() as conn:
+                    conn.executemany('INSERT OR IGNORE INTO selectables (key, data) VALUES (?, ?)',
+                                     [(key, text) for _, key, text in selectables])
+                    conn.executemany('INSERT OR REPLACE INTO rooms (room_id, data, version, created_at, selectable) '
+                                     'VALUES (?, ?, ?, ?, ?)', rows)
+                    conn.executemany('DELETE FROM rooms WHERE room_id = ?', deleted)
+                    if waiting is not None:
+                        conn.execute('DELETE FROM waiting_players')
+                        conn.executemany('INSERT INTO waiting_players (player, rating, bucket, enqueued_at) '
+                                         'VALUES (?, ?, ?, ?)', waiting)
+                    conn.executemany('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)',
+                                     [('room_counter', room_counter), ('written_at', time.time())])
+            except Exception:
+                # برای snapshot بعدی نگه داشته می‌شود
+                for selectable_id, _, _ in selectables:
+                    self.selectable_keys.pop(selectable_id, None)
+                self.store.mark_changed(room_ids, waiting is not None)
+                raise
+            self.last_write = (len(room_ids), time.perf_counter() - start)
+            return len(room_ids)
+
+    def close(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.write()
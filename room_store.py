@@ -0,0 +1,481 @@
+import bisect
+import heapq
+import json
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from db import ThreadLocalSQLite
+from room import Room
+
+
+# ذخیره‌سازی وضعیت اتاق‌ها و صف انتظار
+# GameManager talks to one of these stores. Both expose the same methods:
+#   transaction()                  -> context manager making a group of calls atomic
+#   enqueue / remove_waiting / waiting_entry / waiting_buckets / bucket_head
+#   waiting_count / waiting_by_bucket   (rating buckets, see matchmaking)
+#   next_room_id / insert / get / compare_and_set / update / delete
+#   room_of(player) / reap(now) / room_count
+#   room_deadlines()               -> [(room_id, player, deadline)] to reschedule after a restart
+# A room is a room.Room; get() returns (room, version) and update(room_id,
+# mutate) calls mutate with the room. The SQLite store keeps Room.to_dict()
+# as JSON and hands out a fresh Room per read.
+#
+# The SQLite store survives restarts by itself. The in-memory store also
+# tracks which rooms changed and whether the queue did, for
+# room_snapshot.RoomSnapshotter:
+#   take_changes() / snapshot_room(room_id) / mark_changed(...) / restore(...)
+
+
+# زمان انقضای اتاق‌ها
+# A room expires ttl seconds after its last activity, where the ttl depends
+# on its status, and never later than max_age after it was created.
+class RoomExpiryPolicy:
+    def __init__(self, idle_ttl, in_progress_ttl, finished_ttl, max_age):
+        self.idle_ttl = idle_ttl
+        self.in_progress_ttl = in_progress_ttl
+        self.finished_ttl = finished_ttl
+        self.max_age = max_age
+
+    @staticmethod
+    def reason(status):
+        if status in ('in_progress', 'finished'):
+            return status
+        return 'idle'
+
+    def deadline(self, room):
+        ttl = {
+            'idle': self.idle_ttl,
+            'in_progress': self.in_progress_ttl,
+            'finished': self.finished_ttl,
+        }[self.reason(room.status)]
+        return min(room.last_activity + ttl, room.created_at + self.max_age)
+
+
+class InMemoryRoomStore:
+    # حالت پیش‌فرض: یک پروسه، داده در حافظه
+    # Lookups are O(1): player_rooms maps a player to their room, and each
+    # rating bucket's queue is a deque of (ticket, player) plus the shared
+    # player -> (ticket, rating, bucket, enqueued_at) dict `waiting`; the
+    # non-empty buckets are kept sorted in bucket_keys. Removing a player just
+    # drops the dict entry; the stale deque entry is skipped when it reaches
+    # the front, and an emptied bucket is dropped whole. Expiry uses a min-heap of
+    # (deadline, room_id) with the same lazy invalidation against deadlines.
+    # update() holds only that room's lock while mutate runs, and the store
+    # lock just for the bookkeeping afterwards, so different rooms are
+    # updated in parallel.
+    def __init__(self, expiry):
+        self.expiry = expiry
+        self.lock = threading.RLock()
+        self.rooms = {}
+        self.versions = {}
+        self.deadlines = {}
+        self.expiry_heap = []
+        self.player_rooms = {}
+        self.waiting = {}
+        self.waiting_queues = {}
+        self.bucket_keys = []
+        self.bucket_counts = {}
+        self.ticket_counter = 0
+        self.room_counter = 0
+        # تغییرات از آخرین snapshot
+        self.changed_rooms = set()
+        self.waiting_changed = False
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            yield
+
+    # صف انتظار
+    def enqueue(self, player, rating, bucket, now):
+        with self.lock:
+            if player in self.waiting:
+                return
+            self.ticket_counter += 1
+            self.waiting[player] = (self.ticket_counter, rating, bucket, now)
+            queue = self.waiting_queues.get(bucket)
+            if queue is None:
+                queue = self.waiting_queues[bucket] = deque()
+                bisect.insort(self.bucket_keys, bucket)
+            queue.append((self.ticket_counter, player))
+            self.bucket_counts[bucket] = self.bucket_counts.get(bucket, 0) + 1
+            self.waiting_changed = True
+
+    def remove_waiting(self, player):
+        with self.lock:
+            entry = self.waiting.pop(player, None)
+            if entry is None:
+                return
+            self.waiting_changed = True
+            bucket = entry[2]
+            self.bucket_counts[bucket] -= 1
+            if not self.bucket_counts[bucket]:
+                del self.bucket_counts[bucket]
+                del self.waiting_queues[bucket]
+                del self.bucket_keys[bisect.bisect_left(self.bucket_keys, bucket)]
+
+    def waiting_entry(self, player):
+        entry = self.waiting.get(player)
+        return entry[1:] if entry else None
+
+    def waiting_buckets(self, lo, hi):
+        with self.lock:
+            start = 0 if lo is None else bisect.bisect_left(self.bucket_keys, lo)
+            end = len(self.bucket_keys) if hi is None else bisect.bisect_right(self.bucket_keys, hi)
+            return self.bucket_keys[start:end]
+
+    def bucket_head(self, bucket, exclude=None):
+        with self.lock:
+            queue = self.waiting_queues.get(bucket)
+            if not queue:
+                return None
+            while self.waiting.get(queue[0][1], (None,))[0] != queue[0][0]:
+                queue.popleft()
+            for ticket, player in queue:
+                entry = self.waiting.get(player)
+                if player != exclude and entry is not None and entry[0] == ticket:
+                    return player, entry[1], entry[3]
+            return None
+
+    def waiting_count(self):
+        return len(self.waiting)
+
+    def waiting_by_bucket(self):
+        with self.lock:
+            return dict(self.bucket_counts)
+
+    # اتاق‌ها
+    def next_room_id(self):
+        with self.lock:
+            room_id = f"room_{self.room_counter}"
+            self.room_counter += 1
+            return room_id
+
+    def insert(self, room_id, room):
+        with self.lock:
+            self.rooms[room_id] = room
+            self.versions[room_id] = 0
+            for player in room.players:
+                self.player_rooms[player] = room_id
+            self.changed_rooms.add(room_id)
+            self._schedule(room_id, room)
+
+    # The live room is returned; callers treat it as read-only and go
+    # through update() for changes.
+    def get(self, room_id):
+        with self.lock:
+            room = self.rooms.get(room_id)
+            if room is None:
+                return None, None
+            return room, self.versions[room_id]
+
+    def compare_and_set(self, room_id, expected_version, room):
+        current = self.rooms.get(room_id)
+        if current is None:
+            return False
+        with current.lock, self.lock:
+            if self.versions.get(room_id) != expected_version:
+                return False
+            self.rooms[room_id] = room
+            self.versions[room_id] = expected_version + 1
+            self.changed_rooms.add(room_id)
+            self._schedule(room_id, room)
+            return True
+
+    def update(self, room_id, mutate):
+        room = self.rooms.get(room_id)
+        if room is None:
+            raise KeyError(room_id)
+        with room.lock:
+            # the room may have been reaped while we waited for its lock
+            if self.rooms.get(room_id) is not room:
+                raise KeyError(room_id)
+            result = mutate(room)
+            with self.lock:
+                if room_id in self.versions:
+                    self.versions[room_id] += 1
+                    self.changed_rooms.add(room_id)
+                    self._schedule(room_id, room)
+            return result
+
+    def delete(self, room_id):
+        with self.lock:
+            room = self.rooms.pop(room_id, None)
+            self.versions.pop(room_id, None)
+            self.deadlines.pop(room_id, None)
+            if room is not None:
+                self.changed_rooms.add(room_id)
+                for player in room.players:
+                    if self.player_rooms.get(player) == room_id:
+                        del self.player_rooms[player]
+
+    def room_of(self, player):
+        return self.player_rooms.get(player)
+
+    def _schedule(self, room_id, room):
+        deadline = self.expiry.deadline(room)
+        if self.deadlines.get(room_id) == deadline:
+            return
+        self.deadlines[room_id] = deadline
+        heapq.heappush(self.expiry_heap, (deadline, room_id))
+        # Superseded entries normally pop out on their own; rebuild if
+        # frequent updates let them pile up.
+        if len(self.expiry_heap) > 2 * len(self.deadlines) + 64:
+            self.expiry_heap = [(d, r) for r, d in self.deadlines.items()]
+            heapq.heapify(self.expiry_heap)
+
+    # اتاق‌های منقضی‌شده را حذف می‌کند و [(room_id, status)] برمی‌گرداند
+    def reap(self, now):
+        reaped = []
+        with self.lock:
+            while self.expiry_heap and self.expiry_heap[0][0] <= now:
+                deadline, room_id = heapq.heappop(self.expiry_heap)
+                if self.deadlines.get(room_id) != deadline:
+                    continue
+                reaped.append((room_id, self.rooms[room_id].status))
+                self.delete(room_id)
+        return reaped
+
+    def room_count(self):
+        return len(self.rooms)
+
+    def room_deadlines(self):
+        with self.lock:
+            rooms = list(self.rooms.items())
+        return [(room_id, player, deadline) for room_id, room in rooms
+                for player, deadline in zip(room.players, room.deadlines) if deadline]
+
+    # snapshot
+    # take_changes() hands over (changed room ids, queue or None if unchanged,
+    # room counter) and starts a new change set; the rooms themselves are read
+    # afterwards with snapshot_room(), one room lock at a time, so taking a
+    # snapshot holds the store lock only for the swap.
+    def take_changes(self):
+        with self.lock:
+            room_ids, self.changed_rooms = self.changed_rooms, set()
+            waiting = None
+            if self.waiting_changed:
+                self.waiting_changed = False
+                waiting = [(player, rating, bucket, enqueued_at) for player, (_, rating, bucket, enqueued_at)
+                           in sorted(self.waiting.items(), key=lambda item: item[1][0])]
+            return room_ids, waiting, self.room_counter
+
+    # (Room.to_dict(), version)، یا None اگر اتاق حذف شده باشد
+    def snapshot_room(self, room_id):
+        room = self.rooms.get(room_id)
+        if room is None:
+            return None
+        with room.lock:
+            if self.rooms.get(room_id) is not room:
+                return None
+            return room.to_dict(), self.versions[room_id]
+
+    # برای snapshot بعدی، اگر نوشتن این یکی ناموفق بود
+    def mark_changed(self, room_ids, waiting):
+        with self.lock:
+            self.changed_rooms.update(room_ids)
+            self.waiting_changed = self.waiting_changed or waiting
+
+    # rooms: [(room_id, room, version)] به ترتیب ساخت؛ waiting به ترتیب ورود به صف.
+    # چیزی که بازیابی می‌شود تغییر حساب نمی‌شود.
+    def restore(self, rooms, waiting, room_counter):
+        with self.lock:
+            for room_id, room, version in rooms:
+                self.rooms[room_id] = room
+                self.versions[room_id] = version
+                for player in room.players:
+                    self.player_rooms[player] = room_id
+                self._schedule(room_id, room)
+            for player, rating, bucket, enqueued_at in waiting:
+                self.enqueue(player, rating, bucket, enqueued_at)
+            self.room_counter = max(self.room_counter, room_counter)
+            self.changed_rooms.clear()
+            self.waiting_changed = False
+
+
+class SQLiteRoomStore:
+    # حالت چند پروسه‌ای: همه‌ی workerهای gunicorn یک فایل SQLite مشترک دارند.
+    # Room changes are compare-and-set on a version column, so a write based
+    # on a stale read is rejected instead of overwriting another worker.
+    # question_lookup(id) -> Question: سؤال‌های اتاق با شناسه ذخیره می‌شوند
+    def __init__(self, path, expiry, question_lookup, busy_timeout=5.0):
+        self.path = path
+        self.expiry = expiry
+        self.question_lookup = question_lookup
+        self.db = ThreadLocalSQLite(path, busy_timeout)
+        self.transaction = self.db.transaction
+        self._init_schema()
+
+    def _init_schema(self):
+        conn = self.db.conn()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS rooms (
+                room_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                player1 TEXT NOT NULL,
+                player2 TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS rooms_player1 ON rooms(player1);
+            CREATE INDEX IF NOT EXISTS rooms_player2 ON rooms(player2);
+            CREATE TABLE IF NOT EXISTS waiting_players (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                player TEXT NOT NULL UNIQUE,
+                rating REAL NOT NULL DEFAULT 0,
+                bucket INTEGER NOT NULL DEFAULT 0,
+                enqueued_at REAL NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        ''')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(rooms)')}
+        if 'expires_at' not in columns:
+            conn.execute("ALTER TABLE rooms ADD COLUMN status TEXT NOT NULL DEFAULT ''")
+            conn.execute('ALTER TABLE rooms ADD COLUMN expires_at REAL NOT NULL DEFAULT 0')
+            conn.execute('UPDATE rooms SET expires_at = created_at + ?', (self.expiry.max_age,))
+        conn.execute('DROP INDEX IF EXISTS rooms_created_at')
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(waiting_players)')}
+        if 'bucket' not in columns:
+            conn.execute('ALTER TABLE waiting_players ADD COLUMN rating REAL NOT NULL DEFAULT 0')
+            conn.execute('ALTER TABLE waiting_players ADD COLUMN bucket INTEGER NOT NULL DEFAULT 0')
+            conn.execute('ALTER TABLE waiting_players ADD COLUMN enqueued_at REAL NOT NULL DEFAULT 0')
+        conn.execute('CREATE INDEX IF NOT EXISTS waiting_players_bucket ON waiting_players(bucket, seq)')
+        # user_version 1: Room.to_dict(). Older room rows use the previous JSON
+        # layout; rooms live at most max_age, so they are dropped, not converted.
+        if conn.execute('PRAGMA user_version').fetchone()[0] < 1:
+            conn.execute('DELETE FROM rooms')
+            conn.execute('PRAGMA user_version = 1')
+        conn.execute('CREATE INDEX IF NOT EXISTS rooms_expires_at ON rooms(expires_at)')
+
+    # transaction() is ThreadLocalSQLite.transaction (BEGIN IMMEDIATE), so
+    # the whole find-room/enqueue/pair sequence is serialised across processes.
+
+    # صف انتظار
+    def enqueue(self, player, rating, bucket, now):
+        self.db.conn().execute(
+            'INSERT OR IGNORE INTO waiting_players (player, rating, bucket, enqueued_at) '
+            'VALUES (?, ?, ?, ?)', (player, rating, bucket, now))
+
+    def remove_waiting(self, player):
+        self.db.conn().execute('DELETE FROM waiting_players WHERE player = ?', (player,))
+
+    def waiting_entry(self, player):
+        return self.db.conn().execute(
+            'SELECT rating, bucket, enqueued_at FROM waiting_players WHERE player = ?',
+            (player,)).fetchone()
+
+    # هر bucket بعدی با یک جستجوی ایندکس پیدا می‌شود، بدون پیمایش کل صف
+    def waiting_buckets(self, lo, hi):
+        conn = self.db.conn()
+        buckets = []
+        row = conn.execute('SELECT MIN(bucket) FROM waiting_players WHERE bucket >= ?',
+                           (lo if lo is not None else -2 ** 62,)).fetchone()
+        while row[0] is not None and (hi is None or row[0] <= hi):
+            buckets.append(row[0])
+            row = conn.execute('SELECT MIN(bucket) FROM waiting_players WHERE bucket > ?',
+                               (row[0],)).fetchone()
+        return buckets
+
+    def bucket_head(self, bucket, exclude=None):
+        return self.db.conn().execute(
+            'SELECT player, rating, enqueued_at FROM waiting_players '
+            'WHERE bucket = ? AND player IS NOT ? ORDER BY seq LIMIT 1',
+            (bucket, exclude)).fetchone()
+
+    def waiting_count(self):
+        return self.db.conn().execute('SELECT COUNT(*) FROM waiting_players').fetchone()[0]
+
+    def waiting_by_bucket(self):
+        return dict(self.db.conn().execute(
+            'SELECT bucket, COUNT(*) FROM waiting_players GROUP BY bucket'))
+
+    # اتاق‌ها
+    def next_room_id(self):
+        with self.transaction():
+            conn = self.db.conn()
+            conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('room', 0)")
+            value = conn.execute("SELECT value FROM counters WHERE name = 'room'").fetchone()[0]
+            conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'room'")
+            return f"room_{value}"
+
+    def insert(self, room_id, room):
+        player1, player2 = room.players
+        self.db.conn().execute(
+            'INSERT OR REPLACE INTO rooms '
+            '(room_id, data, version, player1, player2, created_at, status, expires_at) '
+            'VALUES (?, ?, 0, ?, ?, ?, ?, ?)',
+            (room_id, self._dumps(room), player1, player2, room.created_at,
+             room.status, self.expiry.deadline(room)))
+
+    def get(self, room_id):
+        row = self.db.conn().execute(
+            'SELECT data, version FROM rooms WHERE room_id = ?', (room_id,)).fetchone()
+        if row is None:
+            return None, None
+        return Room.from_dict(room_id, json.loads(row[0]), self.question_lookup), row[1]
+
+    def compare_and_set(self, room_id, expected_version, room):
+        cur = self.db.conn().execute(
+            'UPDATE rooms SET data = ?, version = version + 1, status = ?, expires_at = ? '
+            'WHERE room_id = ? AND version = ?',
+            (self._dumps(room), room.status, self.expiry.deadline(room),
+             room_id, expected_version))
+        return cur.rowcount == 1
+
+    # mutate may run more than once if another worker wins the race, so it
+    # must only depend on the room it is given.
+    def update(self, room_id, mutate):
+        while True:
+            room, version = self.get(room_id)
+            if room is None:
+                raise KeyError(room_id)
+            result = mutate(room)
+            if self.compare_and_set(room_id, version, room):
+                return result
+
+    def delete(self, room_id):
+        self.db.conn().execute('DELETE FROM rooms WHERE room_id = ?', (room_id,))
+
+    def room_of(self, player):
+        row = self.db.conn().execute(
+            'SELECT room_id FROM rooms WHERE player1 = ? UNION ALL '
+            'SELECT room_id FROM rooms WHERE player2 = ? LIMIT 1', (player, player)).fetchone()
+        return row[0] if row else None
+
+    def reap(self, now):
+        with self.transaction():
+            conn = self.db.conn()
+            reaped = conn.execute(
+                'SELECT room_id, status FROM rooms WHERE expires_at <= ?', (now,)).fetchall()
+            conn.execute('DELETE FROM rooms WHERE expires_at <= ?', (now,))
+        return reaped
+
+    def room_count(self):
+        return self.db.conn().execute('SELECT COUNT(*) FROM rooms').fetchone()[0]
+
+    def room_deadlines(self):
+        rows = self.db.conn().execute(
+            "SELECT room_id, data FROM rooms WHERE status != 'finished'").fetchall()
+        result = []
+        for room_id, data in rows:
+            data = json.loads(data)
+            result.extend((room_id, player, deadline)
+                          for player, deadline in zip(data['players'], data.get('deadlines', ())) if deadline)
+        return result
+
+    @staticmethod
+    def _dumps(room):
+        return json.dumps(room.to_dict(), ensure_ascii=False, separators=(',', ':'))
+
+
+def create_room_store(backend, expiry, path=None, question_lookup=None):
+    if backend == 'memory':
+        return InMemoryRoomStore(expiry)
+    if backend == 'sqlite':
+        return SQLiteRoomStore(path or os.path.abspath('rooms.db'), expiry, question_lookup)
+    raise ValueError(f"unknown room store backend: {backend}")
@@ -0,0 +1,95 @@
+import bisect
+import re
+
+
+# نرمال‌سازی متن فارسی برای جستجو
+# Arabic yeh/kaf become Persian ی/ک, zero-width non-joiners split words,
+# diacritics and tatweel are dropped and Persian/Arabic digits become ASCII,
+# so "كتاب‌ها", "کتاب ها" and "کتابها" all index the same way as far as
+# their tokens allow.
+_CHAR_MAP = str.maketrans({
+    '\u064a': '\u06cc', '\u0649': '\u06cc', '\u0626': '\u06cc',  # Arabic yeh forms -> Persian yeh
+    '\u0643': '\u06a9',  # Arabic kaf -> Persian kaf
+    '\u06c0': '\u0647', '\u0629': '\u0647',  # heh with yeh, teh marbuta -> heh
+    '\u0623': '\u0627', '\u0625': '\u0627', '\u0671': '\u0627',  # hamza/wasla alef -> alef
+    '\u200c': ' ', '\u200d': '', '\u0640': '',  # ZWNJ, ZWJ, tatweel
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+})
+_DIACRITICS = re.compile('[\u064b-\u065f\u0670]')
+_TOKEN = re.compile(r'\w+')
+# توکن‌های کوتاه‌تر از این در جستجو فقط با توکن کامل مطابقت دارند
+MIN_PREFIX = 3
+
+
+def normalize(text):
+    return _DIACRITICS.sub('', str(text).translate(_CHAR_MAP)).lower()
+
+
+def tokenize(text):
+    return _TOKEN.findall(normalize(text))
+
+
+# ایندکس معکوس: توکن -> مجموعه‌ی کلیدها
+# Every query token must match (AND). A query token matches every indexed
+# token it is a prefix of, found by bisecting the sorted token list. One
+# or two characters are a prefix of a large part of the vocabulary and
+# are often a whole word (در، از، 12), so a token shorter than MIN_PREFIX
+# matches only itself.
+class InvertedIndex:
+    def __init__(self):
+        self.postings = {}
+        self.sorted_tokens = []
+
+    def build(self, documents):
+        postings = {}
+        for key, text in documents:
+            for token in tokenize(text):
+                postings.setdefault(token, set()).add(key)
+        self.postings = postings
+        self.sorted_tokens = sorted(postings)
+        return self
+
+    # به‌روزرسانی یک سند بدون ساختن دوباره‌ی کل ایندکس
+    def add(self, key, text):
+        for token in set(tokenize(text)):
+            keys = self.postings.get(token)
+            if keys is None:
+                keys = self.postings[token] = set()
+                bisect.insort(self.sorted_tokens, token)
+            keys.add(key)
+
+    def remove(self, key, text):
+        for token in set(tokenize(text)):
+            keys = self.postings.get(token)
+            if keys is None:
+                continue
+            keys.discard(key)
+            if not keys:
+                del self.postings[token]
+                del self.sorted_tokens[bisect.bisect_left(self.sorted_tokens, token)]
+
+    def _matches(self, prefix):
+        if len(prefix) < MIN_PREFIX:
+            return set(self.postings.get(prefix, ()))
+        start = bisect.bisect_left(self.sorted_tokens, prefix)
+        matches = set()
+        for token in self.sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            matches |= self.postings[token]
+        return matches
+
+    def search(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        # rarest exact token first keeps the intersection small
+        tokens.sort(key=lambda t: len(self.postings.get(t, ())))
+        result = None
+        for token in tokens:
+            matches = self._matches(token)
+            result = matches if result is None else result & matches
+            if not result:
+                return set()
+        return result
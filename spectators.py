@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+
+
+# تماشای زنده‌ی مسابقه
+# Spectators never touch the room: one broadcaster thread per watched room
+# waits on the room's RoomEventHub channel like a player stream does,
+# computes the spectator state once per change with state_of(room_id),
+# serializes it once into an SSE frame and hands the same bytes to every
+# subscriber. The players' request path only pays for waking that single
+# thread, however many people watch.
+#
+# Every subscriber has its own queue of frames. One that has max_queue
+# frames still unsent (its connection is not keeping up) is dropped and
+# its stream ends, instead of the frames piling up; EventSource reconnects
+# and gets the current state. A new subscriber starts with the latest
+# frame. Frames are whole states, so a reconnect never misses anything.
+#
+# Subscribers served by a thread (WSGI) wait on a threading.Event;
+# subscribers on an asyncio loop (asgi) pass the loop, and a change wakes
+# each loop once with call_soon_threadsafe rather than once per spectator.
+# The broadcaster stops when the last spectator leaves, or after sending
+# the final state of a finished or removed room.
+KEEPALIVE_FRAME = b': keepalive\n\n'
+
+
+class Subscriber:
+    __slots__ = ('frames', 'event', 'loop', 'dropped', 'closed')
+
+    def __init__(self, loop=None):
+        self.frames = deque()
+        self.loop = loop
+        self.event = threading.Event() if loop is None else asyncio.Event()
+        # dropped: عقب ماند و حذف شد؛ closed: مسابقه تمام شد و فریم دیگری نمی‌آید
+        self.dropped = False
+        self.closed = False
+
+    def take(self):
+        frames = []
+        while self.frames:
+            frames.append(self.frames.popleft())
+        return b''.join(frames)
+
+
+class RoomChannel:
+    __slots__ = ('subscribers', 'latest', 'thread')
+
+    def __init__(self):
+        self.subscribers = set()
+        self.latest = None
+        self.thread = None
+
+
+def _set_all(events):
+    for event in events:
+        event.set()
+
+
+class SpectatorHub:
+    def __init__(self, events, state_of, max_queue=8, recheck=1.0):
+        self.events = events
+        # state_of(room_id) -> dict، یا None اگر اتاق دیگر وجود ندارد
+        self.state_of = state_of
+        self.max_queue = max_queue
+        self.recheck = recheck
+        self.lock = threading.Lock()
+        self.rooms = {}
+        self.dropped_total = 0
+
+    def subscribe(self, room_id, loop=None):
+        subscriber = Subscriber(loop)
+        with self.lock:
+            channel = self.rooms.get(room_id)
+            if channel is None:
+                channel = self.rooms[room_id] = RoomChannel()
+                channel.thread = threading.Thread(target=self._run, args=(room_id, channel),
+                                                  name=f'spectators-{room_id}', daemon=True)
+                channel.thread.start()
+            elif channel.latest is not None:
+                subscriber.frames.append(channel.latest)
+            channel.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, room_id, subscriber):
+        with self.lock:
+            channel = self.rooms.get(room_id)
+            if channel is not None:
+                channel.subscribers.discard(subscriber)
+
+    def spectators(self, room_id=None):
+        with self.lock:
+            if room_id is not None:
+                channel = self.rooms.get(room_id)
+                return len(channel.subscribers) if channel else 0
+            return sum(len(channel.subscribers) for channel in self.rooms.values())
+
+    def _run(self, room_id, channel):
+        key = f'room:{room_id}'
+        with self.events.subscribe(key):
+            while True:
+                seen = self.events.version(key)
+                final = False
+                try:
+                    state = self.state_of(room_id)
+                except Exception:
+                    logging.getLogger(__name__).exception('spectator state of %s failed', room_id)
+                else:
+                    final = state is None or state['status'] == 'finished'
+                    frame = ('data: ' + json.dumps(state if state is not None else {'status': 'gone'},
+                                                   ensure_ascii=False) + '\n\n').encode('utf-8')
+                    if frame != channel.latest:
+                        channel.latest = frame
+                        self._fan_out(channel, frame)
+                with self.lock:
+                    if final or not channel.subscribers:
+                        if self.rooms.get(room_id) is channel:
+                            del self.rooms[room_id]
+                        subscribers = list(channel.subscribers)
+                        channel.subscribers.clear()
+                        for subscriber in subscribers:
+                            subscriber.closed = True
+                        self._wake(subscribers)
+                        return
+                self.events.wait(key, seen, self.recheck)
+
+    def _fan_out(self, channel, frame):
+        with self.lock:
+            subscribers = list(channel.subscribers)
+            for subscriber in subscribers:
+                if len(subscriber.frames) >= self.max_queue:
+                    channel.subscribers.discard(subscriber)
+                    subscriber.dropped = True
+                    self.dropped_total += 1
+                else:
+                    subscriber.frames.append(frame)
+        self._wake(subscribers)
+
+    def _wake(self, subscribers):
+        loops = {}
+        for subscriber in subscribers:
+            if subscriber.loop is None:
+                subscriber.event.set()
+            else:
+                loops.setdefault(subscriber.loop, []).append(subscriber.event)
+        for loop, events in loops.items():
+            try:
+                loop.call_soon_threadsafe(_set_all, events)
+            except RuntimeError:
+                # event loop بسته شده است
+                pass
+
+    # بدنه‌ی پاسخ SSE برای WSGI: هر بار همه‌ی فریم‌های رسیده با هم نوشته می‌شوند
+    def stream(self, room_id, keepalive):
+        subscriber = self.subscribe(room_id)
+        try:
+            while not subscriber.dropped:
+                subscriber.event.clear()
+                frames = subscriber.take()
+                if frames:
+                    yield frames
+                elif subscriber.closed:
+                    return
+                elif not subscriber.event.wait(keepalive):
+                    yield KEEPALIVE_FRAME
+        finally:
+            self.unsubscribe(room_id, subscriber)
@@ -0,0 +1,67 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+# زمان‌بندی مشترک همه‌ی اتاق‌ها
+# One thread and one min-heap of (when, seq, callback, args) serve every
+# timer in the process, however many rooms are live. Timers are never
+# cancelled: a callback must check on its own whether it is still due,
+# which lets a room reschedule freely (an old entry just finds nothing to
+# do when it fires). Callbacks run one at a time on the timer thread and
+# should be short.
+class TimerScheduler:
+    def __init__(self, name='timers'):
+        self.name = name
+        self.cond = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def call_at(self, when, callback, *args):
+        with self.cond:
+            entry = (when, next(self.counter), callback, args)
+            heapq.heappush(self.heap, entry)
+            # فقط اگر زودتر از همه باشد thread باید زودتر بیدار شود
+            if self.heap[0] is entry:
+                self.cond.notify()
+
+    def pending(self):
+        return len(self.heap)
+
+    def _next_due(self):
+        with self.cond:
+            while not self.stopping:
+                if self.heap:
+                    delay = self.heap[0][0] - time.time()
+                    if delay <= 0:
+                        return heapq.heappop(self.heap)
+                else:
+                    delay = None
+                self.cond.wait(delay)
+            return None
+
+    def _run(self):
+        while True:
+            entry = self._next_due()
+            if entry is None:
+                return
+            _, _, callback, args = entry
+            try:
+                callback(*args)
+            except Exception:
+                logging.getLogger(__name__).exception('timer callback failed')
+
+    def close(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
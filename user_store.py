@@ -0,0 +1,438 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from db import ThreadLocalSQLite
+from metrics import record_file_load, record_file_save
+
+# رتبه‌ی Elo کاربری که هنوز مسابقه‌ای نداده
+DEFAULT_RATING = 1200
+
+# ذخیره‌سازی کاربران
+# Both stores return user records in the users.json shape:
+#   {'password': ..., 'scores': {'online_match': 0}, 'completed_questions': [...],
+#    'rating': 1200}
+# and offer point operations so routes never load or rewrite every user.
+# completed_questions only grows, and only the question sampler needs it:
+# SQLiteUserStore keeps it in a table of its own and leaves it out of
+# get() and search(); completed_of() returns it for one user.
+# The matchmaking rating is a field of its own rather than a score, so it
+# never counts toward a user's total; add_scores() treats the key 'rating'
+# as a rating delta.
+
+
+def _extend_completed(record, question_ids):
+    completed = record.setdefault('completed_questions', [])
+    known = set(completed)
+    for question_id in question_ids:
+        if question_id not in known:
+            known.add(question_id)
+            completed.append(question_id)
+
+
+class JsonUserStore:
+    # رفتار قدیمی: کل users.json؛ تغییرات زیر یک قفل انجام می‌شوند تا
+    # درخواست‌های هم‌زمان تغییرات یکدیگر را از بین نبرند
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+
+    def all(self):
+        if not os.path.exists(self.path) or os.stat(self.path).st_size == 0:
+            return {}
+        start = time.perf_counter()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return {}
+            finally:
+                record_file_load(self.path, os.fstat(f.fileno()).st_size, time.perf_counter() - start)
+
+    def save_all(self, users):
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(users, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.path)
+            record_file_save(self.path, os.stat(self.path).st_size)
+
+    def get(self, username):
+        return self.all().get(username)
+
+    def completed_of(self, username):
+        return (self.get(username) or {}).get('completed_questions', [])
+
+    def rating(self, username):
+        record = self.get(username)
+        return record.get('rating', DEFAULT_RATING) if record else DEFAULT_RATING
+
+    # فهرست صفحه‌بندی‌شده‌ی کاربران با جستجوی پیشوندی نام کاربری
+    def search(self, prefix='', offset=0, limit=50):
+        users = self.all()
+        names = sorted(name for name in users if name.startswith(prefix))
+        return len(names), [(name, users[name]) for name in names[offset:offset + limit]]
+
+    def count(self):
+        return len(self.all())
+
+    # (username, امتیاز key) برای همه‌ی کاربران، برای ساختن جدول امتیازات
+    def scores_of(self, key):
+        return [(username, record.get('scores', {}).get(key, 0))
+                for username, record in self.all().items()]
+
+    def create(self, username, record):
+        with self.lock:
+            users = self.all()
+            if username in users:
+                return False
+            users[username] = record
+            self.save_all(users)
+            return True
+
+    def set_password(self, username, password_hash):
+        with self.lock:
+            users = self.all()
+            if username not in users:
+                return False
+            users[username]['password'] = password_hash
+            self.save_all(users)
+            return True
+
+    # increments: {username: {score_key: delta}}
+    def add_scores(self, increments):
+        with self.lock:
+            users = self.all()
+            for username, deltas in increments.items():
+                if username not in users:
+                    continue
+                record = users[username]
+                scores = record.setdefault('scores', {})
+                for key, delta in deltas.items():
+                    if key == 'rating':
+                        record['rating'] = record.get('rating', DEFAULT_RATING) + delta
+                    else:
+                        scores[key] = scores.get(key, 0) + delta
+            self.save_all(users)
+
+    # completed: {username: [question_id]}؛ به completed_questions اضافه می‌شوند
+    def add_completed(self, completed):
+        with self.lock:
+            users = self.all()
+            for username, question_ids in completed.items():
+                if username in users:
+                    _extend_completed(users[username], question_ids)
+            self.save_all(users)
+
+
+class SQLiteUserStore:
+    # هر کاربر یک ردیف؛ امتیازها در جدول جدا تا افزایش امتیاز یک UPDATE اتمی باشد.
+    # Fields other than password, scores and rating are kept as JSON in `extra`.
+    def __init__(self, path, legacy_json_path=None, busy_timeout=5.0):
+        self.path = path
+        self.db = ThreadLocalSQLite(path, busy_timeout)
+        self._init_schema()
+        if legacy_json_path:
+            self.migrate_from_json(legacy_json_path)
+
+    def _init_schema(self):
+        self.db.conn().executescript('''
+            CREATE TABLE IF NOT EXISTS users (
+                username TEXT PRIMARY KEY,
+                password TEXT NOT NULL,
+                extra TEXT NOT NULL DEFAULT '{}',
+                rating INTEGER NOT NULL DEFAULT 1200
+            );
+            CREATE TABLE IF NOT EXISTS user_scores (
+                username TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (username, key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS completed_questions (
+                username TEXT NOT NULL,
+                question_id TEXT NOT NULL,
+                PRIMARY KEY (username, question_id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS meta (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        ''')
+        columns = {row[1] for row in self.db.conn().execute('PRAGMA table_info(users)')}
+        if 'rating' not in columns:
+            self.db.conn().execute(
+                f'ALTER TABLE users ADD COLUMN rating INTEGER NOT NULL DEFAULT {DEFAULT_RATING}')
+        self._split_completed()
+
+    # completed_questions پایگاه‌های قدیمی در ستون extra بود؛ یک بار به جدول خودش منتقل می‌شود
+    def _split_completed(self):
+        with self.db.transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE name = 'completed_split'").fetchone():
+                return
+            rows = conn.execute(
+                "SELECT username, extra FROM users WHERE extra LIKE '%completed_questions%'").fetchall()
+            for username, extra in rows:
+                extra = json.loads(extra)
+                conn.executemany(
+                    'INSERT OR IGNORE INTO completed_questions (username, question_id) VALUES (?, ?)',
+                    [(username, question_id) for question_id in extra.pop('completed_questions', [])])
+                conn.execute('UPDATE users SET extra = ? WHERE username = ?',
+                             (json.dumps(extra, ensure_ascii=False), username))
+            conn.execute("INSERT INTO meta (name, value) VALUES ('completed_split', '1')")
+
+    # انتقال یک‌باره از users.json؛ فایل اصلی دست نمی‌خورد
+    def migrate_from_json(self, json_path):
+        with self.db.transaction() as conn:
+            if conn.execute("SELECT 1 FROM meta WHERE name = 'json_migrated'").fetchone():
+                return False
+            users = JsonUserStore(json_path).all()
+            self._insert_all(conn, users)
+            conn.execute("INSERT INTO meta (name, value) VALUES ('json_migrated', ?)",
+                         (json_path,))
+            return True
+
+    def _insert_all(self, conn, users):
+        for username, record in users.items():
+            extra = {k: v for k, v in record.items()
+                     if k not in ('password', 'scores', 'rating', 'completed_questions')}
+            conn.execute(
+                'INSERT OR REPLACE INTO users (username, password, extra, rating) VALUES (?, ?, ?, ?)',
+                (username, record['password'], json.dumps(extra, ensure_ascii=False),
+                 record.get('rating', DEFAULT_RATING)))
+            conn.executemany(
+                'INSERT OR REPLACE INTO user_scores (username, key, value) VALUES (?, ?, ?)',
+                [(username, key, value) for key, value in record.get('scores', {}).items()])
+            conn.executemany(
+                'INSERT OR IGNORE INTO completed_questions (username, question_id) VALUES (?, ?)',
+                [(username, question_id) for question_id in record.get('completed_questions', [])])
+
+    @staticmethod
+    def _record(password, extra, scores, rating):
+        record = {'password': password, 'scores': scores}
+        record.update(json.loads(extra))
+        record['rating'] = rating
+        return record
+
+    # همه‌ی کاربران به شکل کامل users.json، همراه با completed_questions
+    def all(self):
+        conn = self.db.conn()
+        scores = {}
+        for username, key, value in conn.execute('SELECT username, key, value FROM user_scores'):
+            scores.setdefault(username, {})[key] = value
+        completed = {}
+        for username, question_id in conn.execute('SELECT username, question_id FROM completed_questions'):
+            completed.setdefault(username, []).append(question_id)
+        users = {}
+        for username, password, extra, rating in conn.execute(
+                'SELECT username, password, extra, rating FROM users ORDER BY rowid'):
+            users[username] = self._record(password, extra, scores.get(username, {}), rating)
+            users[username]['completed_questions'] = completed.get(username, [])
+        return users
+
+    def save_all(self, users):
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM completed_questions')
+            conn.execute('DELETE FROM user_scores')
+            conn.execute('DELETE FROM users')
+            self._insert_all(conn, users)
+
+    def get(self, username):
+        conn = self.db.conn()
+        row = conn.execute('SELECT password, extra, rating FROM users WHERE username = ?',
+                           (username,)).fetchone()
+        if row is None:
+            return None
+        scores = dict(conn.execute('SELECT key, value FROM user_scores WHERE username = ?',
+                                   (username,)))
+        return self._record(row[0], row[1], scores, row[2])
+
+    def completed_of(self, username):
+        return [row[0] for row in self.db.execute(
+            'SELECT question_id FROM completed_questions WHERE username = ?', (username,))]
+
+    def rating(self, username):
+        row = self.db.execute('SELECT rating FROM users WHERE username = ?', (username,)).fetchone()
+        return row[0] if row else DEFAULT_RATING
+
+    def count(self):
+        return self.db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def scores_of(self, key):
+        return self.db.execute(
+            'SELECT u.username, COALESCE(s.value, 0) FROM users u '
+            'LEFT JOIN user_scores s ON s.username = u.username AND s.key = ?', (key,)).fetchall()
+
+    # جستجوی پیشوندی روی کلید اصلی؛ فقط کاربران همین صفحه خوانده می‌شوند
+    def search(self, prefix='', offset=0, limit=50):
+        conn = self.db.conn()
+        bounds = (prefix, prefix + '\U0010ffff')
+        total = conn.execute('SELECT COUNT(*) FROM users WHERE username >= ? AND username < ?',
+                             bounds).fetchone()[0]
+        rows = conn.execute(
+            'SELECT username, password, extra, rating FROM users WHERE username >= ? AND username < ? '
+            'ORDER BY username LIMIT ? OFFSET ?', bounds + (limit, offset)).fetchall()
+        scores = {}
+        if rows:
+            placeholders = ','.join('?' * len(rows))
+            for username, key, value in conn.execute(
+                    f'SELECT username, key, value FROM user_scores WHERE username IN ({placeholders})',
+                    [row[0] for row in rows]):
+                scores.setdefault(username, {})[key] = value
+        return total, [(username, self._record(password, extra, scores.get(username, {}), rating))
+                       for username, password, extra, rating in rows]
+
+    def create(self, username, record):
+        with self.db.transaction() as conn:
+            if conn.execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone():
+                return False
+            self._insert_all(conn, {username: record})
+            return True
+
+    def set_password(self, username, password_hash):
+        cur = self.db.execute('UPDATE users SET password = ? WHERE username = ?',
+                              (password_hash, username))
+        return cur.rowcount == 1
+
+    # increments: {username: {score_key: delta}}؛ همه در یک تراکنش
+    def add_scores(self, increments):
+        with self.db.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO user_scores (username, key, value) '
+                'SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE username = ?) '
+                'ON CONFLICT (username, key) DO UPDATE SET value = value + excluded.value',
+                [(username, key, delta, username)
+                 for username, deltas in increments.items()
+                 for key, delta in deltas.items() if key != 'rating'])
+            conn.executemany(
+                'UPDATE users SET rating = rating + ? WHERE username = ?',
+                [(deltas['rating'], username)
+                 for username, deltas in increments.items() if 'rating' in deltas])
+
+    # فقط ردیف‌های تازه نوشته می‌شوند؛ سؤال تکراری را کلید اصلی نادیده می‌گیرد
+    def add_completed(self, completed):
+        with self.db.transaction() as conn:
+            conn.executemany(
+                'INSERT OR IGNORE INTO completed_questions (username, question_id) '
+                'SELECT ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE username = ?)',
+                [(username, question_id, username)
+                 for username, question_ids in completed.items() for question_id in question_ids])
+
+
+# نوشتن تأخیری امتیازها
+# Finished matches hand their score increments to this queue. Increments
+# are merged per user and written in one add_scores() call every
+# flush_interval seconds, or sooner once max_batch matches are pending.
+# Pending scores are flushed on interpreter exit. Answered question ids
+# (add_completed) ride along and are appended to completed_questions in the
+# same flush.
+class ScoreWriter:
+    def __init__(self, store, flush_interval=0.5, max_batch=100):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        self.pending_matches = 0
+        self.pending_completed = {}
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='score-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def _merge(self, increments):
+        for username, deltas in increments.items():
+            scores = self.pending.setdefault(username, {})
+            for key, delta in deltas.items():
+                scores[key] = scores.get(key, 0) + delta
+
+    def add(self, increments):
+        with self.cond:
+            self._merge(increments)
+            self.pending_matches += 1
+            if self.pending_matches >= self.max_batch:
+                self.cond.notify()
+
+    def _merge_completed(self, completed):
+        for username, question_ids in completed.items():
+            self.pending_completed.setdefault(username, []).extend(question_ids)
+
+    def add_completed(self, username, question_ids):
+        with self.cond:
+            self._merge_completed({username: question_ids})
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.stopping or self.pending_matches >= self.max_batch,
+                                   self.flush_interval)
+                if self.stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logging.getLogger(__name__).exception('score flush failed')
+
+    # {username: امتیاز key} که هنوز در صف است و نوشته نشده
+    def pending_of(self, key):
+        with self.cond:
+            return {username: scores[key] for username, scores in self.pending.items() if key in scores}
+
+    # صف را می‌نویسد و تا پایان بلوک چیز دیگری نمی‌نویسد؛ امتیازهایی که در این
+    # فاصله برسند در pending_of() می‌مانند و در خواندن store نیستند
+    @contextmanager
+    def holding(self):
+        with self.flush_lock:
+            self._write_pending()
+            yield
+
+    def flush(self):
+        with self.flush_lock:
+            self._write_pending()
+
+    def _write_pending(self):
+        with self.cond:
+            batch, completed = self.pending, self.pending_completed
+            self.pending = {}
+            self.pending_matches = 0
+            self.pending_completed = {}
+        if batch:
+            try:
+                self.store.add_scores(batch)
+            except Exception:
+                # برای تلاش بعدی به صف برمی‌گردد
+                with self.cond:
+                    self._merge(batch)
+                    self._merge_completed(completed)
+                raise
+        if completed:
+            try:
+                self.store.add_completed(completed)
+            except Exception:
+                with self.cond:
+                    self._merge_completed(completed)
+                raise
+
+    def close(self):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+
+def create_user_store(backend, json_path, db_path=None):
+    if backend == 'json':
+        return JsonUserStore(json_path)
+    if backend == 'sqlite':
+        return SQLiteUserStore(db_path or os.path.abspath('users.db'), legacy_json_path=json_path)
+    raise ValueError(f"unknown user store backend: {backend}")